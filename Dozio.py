@@ -1,28 +1,66 @@
 import asyncio
 from aiogram import Bot, Dispatcher, types, F
-from aiogram.types import ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardMarkup, InlineKeyboardButton
+from aiogram.types import (
+    ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardMarkup, InlineKeyboardButton,
+    InlineQueryResultArticle, InputTextMessageContent, FSInputFile,
+)
 from aiogram.fsm.context import FSMContext
-from aiogram.fsm.storage.memory import MemoryStorage
-from aiogram.filters import Command
+from aiogram.filters import Command, CommandObject, CommandStart
 from aiogram.fsm.state import StatesGroup, State
 
-from config import BOT_TOKEN
-from database import (
+from config import BOT_TOKEN, BOT_MODE, MAX_CONCURRENT_UPDATES, ALLOW_NEW_TENANTS, WORKERS, require_bot_token
+from middlewares import UserMiddleware, ConcurrencyLimitMiddleware, UpdateMetricsMiddleware, HandlerMetricsMiddleware
+from scheduler import ReminderScheduler
+from retention import ReportArchiver
+from notifications import Notifier
+from outbox import GLOBAL_RATE, OutboundQueue, bulk
+import metrics
+from webhook import run_webhook
+from fsm_storage import SQLiteStorage
+import timeutil
+import team_import
+import export
+import tenants
+import notifications
+import attachments
+from attachments import AlbumCollector
+from stats import stats_text
+from hierarchy import ORG_PAGE_SIZE, can_manage, org_tree, page_rows, render_node
+from pagination import PAGE_SIZE, answer_long, build_page, keyset_args, offset_window, parse_callback, truncate
+from async_database import (
+    close as close_db,
+    user_cache,
     init_db,
-    get_user_by_telegram_id,
     get_user_by_username,
+    get_pending_users_by_username,
     create_user,
     get_tasks_for_user,
     create_report,
-    create_task,
+    create_tasks,
+    get_task_groups,
+    get_pending_in_groups,
     get_reports_for_supervisor,
     rate_report,
-    get_team_users,
-    get_all_users_by_role,
+    get_assignees,
+    filter_assignees,
+    count_tenants,
+    create_tenant,
+    accept_invite,
     get_reports_for_user,
+    get_archived_report,
+    get_archived_reports_for_user,
+    get_report,
+    get_report_attachments,
+    search,
+    get_tasks_due,
+    import_users,
+    set_notify_mode,
+    mark_task_done,
+    get_active_task,
 )
-from datetime import datetime
-import jdatetime
+import io
+import os
+import sqlite3
 import logging
 
 logging.basicConfig(level=logging.INFO)
@@ -32,7 +70,9 @@ def admin_menu():
     kb = [
         [KeyboardButton(text="➕ افزودن مدیر میانی"), KeyboardButton(text="➕ تعریف تسک")],
         [KeyboardButton(text="📥 مشاهده گزارش‌ها"), KeyboardButton(text="🗂 مشاهده تسک‌های فعال")],
-        [KeyboardButton(text="👥 لیست کاربران")]
+        [KeyboardButton(text="👥 لیست کاربران"), KeyboardButton(text="⏰ سررسیدها")],
+        [KeyboardButton(text="📤 ورود گروهی از فایل"), KeyboardButton(text="📦 تسک‌های گروهی")],
+        [KeyboardButton(text="🔗 لینک دعوت")]
     ]
     return ReplyKeyboardMarkup(keyboard=kb, resize_keyboard=True)
 
@@ -40,23 +80,307 @@ def manager_menu():
     kb = [
         [KeyboardButton(text="➕ افزودن کاربر"), KeyboardButton(text="➕ تعریف تسک")],
         [KeyboardButton(text="📝 ثبت گزارش برای مدیر"), KeyboardButton(text="📥 مشاهده گزارش‌ها")],
-        [KeyboardButton(text="🗂 مشاهده تسک‌های فعال"), KeyboardButton(text="👥 لیست اعضای تیم")]
+        [KeyboardButton(text="🗂 مشاهده تسک‌های فعال"), KeyboardButton(text="👥 لیست اعضای تیم")],
+        [KeyboardButton(text="⏰ سررسیدها"), KeyboardButton(text="📤 ورود گروهی از فایل")],
+        [KeyboardButton(text="📦 تسک‌های گروهی"), KeyboardButton(text="🔗 لینک دعوت")]
     ]
     return ReplyKeyboardMarkup(keyboard=kb, resize_keyboard=True)
 
 def member_menu():
     kb = [
         [KeyboardButton(text="🗂 مشاهده تسک‌های فعال"), KeyboardButton(text="📝 ارسال گزارش")],
-        [KeyboardButton(text="📥 مشاهده گزارش‌های من")]
+        [KeyboardButton(text="📥 مشاهده گزارش‌های من"), KeyboardButton(text="⏰ سررسیدها")]
     ]
     return ReplyKeyboardMarkup(keyboard=kb, resize_keyboard=True)
 
+def menu_for(user):
+    if user['role'] == 'admin':
+        return admin_menu()
+    if user['role'] == 'manager':
+        return manager_menu()
+    return member_menu()
+
 def cancel_menu():
     return ReplyKeyboardMarkup(keyboard=[[KeyboardButton(text="❌ کنسل")]], resize_keyboard=True)
 
 def cancel_menu():
     return ReplyKeyboardMarkup(keyboard=[[CANCEL_BTN]], resize_keyboard=True)
 
+# --- نمایش فیدها (صفحه‌بندی شده)
+def format_task(task):
+    if task["reminder_type"] == "hour":
+        rem = f"یادآوری هر {task['reminder_value']} ساعت"
+    elif task["reminder_type"] == "day":
+        rem = f"یادآوری هر {task['reminder_value']} روز"
+    else:
+        rem = "یادآوری فقط روز ددلاین"
+    return (
+        f"📌 {task['title']}\n"
+        f"📝 {task['description']}\n"
+        f"⏰ مهلت: {timeutil.jalali_date(task['deadline'])}\n"
+        f"⏱ {rem}\n\n"
+    )
+
+def format_active_task(task):
+    text = format_task(task)
+    if task['reports']:
+        text = text[:-1] + f"💬 {task['reports']} گزارش روی این تسک\n\n"
+    return text
+
+def task_buttons(task):
+    return [
+        InlineKeyboardButton(text="✅ " + truncate(task['title'], 24), callback_data=f"tsk:done:{task['id']}"),
+        InlineKeyboardButton(text="📝 گزارش", callback_data=f"tsk:rep:{task['id']}"),
+    ]
+
+def task_line(rep):
+    return f"📌 تسک: {rep['task_title']}\n" if rep['task_title'] else ""
+
+def attachments_line(rep):
+    return f"📎 {rep['attachments']} پیوست\n" if rep['attachments'] else ""
+
+def attachment_buttons(rep):
+    if not rep['attachments']:
+        return []
+    label = f"📎 {rep['attachments']} پیوست — {timeutil.jalali_datetime(rep['timestamp'])}"
+    return [InlineKeyboardButton(text=label, callback_data=f"att:{rep['id']}")]
+
+def format_report(rep):
+    return (
+        f"🆔 Report ID: {rep['id']}\n"
+        f"👤 کاربر: {rep['name']}\n"
+        f"{task_line(rep)}"
+        f"📝 {rep['content']}\n"
+        f"{attachments_line(rep)}"
+        f"📅 {timeutil.jalali_datetime(rep['timestamp'])}\n"
+        f"⭐ امتیاز: {rep['score'] or 'ندارد'}\n\n"
+    )
+
+def format_my_report(rep):
+    return (
+        f"{task_line(rep)}"
+        f"📝 {rep['content']}\n"
+        f"{attachments_line(rep)}"
+        f"📅 {timeutil.jalali_datetime(rep['timestamp'])}\n"
+        f"⭐ امتیاز: {rep['score'] or 'ندارد'}\n\n"
+    )
+
+async def tasks_page(telegram_id, direction=None, cursor=None):
+    tasks = await get_tasks_for_user(telegram_id, limit=PAGE_SIZE + 1, **keyset_args(False, direction, cursor))
+    if not tasks:
+        return None
+    return build_page(
+        tasks, format_active_task, "pg:tsk", direction, item_buttons=task_buttons,
+        header="📋 تسک‌های شما:\n\n", footer="با دکمه‌ها تسک را انجام‌شده بزنید یا برایش گزارش بفرستید.",
+    )
+
+async def reports_page(user, direction=None, cursor=None):
+    kwargs = keyset_args(True, direction, cursor)
+    if user['role'] == 'admin':
+        reports = await get_reports_for_supervisor(user['id'], all_admin=True, limit=PAGE_SIZE + 1, **kwargs)
+    else:
+        reports = await get_reports_for_supervisor(user['id'], limit=PAGE_SIZE + 1, **kwargs)
+    if not reports:
+        return None
+    return build_page(
+        reports, format_report, "pg:rep", direction, item_buttons=attachment_buttons,
+        header="📊 لیست گزارش‌ها:\n\n",
+        footer="برای امتیاز دادن، دستور زیر را وارد کنید:\n/score <report_id>",
+    )
+
+async def my_reports_page(user, direction=None, cursor=None):
+    reports = await get_reports_for_user(user['id'], limit=PAGE_SIZE + 1, **keyset_args(True, direction, cursor))
+    if not reports:
+        return None
+    return build_page(
+        reports, format_my_report, "pg:my", direction, item_buttons=attachment_buttons,
+        header="📥 گزارش‌های ثبت‌شده شما:\n\n",
+    )
+
+async def archive_page(user_id, name, direction=None, cursor=None):
+    reports = await get_archived_reports_for_user(user_id, limit=PAGE_SIZE + 1, **keyset_args(True, direction, cursor))
+    if not reports:
+        return None
+    return build_page(
+        reports, format_my_report, "pg:arc", direction, item_buttons=attachment_buttons,
+        header=f"🗄 گزارش‌های آرشیوشده‌ی {name}:\n\n",
+    )
+
+def format_search_hit(hit):
+    if hit['kind'] == 'report':
+        title = f"📝 گزارش {hit['item_id']}"
+    else:
+        title = f"📌 تسک {hit['item_id']}" + (" ✅" if hit['is_done'] else "")
+    return (
+        f"{title} — 👤 {hit['name']}\n"
+        f"{hit['snippet']}\n"
+        f"📅 {timeutil.jalali_date(hit['at'])}\n\n"
+    )
+
+async def search_page(user, query, direction=None, cursor=None):
+    offset, count = offset_window(direction, cursor)
+    scope_id = None if user['role'] == 'admin' else user['id']
+    hits = await search(query, scope_id, user['tenant_id'], limit=count, offset=offset)
+    if not hits:
+        return None
+    rows = [{**dict(hit), 'id': offset + i} for i, hit in enumerate(hits)]
+    return build_page(rows, format_search_hit, "pg:srch", direction, header=f"🔎 نتایج جستجوی «{query}»:\n\n")
+
+# تلگرام حداکثر ۱۰۰ دکمه در یک کیبورد و ۵۰ نتیجه در هر پاسخ inline query می‌پذیرد
+ASSIGNEE_PAGE_SIZE = 20
+INLINE_RESULTS = 50
+
+async def assignee_picker(user, direction=None, cursor=None, selected=None):
+    """کیبورد یک صفحه از دریافت‌کننده‌های مجاز user؛ selected=None انتخاب تکی، وگرنه حالت چندانتخابی
+
+    اگر دریافت‌کننده‌ای نباشد None برمی‌گرداند.
+    """
+    rows = await get_assignees(user['role'], user['id'], limit=ASSIGNEE_PAGE_SIZE + 1,
+                               **keyset_args(False, direction, cursor))
+    if direction == 'b':
+        has_prev, has_next = len(rows) > ASSIGNEE_PAGE_SIZE, True
+        rows = rows[-ASSIGNEE_PAGE_SIZE:]
+    else:
+        has_prev, has_next = direction == 'f', len(rows) > ASSIGNEE_PAGE_SIZE
+        rows = rows[:ASSIGNEE_PAGE_SIZE]
+    if not rows:
+        return None
+    if selected is None:
+        prefix = "assign_mgr_" if user['role'] == 'admin' else "assign_mem_"
+        keyboard = [[InlineKeyboardButton(text=r['name'], callback_data=f"{prefix}{r['id']}")] for r in rows]
+    else:
+        keyboard = [
+            [InlineKeyboardButton(text=("✅ " if r['id'] in selected else "⬜ ") + r['name'], callback_data=f"assign_tgl_{r['id']}")]
+            for r in rows
+        ]
+    nav = []
+    if has_prev:
+        nav.append(InlineKeyboardButton(text="◀️ قبلی", callback_data=f"assign_pg:b:{rows[0]['id']}"))
+    if has_next:
+        nav.append(InlineKeyboardButton(text="بعدی ▶️", callback_data=f"assign_pg:f:{rows[-1]['id']}"))
+    if nav:
+        keyboard.append(nav)
+    # جستجوی نام با inline mode در همین چت؛ نتیجه‌ی انتخاب‌شده یک پیام «👤 نام #id» است
+    keyboard.append([InlineKeyboardButton(text="🔎 جستجوی نام", switch_inline_query_current_chat="")])
+    if selected is not None:
+        keyboard.append([InlineKeyboardButton(text=f"✔️ ثبت برای {len(selected)} نفر", callback_data="assign_done")])
+    elif len(rows) > 1 or nav:
+        keyboard.append([
+            InlineKeyboardButton(text="👥 همه", callback_data="assign_all"),
+            InlineKeyboardButton(text="☑️ انتخاب چندتایی", callback_data="assign_multi"),
+        ])
+    return InlineKeyboardMarkup(inline_keyboard=keyboard)
+
+async def notify_assignees(bot, tasks):
+    """اعلان تسک جدید به دریافت‌کننده‌ها؛ با اولویت پایین از صف خروجی (همزمان و با رعایت محدودیت نرخ)"""
+    targets = [task for task in tasks if task['user_telegram_id']]
+    with bulk():
+        results = await asyncio.gather(*(
+            bot.send_message(task['user_telegram_id'], "🆕 تسک جدید برای شما ثبت شد:\n\n" + format_task(task))
+            for task in targets
+        ), return_exceptions=True)
+    failed = sum(isinstance(r, Exception) for r in results)
+    if failed:
+        logging.warning("task notification failed for %d of %d assignees", failed, len(targets))
+
+async def save_assigned_task(message, state, user, scheduler, assignee_ids):
+    """ثبت تسک گفتگو برای assignee_ids (که قبلاً بررسی شده‌اند)؛ تسک‌های ساخته‌شده را برمی‌گرداند"""
+    data = await state.get_data()
+    _, tasks = await create_tasks(
+        assignee_ids,
+        title=data['title'],
+        description=data['description'],
+        assigned_by=user['id'],
+        deadline=data['deadline'],
+        reminder_type=data['reminder_type'],
+        reminder_value=data['reminder_value'],
+        is_urgent=0,
+        created_at=timeutil.now()
+    )
+    for task in tasks:
+        scheduler.schedule(task)
+    if len(tasks) == 1:
+        done_text = "✅ تسک با موفقیت ثبت شد."
+    else:
+        done_text = f"✅ تسک برای {len(tasks)} نفر ثبت شد. پیشرفت آن در «📦 تسک‌های گروهی» قابل پیگیری است."
+    await message.answer(done_text, reply_markup=manager_menu() if user['role'] == 'manager' else admin_menu())
+    await state.clear()
+    return tasks
+
+REPORT_PROMPT = "گزارش خود را بفرستید: متن، یا عکس، ویدیو، فایل یا پیام صوتی (توضیح را در کپشن بنویسید)."
+
+async def save_report(messages, state, user, notifier, done_text, prefix=""):
+    """ثبت یک گزارش از یک پیام یا همه‌ی پیام‌های یک آلبوم
+
+    اگر نه متن دارد نه پیوست قابل ثبت، استیت می‌ماند تا کاربر دوباره بفرستد.
+    """
+    content, files = attachments.collect(messages)
+    if not content and not files:
+        await messages[0].answer("این نوع پیام قابل ثبت نیست.\n" + REPORT_PROMPT)
+        return
+    # گزارشی که از دکمه‌ی «📝 گزارش» یک تسک شروع شده به همان تسک وصل می‌شود
+    task_id = (await state.get_data()).get('report_task_id')
+    await create_report(
+        task_id=task_id, user_id=user['id'], content=prefix + content, timestamp=timeutil.now(), attachments=files
+    )
+    notifier.report(user)
+    if files:
+        done_text += f" (📎 {len(files)} پیوست)"
+    await messages[0].answer(done_text, reply_markup=menu_for(user))
+    await state.clear()
+
+async def task_groups_text(user):
+    groups = await get_task_groups(user['id'])
+    if not groups:
+        return None
+    pending = {}
+    for row in await get_pending_in_groups([g['id'] for g in groups]):
+        pending.setdefault(row['group_id'], []).append(row['name'])
+    text = "📦 تسک‌های گروهی اخیر شما:\n\n"
+    for g in groups:
+        text += f"📌 {g['title']} — ✅ {g['done']}/{g['total']} — {timeutil.jalali_date(g['created_at'])}\n"
+        names = pending.get(g['id'], [])
+        if names:
+            more = f" و {len(names) - 10} نفر دیگر" if len(names) > 10 else ""
+            text += "    ⏳ " + "، ".join(names[:10]) + more + "\n"
+        text += "\n"
+    return text
+
+def format_due(task):
+    return f"• {task['title']} — 👤 {task['user_name']} — 📅 {timeutil.jalali_date(task['deadline'])}\n"
+
+async def deadlines_text(user, days=7, limit=50):
+    """تسک‌های عقب‌افتاده و تسک‌هایی که تا days روز آینده سررسید می‌شوند"""
+    scope_id = None if user['role'] == 'admin' else user['id']
+    today = timeutil.day_start(timeutil.now())
+    overdue = await get_tasks_due(end=today, scope_id=scope_id, tenant_id=user['tenant_id'], limit=limit)
+    upcoming = await get_tasks_due(start=today, end=timeutil.add_days(today, days), scope_id=scope_id,
+                                   tenant_id=user['tenant_id'], limit=limit)
+    if not overdue and not upcoming:
+        return None
+    text = ""
+    if overdue:
+        text += "⚠️ تسک‌های عقب‌افتاده:\n" + "".join(format_due(t) for t in overdue)
+        if len(overdue) == limit:
+            text += "…\n"
+        text += "\n"
+    if upcoming:
+        text += f"📆 سررسید تا {days} روز آینده:\n" + "".join(format_due(t) for t in upcoming)
+        if len(upcoming) == limit:
+            text += "…\n"
+    return text
+
+async def org_page(user, direction=None, cursor=None):
+    tree = await org_tree(user)
+    if len(tree) <= (0 if user['role'] == 'admin' else 1):
+        return None
+    rows, direction = page_rows(tree, direction, cursor)
+    if user['role'] == 'admin':
+        header = "👥 ساختار سازمان:\n\n"
+    else:
+        header = "👥 اعضای تیم و زیرتیم‌ها:\n\n"
+    return build_page(rows, render_node, "pg:org", direction, limit=ORG_PAGE_SIZE, header=header)
+
 # --- استیت‌ها
 class AddManagerState(StatesGroup):
     waiting_for_id = State()
@@ -81,35 +405,74 @@ class TaskCreation(StatesGroup):
     waiting_for_reminder = State()
     waiting_for_assignee = State()
 
+class ImportState(StatesGroup):
+    waiting_for_file = State()
+
 class ScoreState(StatesGroup):
     waiting_for_report_id = State()
     waiting_for_score = State()
 
-async def main():
-    init_db()
-    bot = Bot(token=BOT_TOKEN)
-    dp = Dispatcher(storage=MemoryStorage())
+def create_dispatcher(bot, storage=None):
+    """Dispatcher با همه‌ی هندلرها و middlewareها؛ زمان‌بند یادآوری در dp["scheduler"]
+    و اعلان‌های سرپرست در dp["notifier"] است
+
+    bot فقط برای این دو لازم است؛ benchmark.py همین تابع را با یک session
+    بدون شبکه صدا می‌زند.
+    """
+    dp = Dispatcher(storage=storage or SQLiteStorage())
+    if BOT_MODE == 'webhook':
+        # در حالت polling همین محدودیت با tasks_concurrency_limit اعمال می‌شود
+        dp.update.outer_middleware(ConcurrencyLimitMiddleware(MAX_CONCURRENT_UPDATES))
+    dp.update.outer_middleware(UpdateMetricsMiddleware())
+    dp.update.outer_middleware(UserMiddleware())
+    dp.message.middleware(HandlerMetricsMiddleware())
+    dp.callback_query.middleware(HandlerMetricsMiddleware())
+    dp.inline_query.middleware(HandlerMetricsMiddleware())
+    scheduler = ReminderScheduler(bot)
+    dp["scheduler"] = scheduler
+    dp["notifier"] = Notifier(bot)
+    dp["albums"] = AlbumCollector()
 
-    @dp.message(Command("start"))
-    async def handle_start(message: types.Message, state: FSMContext):
+    @dp.message(CommandStart())
+    async def handle_start(message: types.Message, state: FSMContext, user, command: CommandObject):
         telegram_id = message.from_user.id
         username = message.from_user.username or ""
         name = message.from_user.full_name
-        user = get_user_by_telegram_id(telegram_id)
-        if not user:
-            # اگر اولین بار است می‌آید، مدیر اصلی می‌شود (اولین نفر)
-            if not get_all_users_by_role('admin'):
-                create_user(telegram_id, username, name, role="admin")
+        token = tenants.parse_invite(command.args)
+        if not user and token:
+            # لینک دعوت (deep link): سازمان، نقش و سرپرست از روی دعوت
+            invite = await accept_invite(token, telegram_id, username, name, timeutil.now())
+            if invite is None:
+                await message.answer("❌ این لینک دعوت نامعتبر یا منقضی شده است. از مدیرتان لینک تازه بگیرید.")
+                return
+            if invite is False:
+                await message.answer("این حساب تلگرام عضو سازمان دیگری است.")
+                return
+            await message.answer(f"✅ به سازمان «{invite['tenant_name']}» پیوستی.")
+            role = invite['role']
+        elif not user:
+            # اگر فقط username ثبت شده بوده و الان کاربر با ربات چت کرد، username و telegram_id را آپدیت کن
+            pending = await get_pending_users_by_username(username)
+            if len(pending) > 1:
+                # یوزرنیم در چند سازمان منتظر است؛ سازمان درست را فقط لینک دعوت مشخص می‌کند
+                await message.answer("یوزرنیم شما در بیش از یک سازمان ثبت شده است. "
+                                     "لینک دعوت سازمان خودتان را از مدیرتان بگیرید و آن را باز کنید.")
+                return
+            if pending:
+                user_by_username = pending[0]
+                await create_user(telegram_id, username, name, role=user_by_username['role'],
+                                  supervisor_id=user_by_username['supervisor_id'], tenant_id=user_by_username['tenant_id'])
+                role = user_by_username['role']
+            elif not await count_tenants():
+                # اولین کاربر ربات، مدیر اصلی اولین سازمان می‌شود
+                await create_tenant(f"سازمان {name}", telegram_id, username, name, timeutil.now())
                 role = "admin"
             else:
-                # اگر فقط username ثبت شده بوده و الان کاربر با ربات چت کرد، username و telegram_id را آپدیت کن
-                user_by_username = get_user_by_username(username)
-                if user_by_username:
-                    create_user(telegram_id, username, name, role=user_by_username['role'], supervisor_id=user_by_username['supervisor_id'])
-                    role = user_by_username['role']
-                else:
-                    create_user(telegram_id, username, name, role="member")
-                    role = "member"
+                text = "برای عضویت، لینک دعوت را از مدیرتان بگیرید و آن را باز کنید."
+                if ALLOW_NEW_TENANTS:
+                    text += "\nبرای ساختن سازمان تازه که خودتان مدیر اصلی آن باشید:\n/neworg <نام سازمان>"
+                await message.answer(text)
+                return
         else:
             role = user['role']
 
@@ -121,8 +484,7 @@ async def main():
             await message.answer("سلام! خوش اومدی. از منوی زیر استفاده کن:", reply_markup=member_menu())
 
     @dp.message(F.text == CANCEL_BTN.text)
-    async def cancel_anytime(message: types.Message, state: FSMContext):
-        user = get_user_by_telegram_id(message.from_user.id)
+    async def cancel_anytime(message: types.Message, state: FSMContext, user):
         if user:
             if user['role'] == 'admin':
                 await message.answer("عملیات لغو شد.", reply_markup=admin_menu())
@@ -136,8 +498,7 @@ async def main():
 
     # --- افزودن مدیر میانی
     @dp.message(F.text == "➕ افزودن مدیر میانی")
-    async def add_manager_start(message: types.Message, state: FSMContext):
-        user = get_user_by_telegram_id(message.from_user.id)
+    async def add_manager_start(message: types.Message, state: FSMContext, user):
         if not user or user['role'] != 'admin':
             await message.answer("دسترسی فقط برای مدیر اصلی!", reply_markup=admin_menu())
             return
@@ -167,22 +528,26 @@ async def main():
         await state.set_state(AddManagerState.waiting_for_position)
 
     @dp.message(AddManagerState.waiting_for_position)
-    async def add_manager_save(message: types.Message, state: FSMContext):
+    async def add_manager_save(message: types.Message, state: FSMContext, user):
         data = await state.get_data()
-        create_user(
+        added = await create_user(
             data.get('telegram_id'),
             data.get('username'),
-            data['name'] + f" ({message.text})",
+            data['name'],
             role="manager",
-            supervisor_id=get_user_by_telegram_id(message.from_user.id)['id']
+            supervisor_id=user['id'],
+            tenant_id=user['tenant_id'],
+            position=message.text
         )
-        await message.answer("✅ مدیر میانی با موفقیت افزوده شد.", reply_markup=admin_menu())
+        if not added:
+            await message.answer("❌ این کاربر عضو سازمان دیگری است.", reply_markup=admin_menu())
+        else:
+            await message.answer("✅ مدیر میانی با موفقیت افزوده شد.", reply_markup=admin_menu())
         await state.clear()
 
     # --- افزودن کاربر توسط مدیر میانی
     @dp.message(F.text == "➕ افزودن کاربر")
-    async def add_user_start(message: types.Message, state: FSMContext):
-        user = get_user_by_telegram_id(message.from_user.id)
+    async def add_user_start(message: types.Message, state: FSMContext, user):
         if not user or user['role'] != 'manager':
             await message.answer("دسترسی فقط برای مدیر میانی!", reply_markup=manager_menu())
             return
@@ -212,22 +577,109 @@ async def main():
         await state.set_state(AddUserState.waiting_for_position)
 
     @dp.message(AddUserState.waiting_for_position)
-    async def add_user_save(message: types.Message, state: FSMContext):
+    async def add_user_save(message: types.Message, state: FSMContext, user):
         data = await state.get_data()
-        create_user(
+        added = await create_user(
             data.get('telegram_id'),
             data.get('username'),
-            data['name'] + f" ({message.text})",
+            data['name'],
             role="member",
-            supervisor_id=get_user_by_telegram_id(message.from_user.id)['id']
+            supervisor_id=user['id'],
+            tenant_id=user['tenant_id'],
+            position=message.text
+        )
+        if not added:
+            await message.answer("❌ این کاربر عضو سازمان دیگری است.", reply_markup=manager_menu())
+        else:
+            await message.answer("✅ کاربر با موفقیت افزوده شد.", reply_markup=manager_menu())
+        await state.clear()
+
+    # --- لینک دعوت (tenants.py): مدیر اصلی مدیر میانی و مدیر میانی عضو تیم دعوت می‌کند
+    @dp.message(Command("invite"))
+    @dp.message(F.text == "🔗 لینک دعوت")
+    async def create_invite_link(message: types.Message, user, bot: Bot):
+        if not user or user['role'] not in tenants.INVITE_ROLES:
+            await message.answer("دسترسی فقط برای مدیران!")
+            return
+        token, role = await tenants.new_invite(user)
+        link = tenants.invite_link((await bot.me()).username, token)
+        await message.answer(
+            f"🔗 لینک دعوت {tenants.ROLE_TITLES[role]} (تا {tenants.INVITE_TTL_DAYS} روز و حداکثر "
+            f"{tenants.INVITE_USES} نفر):\n{link}"
         )
-        await message.answer("✅ کاربر با موفقیت افزوده شد.", reply_markup=manager_menu())
+
+    # --- ساختن سازمان تازه توسط کاربری که هنوز عضو جایی نیست
+    @dp.message(Command("neworg"))
+    async def new_organisation(message: types.Message, user, command: CommandObject):
+        if user:
+            await message.answer("شما همین حالا عضو یک سازمان هستید.")
+            return
+        if not ALLOW_NEW_TENANTS:
+            await message.answer("ساختن سازمان تازه در این ربات بسته است؛ از مدیرتان لینک دعوت بگیرید.")
+            return
+        name = (command.args or "").strip()[:64]
+        if not name:
+            await message.answer("فرمت صحیح:\n/neworg <نام سازمان>")
+            return
+        tenant_id = await create_tenant(name, message.from_user.id, message.from_user.username,
+                                        message.from_user.full_name, timeutil.now())
+        if not tenant_id:
+            await message.answer("شما همین حالا عضو یک سازمان هستید.")
+            return
+        await message.answer(
+            f"✅ سازمان «{name}» ساخته شد و شما مدیر اصلی آن هستید.\n"
+            "برای دعوت مدیران میانی از «🔗 لینک دعوت» استفاده کنید.",
+            reply_markup=admin_menu()
+        )
+
+    # --- ورود گروهی اعضا از فایل CSV
+    @dp.message(F.text == "📤 ورود گروهی از فایل")
+    async def import_start(message: types.Message, state: FSMContext, user):
+        if not user or user['role'] not in ('admin', 'manager'):
+            await message.answer("دسترسی فقط برای مدیران!")
+            return
+        await message.answer(
+            "فایل CSV را ارسال کنید (خروجی CSV UTF-8 اکسل هم قابل قبول است).\n"
+            "سطر اول نام ستون‌هاست، مثلاً:\n\n"
+            "آیدی,یوزرنیم,نام,سمت,نقش,سرپرست\n"
+            "123456789,,علی رضایی,کارشناس فروش,عضو,@manager1\n\n"
+            "آیدی یا یوزرنیم و نام لازم است؛ سرپرست خالی یعنی خود شما.",
+            reply_markup=cancel_menu()
+        )
+        await state.set_state(ImportState.waiting_for_file)
+
+    @dp.message(ImportState.waiting_for_file, F.document)
+    async def import_file(message: types.Message, state: FSMContext, user, bot: Bot):
+        menu = admin_menu() if user['role'] == 'admin' else manager_menu()
+        if message.document.file_size and message.document.file_size > team_import.MAX_IMPORT_BYTES:
+            await message.answer("حجم فایل بیش از حد مجاز است.", reply_markup=cancel_menu())
+            return
+        buffer = io.BytesIO()
+        await bot.download(message.document, destination=buffer)
+        buffer.seek(0)
+        try:
+            rows, errors = team_import.read_rows(buffer)
+        except team_import.ImportFileError as e:
+            await message.answer(str(e), reply_markup=cancel_menu())
+            return
+        levels, rejected, updated = await team_import.validate(rows, user)
+        try:
+            imported = await import_users(team_import.to_params(levels, user))
+        except sqlite3.IntegrityError:
+            # مثلاً جابه‌جایی کسی زیر یکی از زیرمجموعه‌های خودش؛ تراکنش کامل برگشته است
+            await message.answer("ورود انجام نشد: فایل ساختار سازمان را دوری می‌کند. هیچ تغییری ثبت نشد.", reply_markup=menu)
+            await state.clear()
+            return
+        await answer_long(message, team_import.format_summary(imported, updated, sorted(errors + rejected)), reply_markup=menu)
         await state.clear()
 
+    @dp.message(ImportState.waiting_for_file)
+    async def import_not_a_file(message: types.Message):
+        await message.answer("لطفاً فایل CSV را به صورت document ارسال کنید.", reply_markup=cancel_menu())
+
     # --- تعریف تسک
     @dp.message(F.text == "➕ تعریف تسک")
-    async def start_task_creation(message: types.Message, state: FSMContext):
-        user = get_user_by_telegram_id(message.from_user.id)
+    async def start_task_creation(message: types.Message, state: FSMContext, user):
         if user['role'] not in ['admin', 'manager']:
             await message.answer("دسترسی فقط برای مدیران!", reply_markup=admin_menu())
             return
@@ -251,19 +703,8 @@ async def main():
     async def get_task_deadline(message: types.Message, state: FSMContext):
         date_str = message.text.strip()
         try:
-            months = {
-                "فروردین": 1, "اردیبهشت": 2, "خرداد": 3, "تیر": 4, "مرداد": 5, "شهریور": 6,
-                "مهر": 7, "آبان": 8, "آذر": 9, "دی": 10, "بهمن": 11, "اسفند": 12
-            }
-            parts = date_str.split()
-            if len(parts) != 3 or parts[1] not in months:
-                raise ValueError
-            day = int(parts[0])
-            month = months[parts[1]]
-            year = int(parts[2])
-            jalali = jdatetime.date(year, month, day)
-            miladi = jalali.togregorian().isoformat()
-            await state.update_data(deadline=miladi)
+            deadline = timeutil.parse_jalali_date(date_str)
+            await state.update_data(deadline=deadline)
             await message.answer(
                 "چه بازه‌ای برای یادآوری تنظیم کنم؟\n"
                 "نمونه:\n6 ساعت\nیا\n3 روز\nیا بنویسید: فقط روز ددلاین",
@@ -274,9 +715,12 @@ async def main():
             await message.answer("فرمت ددلاین نادرست است. مثال درست: 26 خرداد 1404")
 
     @dp.message(TaskCreation.waiting_for_reminder)
-    async def get_reminder(message: types.Message, state: FSMContext):
+    async def get_reminder(message: types.Message, state: FSMContext, user):
         text = message.text.strip()
-        if "ساعت" in text:
+        if "ددلاین" in text:
+            # «فقط روز ددلاین» خودش کلمه‌ی «روز» را دارد
+            await state.update_data(reminder_type="none", reminder_value=None)
+        elif "ساعت" in text:
             try:
                 value = int(text.replace("ساعت", "").strip())
                 if not (1 <= value <= 48):
@@ -297,180 +741,289 @@ async def main():
         else:
             await state.update_data(reminder_type="none", reminder_value=None)
 
-        user = get_user_by_telegram_id(message.from_user.id)
-        if user['role'] == 'admin':
-            managers = get_all_users_by_role("manager")
-            if not managers:
+        picker = await assignee_picker(user)
+        if picker is None:
+            if user['role'] == 'admin':
                 await message.answer("مدیر میانی ثبت نشده است.")
-                await state.clear()
-                return
-            kb = InlineKeyboardMarkup(
-                inline_keyboard=[
-                    [InlineKeyboardButton(text=f"{mgr['name']}", callback_data=f"assign_mgr_{mgr['id']}")]
-                    for mgr in managers
-                ]
-            )
-            await message.answer("کدام مدیر میانی دریافت‌کننده تسک باشد؟", reply_markup=kb)
-        elif user['role'] == 'manager':
-            team = get_team_users(user['id'])
-            if not team:
+            else:
                 await message.answer("هیچ عضوی برای تیم شما ثبت نشده.", reply_markup=manager_menu())
-                await state.clear()
-                return
-            kb = InlineKeyboardMarkup(
-                inline_keyboard=[
-                    [InlineKeyboardButton(text=f"{member['name']}", callback_data=f"assign_mem_{member['id']}")]
-                    for member in team
-                ]
-            )
-            await message.answer("کدام عضو تیم دریافت‌کننده تسک باشد؟", reply_markup=kb)
+            await state.clear()
+            return
+        prompt = "کدام مدیر میانی دریافت‌کننده تسک باشد؟" if user['role'] == 'admin' else "کدام عضو تیم دریافت‌کننده تسک باشد؟"
+        # selected فقط در حالت چندانتخابی لیست است؛ picker صفحه‌ی فعلی کیبورد (جهت، cursor)
+        await state.update_data(selected=None, picker=None)
+        await message.answer(prompt, reply_markup=picker)
         await state.set_state(TaskCreation.waiting_for_assignee)
 
-    @dp.callback_query(TaskCreation.waiting_for_assignee)
-    async def assign_task_callback(call: types.CallbackQuery, state: FSMContext):
+    @dp.callback_query(TaskCreation.waiting_for_assignee, F.data.startswith("assign_"))
+    async def assign_task_callback(call: types.CallbackQuery, state: FSMContext, user, scheduler: ReminderScheduler, bot: Bot):
         data = await state.get_data()
-        user = get_user_by_telegram_id(call.from_user.id)
-        if user['role'] == 'admin' and call.data.startswith("assign_mgr_"):
-            assignee_id = int(call.data.replace("assign_mgr_", ""))
+        selected = set(data['selected']) if data.get('selected') is not None else None
+        page = data.get('picker') or (None, None)
+        if call.data.startswith("assign_pg:"):
+            _, direction, cursor = call.data.split(':')
+            page = (direction, int(cursor))
+            await state.update_data(picker=page)
+        elif call.data == "assign_multi":
+            selected = set()
+            await state.update_data(selected=[])
+        elif call.data.startswith("assign_tgl_"):
+            target = int(call.data.replace("assign_tgl_", ""))
+            selected = selected or set()
+            if target in selected:
+                selected.discard(target)
+            elif await filter_assignees(user['role'], user['id'], [target]):
+                selected.add(target)
+            await state.update_data(selected=list(selected))
+        if call.data.startswith(("assign_pg:", "assign_multi", "assign_tgl_")):
+            picker = await assignee_picker(user, *page, selected=selected)
+            if picker:
+                await call.message.edit_reply_markup(reply_markup=picker)
+            await call.answer()
+            return
+
+        if call.data == "assign_all":
+            assignee_ids = await filter_assignees(user['role'], user['id'])
+        elif call.data == "assign_done":
+            assignee_ids = await filter_assignees(user['role'], user['id'], selected or [])
+            if not assignee_ids:
+                await call.answer("هیچ کس انتخاب نشده است.")
+                return
+        elif user['role'] == 'admin' and call.data.startswith("assign_mgr_"):
+            assignee_ids = await filter_assignees(user['role'], user['id'], [int(call.data.replace("assign_mgr_", ""))])
         elif user['role'] == 'manager' and call.data.startswith("assign_mem_"):
-            assignee_id = int(call.data.replace("assign_mem_", ""))
+            assignee_ids = await filter_assignees(user['role'], user['id'], [int(call.data.replace("assign_mem_", ""))])
         else:
+            assignee_ids = []
+        if not assignee_ids:
             await call.answer("خطا در انتخاب دریافت‌کننده.")
             return
-        assigner = user
-        create_task(
-            title=data['title'],
-            description=data['description'],
-            assigned_by=assigner['id'],
-            assigned_to=assignee_id,
-            deadline=data['deadline'],
-            reminder_type=data['reminder_type'],
-            reminder_value=data['reminder_value'],
-            is_urgent=0,
-            created_at=datetime.now().isoformat()
-        )
-        await call.message.answer("✅ تسک با موفقیت ثبت شد.", reply_markup=manager_menu() if assigner['role']=='manager' else admin_menu())
-        await state.clear()
+        tasks = await save_assigned_task(call.message, state, user, scheduler, assignee_ids)
         await call.answer()
+        await notify_assignees(bot, tasks)
+
+    # نتیجه‌ی جستجوی inline (🔎 جستجوی نام) به صورت پیام «👤 نام #id» در چت می‌آید
+    @dp.message(TaskCreation.waiting_for_assignee, F.text.regexp(r"^👤 .* #(\d+)$").as_("match"))
+    async def assign_from_search(message: types.Message, state: FSMContext, user, scheduler: ReminderScheduler, bot: Bot, match):
+        target = int(match.group(1))
+        if not await filter_assignees(user['role'], user['id'], [target]):
+            await message.answer("این کاربر قابل انتخاب نیست.")
+            return
+        data = await state.get_data()
+        if data.get('selected') is None:
+            tasks = await save_assigned_task(message, state, user, scheduler, [target])
+            await notify_assignees(bot, tasks)
+            return
+        selected = set(data['selected']) | {target}
+        await state.update_data(selected=list(selected))
+        picker = await assignee_picker(user, *(data.get('picker') or (None, None)), selected=selected)
+        await message.answer(f"{len(selected)} نفر انتخاب شده‌اند.", reply_markup=picker)
+
+    @dp.inline_query()
+    async def search_assignees(query: types.InlineQuery, user):
+        """جستجوی پیشوندی نام دریافت‌کننده‌های مجاز (inline mode باید در BotFather فعال باشد)"""
+        results = []
+        if user and user['role'] in ('admin', 'manager'):
+            rows = await get_assignees(user['role'], user['id'], prefix=query.query.strip() or None, limit=INLINE_RESULTS)
+            results = [
+                InlineQueryResultArticle(
+                    id=str(r['id']), title=r['name'],
+                    input_message_content=InputTextMessageContent(message_text=f"👤 {r['name']} #{r['id']}"),
+                )
+                for r in rows
+            ]
+        await query.answer(results, cache_time=10, is_personal=True)
+
+    # --- پیگیری تسک‌هایی که همزمان به چند نفر داده شده‌اند
+    @dp.message(F.text == "📦 تسک‌های گروهی")
+    async def show_task_groups(message: types.Message, user):
+        if not user or user['role'] not in ('admin', 'manager'):
+            await message.answer("دسترسی فقط برای مدیران!")
+            return
+        text = await task_groups_text(user)
+        if not text:
+            await message.answer("هنوز تسکی را به چند نفر با هم نداده‌اید.")
+            return
+        await answer_long(message, text)
 
     # --- مشاهده تسک‌های فعال
     @dp.message(F.text == "🗂 مشاهده تسک‌های فعال")
     async def handle_tasks(message: types.Message, state: FSMContext):
-        telegram_id = message.from_user.id
-        tasks = get_tasks_for_user(telegram_id)
-        if not tasks:
+        page = await tasks_page(message.from_user.id)
+        if not page:
             await message.answer("شما هیچ تسک فعالی ندارید.")
             return
-        response = "📋 تسک‌های شما:\n\n"
-        for task in tasks:
-            rem = ""
-            if task.get("reminder_type") == "hour":
-                rem = f"یادآوری هر {task['reminder_value']} ساعت"
-            elif task.get("reminder_type") == "day":
-                rem = f"یادآوری هر {task['reminder_value']} روز"
-            else:
-                rem = "یادآوری فقط روز ددلاین"
-            response += (
-                f"📌 {task['title']}\n"
-                f"📝 {task['description']}\n"
-                f"⏰ مهلت: {task['deadline']}\n"
-                f"⏱ {rem}\n\n"
-            )
-        await message.answer(response)
+        text, kb = page
+        await message.answer(text, reply_markup=kb)
+
+    # --- دکمه‌های هر تسک: انجام شد / گزارش
+    @dp.callback_query(F.data.startswith("tsk:done:"))
+    async def task_done_callback(call: types.CallbackQuery, user, scheduler: ReminderScheduler, notifier: Notifier):
+        if not user:
+            await call.answer("ابتدا با دستور /start ثبت‌نام کن.")
+            return
+        task_id = int(call.data.rsplit(":", 1)[1])
+        # UPDATE شرطی: فقط دریافت‌کننده و فقط یک بار
+        task = await mark_task_done(task_id, user['id'], timeutil.now())
+        if task is None:
+            await call.answer("این تسک قبلاً انجام شده یا به شما سپرده نشده است.", show_alert=True)
+            return
+        scheduler.discard(task_id)
+        notifier.task_done(task)
+        await call.answer(f"✅ «{task['title']}» انجام شد.")
+        page = await tasks_page(call.from_user.id)
+        if page:
+            text, kb = page
+            await call.message.edit_text(text, reply_markup=kb)
+        else:
+            await call.message.edit_text("🎉 همه‌ی تسک‌های شما انجام شده است.")
+
+    @dp.callback_query(F.data.startswith("tsk:rep:"))
+    async def task_report_callback(call: types.CallbackQuery, state: FSMContext, user):
+        task = await get_active_task(int(call.data.rsplit(":", 1)[1]))
+        if not user or task is None or task['assigned_to'] != user['id']:
+            await call.answer("این تسک دیگر فعال نیست.", show_alert=True)
+            return
+        await state.set_data({'report_task_id': task['id']})
+        await state.set_state(ReportState.waiting_for_report)
+        await call.message.answer(f"گزارش تسک «{task['title']}»: " + REPORT_PROMPT, reply_markup=cancel_menu())
+        await call.answer()
+
+    # --- سررسیدها: عقب‌افتاده و هفته‌ی پیش رو (برای مدیران شامل زیرمجموعه‌ها)
+    @dp.message(F.text == "⏰ سررسیدها")
+    async def show_deadlines(message: types.Message, user):
+        if not user:
+            await message.answer("ابتدا با دستور /start ثبت‌نام کن.")
+            return
+        text = await deadlines_text(user)
+        if not text:
+            await message.answer("تسکی با ددلاین نزدیک یا گذشته وجود ندارد.")
+            return
+        await answer_long(message, text)
 
     # --- گزارش اعضا
     @dp.message(F.text == "📝 ارسال گزارش")
     async def handle_report_start(message: types.Message, state: FSMContext):
-        await message.answer("لطفاً متن گزارش خود را ارسال کنید:", reply_markup=cancel_menu())
+        await message.answer(REPORT_PROMPT, reply_markup=cancel_menu())
+        await state.set_data({})
         await state.set_state(ReportState.waiting_for_report)
 
     @dp.message(ReportState.waiting_for_report)
-    async def handle_report_save(message: types.Message, state: FSMContext):
-        telegram_id = message.from_user.id
-        user = get_user_by_telegram_id(telegram_id)
+    async def handle_report_save(message: types.Message, state: FSMContext, user, notifier: Notifier, albums: AlbumCollector):
         if not user:
             await message.answer("ابتدا با دستور /start ثبت‌نام کن.")
             await state.clear()
             return
-        content = message.text
-        timestamp = datetime.now().isoformat()
-        create_report(task_id=None, user_id=user['id'], content=content, timestamp=timestamp)
-        await message.answer("✅ گزارش شما با موفقیت ثبت شد.", reply_markup=member_menu())
-        await state.clear()
+        async def save(messages):
+            await save_report(messages, state, user, notifier, "✅ گزارش شما با موفقیت ثبت شد.")
+        if message.media_group_id:
+            # تکه‌های آلبوم جمع می‌شوند و با هم یک گزارش می‌شوند
+            albums.add(message, save)
+            return
+        await save([message])
 
     # --- گزارش مدیر میانی برای مدیر اصلی
     @dp.message(F.text == "📝 ثبت گزارش برای مدیر")
     async def handle_manager_report_start(message: types.Message, state: FSMContext):
-        await message.answer("متن گزارش برای مدیر اصلی را وارد کنید:", reply_markup=cancel_menu())
+        await message.answer("گزارش برای مدیر اصلی: " + REPORT_PROMPT, reply_markup=cancel_menu())
+        await state.set_data({})
         await state.set_state(ManagerReportState.waiting_for_report)
 
     @dp.message(ManagerReportState.waiting_for_report)
-    async def handle_manager_report_save(message: types.Message, state: FSMContext):
-        telegram_id = message.from_user.id
-        user = get_user_by_telegram_id(telegram_id)
+    async def handle_manager_report_save(message: types.Message, state: FSMContext, user, notifier: Notifier, albums: AlbumCollector):
         if not user:
             await message.answer("ابتدا با دستور /start ثبت‌نام کن.")
             await state.clear()
             return
-        content = "[گزارش مدیر میانی]\n" + message.text
-        timestamp = datetime.now().isoformat()
-        create_report(task_id=None, user_id=user['id'], content=content, timestamp=timestamp)
-        await message.answer("✅ گزارش برای مدیر اصلی ثبت شد.", reply_markup=manager_menu())
-        await state.clear()
+        async def save(messages):
+            await save_report(messages, state, user, notifier, "✅ گزارش برای مدیر اصلی ثبت شد.", prefix="[گزارش مدیر میانی]\n")
+        if message.media_group_id:
+            albums.add(message, save)
+            return
+        await save([message])
 
     # --- مشاهده گزارش‌ها
     @dp.message(F.text == "📥 مشاهده گزارش‌ها")
-    async def show_reports(message: types.Message, state: FSMContext):
-        user = get_user_by_telegram_id(message.from_user.id)
-        if user['role'] == 'admin':
-            reports = get_reports_for_supervisor(None, all_admin=True)
-        elif user['role'] == 'manager':
-            reports = get_reports_for_supervisor(user['id'])
-        else:
+    async def show_reports(message: types.Message, state: FSMContext, user):
+        if user['role'] not in ('admin', 'manager'):
             await message.answer("این بخش فقط برای مدیران است.", reply_markup=member_menu())
             return
-        if not reports:
+        page = await reports_page(user)
+        if not page:
             await message.answer("هیچ گزارشی برای نمایش وجود ندارد.")
             return
-        response = "📊 لیست گزارش‌ها:\n\n"
-        for rep in reports:
-            response += (
-                f"🆔 Report ID: {rep['id']}\n"
-                f"👤 کاربر: {rep['name']}\n"
-                f"📝 {rep['content']}\n"
-                f"📅 {rep['timestamp']}\n"
-                f"⭐ امتیاز: {rep['score'] or 'ندارد'}\n\n"
-            )
-        response += "برای امتیاز دادن، دستور زیر را وارد کنید:\n/score <report_id>"
-        await message.answer(response)
+        text, kb = page
+        await message.answer(text, reply_markup=kb)
 
     # --- مشاهده گزارش‌های من (کاربر)
     @dp.message(F.text == "📥 مشاهده گزارش‌های من")
-    async def show_my_reports(message: types.Message, state: FSMContext):
-        user = get_user_by_telegram_id(message.from_user.id)
+    async def show_my_reports(message: types.Message, state: FSMContext, user):
         if not user:
             await message.answer("ابتدا با دستور /start ثبت‌نام کن.")
             return
-        reports = get_reports_for_user(user['id'])
-        if not reports:
+        page = await my_reports_page(user)
+        if not page:
             await message.answer("گزارشی برای شما ثبت نشده است.")
             return
-        response = "📥 گزارش‌های ثبت‌شده شما:\n\n"
-        for rep in reports:
-            response += (
-                f"📝 {rep['content']}\n"
-                f"📅 {rep['timestamp']}\n"
-                f"⭐ امتیاز: {rep['score'] or 'ندارد'}\n\n"
-            )
-        await message.answer(response)
+        text, kb = page
+        await message.answer(text, reply_markup=kb)
+
+    # --- دکمه‌های قبلی/بعدی فیدها (پیام در جا ویرایش می‌شود)
+    @dp.callback_query(F.data.startswith("pg:"))
+    async def paginate_feed(call: types.CallbackQuery, state: FSMContext, user):
+        feed, direction, cursor = parse_callback(call.data)
+        page = None
+        if feed == "tsk":
+            page = await tasks_page(call.from_user.id, direction, cursor)
+        elif feed == "rep" and user and user['role'] in ('admin', 'manager'):
+            page = await reports_page(user, direction, cursor)
+        elif feed == "org" and user and user['role'] in ('admin', 'manager'):
+            page = await org_page(user, direction, cursor)
+        elif feed == "srch" and user:
+            query = (await state.get_data()).get('search_query')
+            if query:
+                page = await search_page(user, query, direction, cursor)
+        elif feed == "my" and user:
+            page = await my_reports_page(user, direction, cursor)
+        elif feed == "arc" and user and user['role'] == 'admin':
+            target = (await state.get_data()).get('archive_user')
+            if target:
+                page = await archive_page(*target, direction, cursor)
+        if not page:
+            await call.answer("موردی برای نمایش وجود ندارد.")
+            return
+        text, kb = page
+        await call.message.edit_text(text, reply_markup=kb)
+        await call.answer()
+
+    # --- ارسال دوباره‌ی پیوست‌های یک گزارش با همان file_id ها
+    @dp.callback_query(F.data.startswith("att:"))
+    async def send_report_attachments(call: types.CallbackQuery, user, bot: Bot):
+        report_id = int(call.data.split(":")[1])
+        report = await get_report(report_id)
+        if report is None and user and user['role'] == 'admin':
+            report = await get_archived_report(report_id, user['tenant_id'])
+        if not user or not report or (report['user_id'] != user['id'] and not await can_manage(user, report['user_id'])):
+            await call.answer("گزارشی با این شناسه در تیم شما پیدا نشد.", show_alert=True)
+            return
+        rows = await get_report_attachments(report_id)
+        if not rows:
+            await call.answer("این گزارش پیوستی ندارد.")
+            return
+        await call.answer()
+        await attachments.send(bot, call.from_user.id, rows)
 
     # --- امتیازدهی به گزارش‌ها
     @dp.message(Command("score"))
-    async def score_start(message: types.Message, state: FSMContext):
+    async def score_start(message: types.Message, state: FSMContext, user):
         args = message.text.strip().split()
         if len(args) != 2 or not args[1].isdigit():
             await message.answer("فرمت صحیح:\n/score <report_id>")
             return
+        report = await get_report(int(args[1]))
+        if not report or not await can_manage(user, report['user_id']):
+            await message.answer("گزارشی با این شناسه در تیم شما پیدا نشد.")
+            return
         await state.update_data(report_id=int(args[1]))
         await message.answer("لطفاً امتیاز را وارد کنید (۱ تا ۵):", reply_markup=cancel_menu())
         await state.set_state(ScoreState.waiting_for_score)
@@ -483,42 +1036,213 @@ async def main():
         data = await state.get_data()
         report_id = data['report_id']
         score = int(message.text)
-        rate_report(report_id, score)
+        await rate_report(report_id, score)
         await message.answer("✅ امتیاز ثبت شد.", reply_markup=admin_menu())
         await state.clear()
 
-    # --- لیست کاربران (درختی برای admin، تیمی برای manager)
+    # --- جستجوی تمام‌متن در گزارش‌ها و تسک‌های قابل مشاهده برای کاربر
+    @dp.message(Command("search"))
+    async def search_command(message: types.Message, state: FSMContext, user):
+        if not user:
+            await message.answer("ابتدا با دستور /start ثبت‌نام کن.")
+            return
+        args = message.text.strip().split(maxsplit=1)
+        if len(args) != 2:
+            await message.answer("فرمت صحیح:\n/search <عبارت>")
+            return
+        query = args[1][:100]
+        # عبارت برای دکمه‌های صفحه‌ی بعد/قبل نگه داشته می‌شود (callback_data جای آن را ندارد)
+        await state.update_data(search_query=query)
+        page = await search_page(user, query)
+        if not page:
+            await message.answer("نتیجه‌ای پیدا نشد.")
+            return
+        text, kb = page
+        await message.answer(text, reply_markup=kb)
+
+    # --- گزارش‌های آرشیوشده (retention.py): /archive <report_id> یا /archive @username
+    @dp.message(Command("archive"))
+    async def show_archive(message: types.Message, state: FSMContext, user):
+        if not user or user['role'] != 'admin':
+            await message.answer("دسترسی فقط برای مدیر اصلی!")
+            return
+        args = message.text.strip().split()
+        if len(args) == 2 and args[1].isdigit():
+            report = await get_archived_report(int(args[1]), user['tenant_id'])
+            if not report:
+                await message.answer("گزارش آرشیوشده‌ای با این شماره نیست.")
+                return
+            await answer_long(message, "🗄 گزارش آرشیوشده\n\n" + format_report(report))
+            return
+        if len(args) == 2 and args[1].startswith('@'):
+            target = await get_user_by_username(args[1][1:], user['tenant_id'])
+            if not target:
+                await message.answer("کاربری با این یوزرنیم پیدا نشد.")
+                return
+            await state.update_data(archive_user=[target['id'], target['name']])
+            page = await archive_page(target['id'], target['name'])
+            if not page:
+                await message.answer("گزارش آرشیوشده‌ای برای این کاربر نیست.")
+                return
+            text, kb = page
+            await message.answer(text, reply_markup=kb)
+            return
+        await message.answer("فرمت صحیح:\n/archive <report_id>\n/archive @username")
+
+    # --- خروجی فایل گزارش‌ها/تسک‌ها (export.py)؛ مدیر میانی فقط زیرمجموعه‌ی خودش
+    @dp.message(Command("export"))
+    async def export_command(message: types.Message, user):
+        if not user or user['role'] not in ('admin', 'manager'):
+            await message.answer("این بخش فقط برای مدیران است.")
+            return
+        try:
+            kind, fmt, start, end = export.parse_args(message.text.split()[1:])
+        except ValueError:
+            await message.answer(export.USAGE)
+            return
+        if user['id'] in export.in_progress:
+            await message.answer("یک خروجی دیگر شما در حال ساخت است؛ کمی صبر کنید.")
+            return
+        export.in_progress.add(user['id'])
+        status = await message.answer("⏳ در حال ساخت فایل خروجی...")
+
+        async def progress(count):
+            await status.edit_text(f"⏳ در حال ساخت فایل خروجی... {count} ردیف")
+
+        path = None
+        try:
+            scope_id = None if user['role'] == 'admin' else user['id']
+            path, count = await export.write_export(kind, fmt, scope_id, user['tenant_id'], start, end, progress)
+            if not count:
+                await status.edit_text("ردیفی در این بازه برای خروجی نیست.")
+                return
+            if os.path.getsize(path) > export.MAX_EXPORT_BYTES:
+                await status.edit_text("فایل خروجی از سقف ارسال تلگرام بزرگ‌تر شد؛ بازه‌ی کوتاه‌تری انتخاب کنید.")
+                return
+            await status.edit_text(f"✅ {count} ردیف آماده شد؛ در حال ارسال فایل...")
+            await message.answer_document(FSInputFile(path, filename=export.file_name(kind, fmt)),
+                                          caption=f"📤 {count} ردیف")
+        except Exception:
+            logging.exception("export failed")
+            await status.edit_text("❌ ساخت فایل خروجی با خطا متوقف شد.")
+        finally:
+            export.in_progress.discard(user['id'])
+            if path:
+                os.remove(path)
+
+    # --- آمار و جدول امتیازها (/stats برای ماه جاری، /stats all برای کل دوره)
+    @dp.message(Command("stats"))
+    async def show_stats(message: types.Message, user):
+        if not user:
+            await message.answer("ابتدا با دستور /start ثبت‌نام کن.")
+            return
+        args = message.text.strip().split()
+        period = 'all' if len(args) > 1 and args[1] == 'all' else None
+        await message.answer(await stats_text(user, period))
+
+    # --- تنظیم اعلان‌های فعالیت تیم (notifications.py)
+    @dp.message(Command("notify"))
+    async def notify_settings(message: types.Message, user, command: CommandObject):
+        if not user or user['role'] not in ('admin', 'manager'):
+            await message.answer("این بخش فقط برای مدیران است.")
+            return
+        arg = (command.args or "").strip().lower()
+        if not arg:
+            current = notifications.MODE_TITLES[user['notify_mode'] or 'instant']
+            await message.answer(f"🔔 حالت فعلی اعلان‌ها: {current}\n\n{notifications.USAGE}")
+            return
+        mode = notifications.MODES.get(arg)
+        if mode is None:
+            await message.answer("فرمت صحیح:\n" + notifications.USAGE)
+            return
+        await set_notify_mode(user, mode)
+        await message.answer(f"✅ حالت اعلان‌ها: {notifications.MODE_TITLES[mode]}")
+
+    # --- متریک‌های عملکرد (همان داده‌های خروجی Prometheus)
+    @dp.message(Command("metrics"))
+    async def show_metrics(message: types.Message, user):
+        if not user or user['role'] != 'admin':
+            await message.answer("دسترسی فقط برای مدیر اصلی!")
+            return
+        await answer_long(message, metrics.summary_text())
+
+    # --- لیست کاربران (کل سازمان برای admin، زیردرخت خودش برای manager)
     @dp.message(F.text == "👥 لیست کاربران")
-    async def list_users_admin(message: types.Message, state: FSMContext):
-        user = get_user_by_telegram_id(message.from_user.id)
+    async def list_users_admin(message: types.Message, state: FSMContext, user):
         if user['role'] != 'admin':
             await message.answer("دسترسی فقط برای مدیر اصلی!", reply_markup=member_menu())
             return
-        managers = get_all_users_by_role("manager")
-        msg = "👥 لیست مدیرهای میانی و اعضای تیم‌ها:\n"
-        for manager in managers:
-            msg += f"\n🟦 مدیر: {manager['name']} (ID:{manager['telegram_id']})\n"
-            team = get_team_users(manager['id'])
-            for member in team:
-                msg += f"    └ 🟩 {member['name']} (ID:{member['telegram_id']})\n"
-        await message.answer(msg)
+        page = await org_page(user)
+        if not page:
+            await message.answer("کاربری ثبت نشده است.")
+            return
+        text, kb = page
+        await message.answer(text, reply_markup=kb)
 
     @dp.message(F.text == "👥 لیست اعضای تیم")
-    async def list_users_manager(message: types.Message, state: FSMContext):
-        user = get_user_by_telegram_id(message.from_user.id)
+    async def list_users_manager(message: types.Message, state: FSMContext, user):
         if user['role'] != 'manager':
             await message.answer("این بخش فقط برای مدیرهای میانی است!", reply_markup=member_menu())
             return
-        team = get_team_users(user['id'])
-        if not team:
+        page = await org_page(user)
+        if not page:
             await message.answer("تیمی ثبت نشده است.")
             return
-        msg = "👥 لیست اعضای تیم:\n"
-        for member in team:
-            msg += f"🟩 {member['name']} (ID:{member['telegram_id']})\n"
-        await message.answer(msg)
+        text, kb = page
+        await message.answer(text, reply_markup=kb)
+
+    return dp
+
+def setup_bot(global_rate=GLOBAL_RATE):
+    """Bot با صف خروجی و Dispatcher؛ مشترک بین main و workerهای sharding.py"""
+    bot = Bot(token=BOT_TOKEN)
+    outbox = OutboundQueue(global_rate=global_rate)
+    bot.session.middleware(outbox)
+    dp = create_dispatcher(bot)
+    metrics.register_gauge("bot_outbox_depth", "Messages waiting in the outbound queue", outbox.depth)
+    metrics.register_gauge("bot_user_cache_hit_ratio", "User cache hit ratio", lambda: user_cache.stats()["hit_ratio"])
+    return bot, dp, outbox
+
+async def start_background(dp):
+    """زمان‌بند یادآوری، آرشیو و اعلان‌ها؛ در حالت چندپروسه‌ای فقط در worker صفر اجرا می‌شوند"""
+    scheduler = dp["scheduler"]
+    notifier = dp["notifier"]
+    metrics.register_gauge("bot_scheduled_reminders", "Active tasks with a pending reminder", lambda: len(scheduler))
+    metrics.register_gauge("bot_notify_pending", "Recipients with buffered notifications", lambda: len(notifier))
+    await scheduler.load()
+    scheduler.start()
+    archiver = ReportArchiver()
+    archiver.start()
+    notifier.start()
+    return [scheduler, archiver, notifier]
+
+async def shutdown(dp, outbox, services):
+    for service in services:
+        await service.stop()
+    # آلبوم‌های نیمه‌کاره پیش از بستن صف خروجی و دیتابیس ثبت شوند
+    await dp["albums"].stop()
+    await outbox.close()
+    await dp.storage.close()
+    logging.info("user cache: %s", user_cache.stats())
+    logging.info("outbox: %s", outbox.stats())
+    await close_db()
 
-    await dp.start_polling(bot)
+async def main():
+    await init_db()
+    bot, dp, outbox = setup_bot()
+    services = await start_background(dp)
+    try:
+        if BOT_MODE == 'webhook':
+            await run_webhook(dp, bot)
+        else:
+            await dp.start_polling(bot, tasks_concurrency_limit=MAX_CONCURRENT_UPDATES)
+    finally:
+        await shutdown(dp, outbox, services)
 
 if __name__ == '__main__':
-    asyncio.run(main())
+    require_bot_token()
+    if WORKERS > 1:
+        import sharding
+        sharding.main(WORKERS)
+    else:
+        asyncio.run(main())
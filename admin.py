@@ -1,4 +1,5 @@
-from database import create_user,init_db
+from database import create_tenant, init_db
+from timeutil import now
 init_db()
-# مقدار id تلگرام خودت رو بذار جای عدد زیر
-create_user(6033914166, "اسم شما", role="admin")
+# مقدار id تلگرام خودت رو بذار جای عدد زیر؛ یک سازمان تازه با تو به عنوان مدیر اصلی ساخته می‌شود
+create_tenant("سازمان من", 6033914166, None, "اسم شما", now())
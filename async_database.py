@@ -0,0 +1,319 @@
+"""نسخه‌ی async توابع database.py
+
+کوئری‌ها روی یک ThreadPool کوچک اجرا می‌شوند تا حلقه‌ی رویداد aiogram
+هیچ‌وقت منتظر دیسک یا قفل SQLite نماند. هر ترد این pool اتصال ماندگار
+خودش را از database.get_connection می‌گیرد.
+"""
+import asyncio
+import functools
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import database
+import metrics
+from cache import MISSING, TTLCache
+
+_executor = ThreadPoolExecutor(max_workers=database.POOL_SIZE, thread_name_prefix="db")
+# همه‌ی نوشتن‌های گروهی روی یک ترد جدا تا دسته‌ها به ترتیب و بدون رقابت بر سر قفل نوشته شوند
+_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-writer")
+
+# group commit: نوشتن‌های پرتکرار حداکثر WRITE_BATCH_DELAY ثانیه صبر می‌کنند تا با
+# نوشتن‌های دیگر در یک تراکنش (و یک fsync) بروند؛ با WRITE_BATCH_SIZE نوشتن زودتر
+WRITE_BATCH_DELAY = 0.005
+WRITE_BATCH_SIZE = 64
+
+# کش کاربران بر اساس telegram_id؛ با create_user/delete_user باطل می‌شود
+USER_CACHE_SIZE = 4096
+USER_CACHE_TTL = 300
+user_cache = TTLCache(maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL)
+
+# صفحه‌های انتخاب دریافت‌کننده‌ی تسک بر اساس (نقش، شناسه‌ی انتخاب‌کننده، cursor)؛ هر تغییری
+# در جدول users همه را باطل می‌کند (نوشتن در users نادر است)
+ASSIGNEE_CACHE_SIZE = 1024
+assignee_cache = TTLCache(maxsize=ASSIGNEE_CACHE_SIZE, ttl=USER_CACHE_TTL)
+
+# در حالت چندپروسه‌ای (sharding.py) باطل شدن کش به پروسه‌های دیگر هم خبر داده می‌شود
+_invalidation_listeners = []
+# کش‌های درون‌پروسه‌ای ماژول‌های دیگر (مثل درخت سازمان در hierarchy.py)؛ برای باطل شدن‌هایی
+# که از پروسه‌های دیگر می‌رسند هم صدا زده می‌شوند
+_local_listeners = []
+
+
+def _timed(func, submitted, args, kwargs):
+    """اجرای func روی ترد pool با ثبت زمان انتظار در صف و زمان اجرا"""
+    start = time.perf_counter()
+    metrics.db_wait.observe(start - submitted)
+    try:
+        return func(*args, **kwargs)
+    except Exception:
+        metrics.db_errors.inc(func.__name__)
+        raise
+    finally:
+        metrics.db_latency.observe(time.perf_counter() - start, func.__name__)
+
+
+async def run(func, *args, **kwargs):
+    """اجرای یک تابع همگام دیتابیس خارج از حلقه‌ی رویداد"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, _timed, func, time.perf_counter(), args, kwargs)
+
+
+def _awaitable(func):
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        return await run(func, *args, **kwargs)
+    return wrapper
+
+
+class GroupCommit:
+    """صف نوشتن‌هایی که با هم در یک تراکنش database.write_batch ثبت می‌شوند
+
+    فراخواننده تا COMMIT دسته‌اش منتظر می‌ماند، پس وقتی submit برمی‌گردد نوشتن
+    روی دیسک است و خواندن‌های بعدی خود او (روی هر اتصالی) آن را می‌بینند؛ پاسخ
+    تلگرام هم فقط بعد از آن فرستاده می‌شود.
+    """
+
+    def __init__(self, delay=WRITE_BATCH_DELAY, max_batch=WRITE_BATCH_SIZE):
+        self.delay = delay
+        self.max_batch = max_batch
+        self._pending = []
+        self._timer = None
+        self._commits = set()
+
+    async def submit(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((func, args, kwargs, future))
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.delay, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            task = asyncio.get_running_loop().create_task(self._commit(batch))
+            self._commits.add(task)
+            task.add_done_callback(self._commits.discard)
+
+    async def _commit(self, batch):
+        loop = asyncio.get_running_loop()
+        calls = [(func, args, kwargs) for func, args, kwargs, _ in batch]
+        metrics.db_group_commits.inc()
+        metrics.db_group_writes.inc(amount=len(batch))
+        try:
+            results = await loop.run_in_executor(_writer, _timed, database.write_batch, time.perf_counter(), (calls,), {})
+        except Exception as e:
+            results = [(False, e)] * len(batch)
+        for (*_, future), (ok, value) in zip(batch, results):
+            if future.done():
+                continue
+            if ok:
+                future.set_result(value)
+            else:
+                future.set_exception(value)
+
+    async def drain(self):
+        """نوشتن فوری صف و انتظار برای همه‌ی دسته‌های در حال ثبت"""
+        self._flush()
+        if self._commits:
+            await asyncio.gather(*self._commits, return_exceptions=True)
+
+
+write_buffer = GroupCommit()
+
+
+def _batched(func):
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        return await write_buffer.submit(func, *args, **kwargs)
+    return wrapper
+
+
+async def close():
+    """نوشتن صف group commit و بستن اتصال‌ها و ترد‌های pool"""
+    await write_buffer.drain()
+    await run(database.close_connections)
+    _executor.shutdown(wait=True)
+    _writer.shutdown(wait=True)
+
+
+init_db = _awaitable(database.init_db)
+
+# --- USERS ---
+async def get_user_by_telegram_id(telegram_id):
+    user = user_cache.get(telegram_id)
+    if user is not MISSING:
+        return user
+    generation = user_cache.generation
+    user = await run(database.get_user_by_telegram_id, telegram_id)
+    user_cache.set(telegram_id, user, generation=generation)
+    return user
+
+
+def invalidate_user(telegram_id=None, username=None):
+    """حذف کاربر از کش؛ بعد از هر تغییری در جدول users صدا زده شود"""
+    apply_invalidation(telegram_id, username)
+    for listener in _invalidation_listeners:
+        listener(telegram_id, username)
+
+
+def clear_user_caches():
+    """باطل کردن کل کش کاربران (بعد از تغییرات انبوه)"""
+    apply_invalidation(None, None, everything=True)
+    for listener in _invalidation_listeners:
+        listener(None, None, everything=True)
+
+
+def apply_invalidation(telegram_id, username, everything=False):
+    """فقط کش همین پروسه؛ برای پیام‌هایی که از پروسه‌های دیگر می‌رسند"""
+    assignee_cache.clear()
+    if everything:
+        user_cache.clear()
+    if telegram_id is not None:
+        user_cache.invalidate(telegram_id)
+    if username:
+        user_cache.invalidate_where(lambda u: u is not None and u['username'] == username)
+    for listener in _local_listeners:
+        listener(telegram_id, username, everything)
+
+
+def add_invalidation_listener(listener, local=False):
+    """listener(telegram_id, username, everything=False) بعد از هر باطل شدن محلی صدا زده می‌شود
+
+    با local=True برای پاک کردن کش خود این پروسه است و برای باطل شدن‌هایی که از
+    پروسه‌های دیگر می‌رسند (apply_invalidation) هم صدا زده می‌شود.
+    """
+    (_local_listeners if local else _invalidation_listeners).append(listener)
+
+
+async def create_user(telegram_id, username, name, role='member', supervisor_id=None, tenant_id=None, position=None):
+    try:
+        return await run(database.create_user, telegram_id, username, name, role, supervisor_id, tenant_id, position)
+    finally:
+        invalidate_user(telegram_id, username)
+
+
+async def delete_user_by_telegram_id(telegram_id):
+    try:
+        return await run(database.delete_user_by_telegram_id, telegram_id)
+    finally:
+        invalidate_user(telegram_id)
+
+
+async def import_users(levels):
+    try:
+        return await run(database.import_users, levels)
+    finally:
+        # ممکن است صدها کاربر عوض شده باشند؛ باطل کردن تک‌تک ارزشی ندارد
+        clear_user_caches()
+
+
+async def get_assignees(assigner_role, assigner_id, prefix=None, after_id=None, before_id=None, limit=20):
+    """database.get_assignees با کش برای صفحه‌های بدون جستجو (همان صفحه‌ها بارها در گفتگوها باز می‌شوند)"""
+    if prefix:
+        return await run(database.get_assignees, assigner_role, assigner_id, prefix, limit=limit)
+    # مدیر اصلی هم با شناسه‌ی خودش کلید می‌خورد تا صفحه‌های سازمان‌ها قاطی نشوند
+    key = (assigner_role, assigner_id, after_id, before_id, limit)
+    rows = assignee_cache.get(key)
+    if rows is not MISSING:
+        return rows
+    generation = assignee_cache.generation
+    rows = await run(database.get_assignees, assigner_role, assigner_id,
+                     after_id=after_id, before_id=before_id, limit=limit)
+    assignee_cache.set(key, rows, generation=generation)
+    return rows
+
+
+get_user_by_username = _awaitable(database.get_user_by_username)
+get_pending_users_by_username = _awaitable(database.get_pending_users_by_username)
+get_users_by_keys = _awaitable(database.get_users_by_keys)
+get_all_users_by_role = _awaitable(database.get_all_users_by_role)
+get_team_users = _awaitable(database.get_team_users)
+get_managers_for_admin = _awaitable(database.get_managers_for_admin)
+filter_assignees = _awaitable(database.filter_assignees)
+
+# --- TENANTS ---
+async def create_tenant(name, telegram_id, username, admin_name, created_at):
+    try:
+        return await run(database.create_tenant, name, telegram_id, username, admin_name, created_at)
+    finally:
+        invalidate_user(telegram_id, username)
+
+
+async def accept_invite(token, telegram_id, username, name, now):
+    try:
+        return await run(database.accept_invite, token, telegram_id, username, name, now)
+    finally:
+        invalidate_user(telegram_id, username)
+
+
+count_tenants = _awaitable(database.count_tenants)
+get_tenant = _awaitable(database.get_tenant)
+get_tenant_ids = _awaitable(database.get_tenant_ids)
+create_invite = _awaitable(database.create_invite)
+
+# --- HIERARCHY ---
+get_org_users = _awaitable(database.get_org_users)
+get_subtree = _awaitable(database.get_subtree)
+is_under = _awaitable(database.is_under)
+in_tenant = _awaitable(database.in_tenant)
+
+# --- TASKS ---
+get_tasks_for_user = _awaitable(database.get_tasks_for_user)
+create_task = _batched(database.create_task)
+create_tasks = _batched(database.create_tasks)
+get_task_groups = _awaitable(database.get_task_groups)
+get_pending_in_groups = _awaitable(database.get_pending_in_groups)
+get_all_active_tasks = _awaitable(database.get_all_active_tasks)
+get_active_task = _awaitable(database.get_active_task)
+set_task_reminded = _awaitable(database.set_task_reminded)
+get_tasks_due = _awaitable(database.get_tasks_due)
+mark_task_done = _batched(database.mark_task_done)
+claim_newly_overdue = _awaitable(database.claim_newly_overdue)
+
+# --- REPORTS ---
+create_report = _batched(database.create_report)
+get_report = _awaitable(database.get_report)
+get_report_attachments = _awaitable(database.get_report_attachments)
+rate_report = _batched(database.rate_report)
+get_reports_for_supervisor = _awaitable(database.get_reports_for_supervisor)
+get_reports_for_user = _awaitable(database.get_reports_for_user)
+
+# --- ARCHIVE ---
+archive_reports = _awaitable(database.archive_reports)
+get_archived_report = _awaitable(database.get_archived_report)
+get_archived_reports_for_user = _awaitable(database.get_archived_reports_for_user)
+
+# --- EXPORT ---
+export_reports = _awaitable(database.export_reports)
+export_tasks = _awaitable(database.export_tasks)
+
+# --- NOTIFICATIONS ---
+async def set_notify_mode(user, mode):
+    try:
+        return await run(database.set_notify_mode, user['id'], mode)
+    finally:
+        invalidate_user(user['telegram_id'])
+
+
+get_notify_target = _awaitable(database.get_notify_target)
+get_digest_recipients = _awaitable(database.get_digest_recipients)
+get_digest = _awaitable(database.get_digest)
+
+# --- FSM ---
+get_fsm_record = _awaitable(database.get_fsm_record)
+save_fsm_records = _awaitable(database.save_fsm_records)
+delete_expired_fsm_records = _awaitable(database.delete_expired_fsm_records)
+
+# --- SEARCH ---
+search = _awaitable(database.search)
+
+# --- STATS ---
+get_stats = _awaitable(database.get_stats)
+get_period_stats = _awaitable(database.get_period_stats)
+get_leaderboard = _awaitable(database.get_leaderboard)
@@ -0,0 +1,139 @@
+"""پیوست گزارش‌ها: عکس، ویدیو، فایل، صدا و آلبوم
+
+فقط file_id و file_unique_id تلگرام در report_attachments ذخیره می‌شود؛ هیچ
+فایلی دانلود یا دوباره آپلود نمی‌شود و برای نمایش همان file_id دوباره فرستاده
+می‌شود (حداکثر MEDIA_GROUP_SIZE مورد در هر media group).
+
+آلبوم در تلگرام چند پیام جدا با media_group_id مشترک است. AlbumCollector
+پیام‌های یک آلبوم را جمع می‌کند و ALBUM_WAIT ثانیه بعد از آخرین تکه همه را با
+هم به یک گزارش تبدیل می‌کند؛ هندلر منتظر نمی‌ماند تا تکه‌های بعدی (که در حالت
+چندپروسه‌ای پشت آپدیت قبلی همان کاربر صف می‌کشند) معطل نشوند.
+"""
+import asyncio
+import logging
+
+from aiogram.types import InputMediaAudio, InputMediaDocument, InputMediaPhoto, InputMediaVideo
+
+ALBUM_WAIT = 1.0
+MEDIA_GROUP_SIZE = 10
+
+# animation پیش از document، چون پیام گیف هر دو فیلد را دارد
+KINDS = ('photo', 'video', 'animation', 'document', 'audio', 'voice', 'video_note')
+# نوع -> (متد ارسال تکی، نام آرگومان فایل)
+SENDERS = {
+    'photo': ('send_photo', 'photo'),
+    'video': ('send_video', 'video'),
+    'animation': ('send_animation', 'animation'),
+    'document': ('send_document', 'document'),
+    'audio': ('send_audio', 'audio'),
+    'voice': ('send_voice', 'voice'),
+    'video_note': ('send_video_note', 'video_note'),
+}
+# فقط این نوع‌ها در media group می‌آیند؛ عکس و ویدیو با هم، سند و صوت هر کدام جدا
+INPUT_MEDIA = {'photo': InputMediaPhoto, 'video': InputMediaVideo, 'document': InputMediaDocument, 'audio': InputMediaAudio}
+GROUP_KEYS = {'photo': 'visual', 'video': 'visual', 'document': 'document', 'audio': 'audio'}
+
+
+def extract(message):
+    """(kind, file_id, file_unique_id) پیوست پیام، یا None اگر پیوست پشتیبانی‌شده ندارد"""
+    if message.photo:
+        # بزرگ‌ترین اندازه
+        media = message.photo[-1]
+        return 'photo', media.file_id, media.file_unique_id
+    for kind in KINDS[1:]:
+        media = getattr(message, kind)
+        if media:
+            return kind, media.file_id, media.file_unique_id
+    return None
+
+
+def collect(messages):
+    """پیام‌های یک گزارش (یک پیام یا یک آلبوم) -> (متن، فهرست پیوست‌ها)"""
+    content = next((m.text or m.caption for m in messages if m.text or m.caption), "")
+    files = [item for item in map(extract, messages) if item]
+    return content, files
+
+
+def batches(rows):
+    """گروه‌بندی پیوست‌ها (به ترتیب) در دسته‌های قابل ارسال با یک درخواست
+
+    پیوست‌های پشت سر هم با GROUP_KEYS یکسان تا MEDIA_GROUP_SIZE تا در یک دسته‌اند؛
+    دسته‌ی تک‌عضوی و نوع‌های بدون media group تکی فرستاده می‌شوند.
+    """
+    batch, key = [], None
+    for row in rows:
+        row_key = GROUP_KEYS.get(row['kind'])
+        if batch and (row_key is None or row_key != key or len(batch) == MEDIA_GROUP_SIZE):
+            yield batch
+            batch = []
+        batch.append(row)
+        key = row_key
+    if batch:
+        yield batch
+
+
+async def send(bot, chat_id, rows):
+    for batch in batches(rows):
+        if len(batch) == 1:
+            method, arg = SENDERS[batch[0]['kind']]
+            await getattr(bot, method)(chat_id, **{arg: batch[0]['file_id']})
+        else:
+            media = [INPUT_MEDIA[row['kind']](media=row['file_id']) for row in batch]
+            await bot.send_media_group(chat_id, media)
+
+
+class _Album:
+    __slots__ = ("messages", "on_complete", "timer")
+
+    def __init__(self, on_complete):
+        self.messages = []
+        self.on_complete = on_complete
+        self.timer = None
+
+
+class AlbumCollector:
+    def __init__(self, wait=ALBUM_WAIT):
+        self.wait = wait
+        # (chat_id, media_group_id) -> _Album
+        self._albums = {}
+        self._running = set()
+
+    def __len__(self):
+        return len(self._albums)
+
+    def add(self, message, on_complete):
+        """افزودن یک تکه‌ی آلبوم؛ on_complete (async) با همه‌ی پیام‌های آلبوم صدا زده می‌شود
+
+        on_complete تکه‌ی اول استفاده می‌شود و بقیه نادیده گرفته می‌شوند.
+        """
+        key = (message.chat.id, message.media_group_id)
+        album = self._albums.get(key)
+        if album is None:
+            album = self._albums[key] = _Album(on_complete)
+        else:
+            album.timer.cancel()
+        album.messages.append(message)
+        album.timer = asyncio.get_running_loop().call_later(self.wait, self._complete, key)
+
+    def _complete(self, key):
+        album = self._albums.pop(key, None)
+        if album is None:
+            return
+        album.timer.cancel()
+        album.messages.sort(key=lambda m: m.message_id)
+        task = asyncio.create_task(self._run(album))
+        self._running.add(task)
+        task.add_done_callback(self._running.discard)
+
+    async def _run(self, album):
+        try:
+            await album.on_complete(album.messages)
+        except Exception:
+            logging.exception("saving album %s failed", album.messages[0].media_group_id)
+
+    async def stop(self):
+        """آلبوم‌های نیمه‌کاره همان‌طور که هستند ثبت شوند"""
+        for key in list(self._albums):
+            self._complete(key)
+        if self._running:
+            await asyncio.gather(*self._running, return_exceptions=True)
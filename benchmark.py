@@ -0,0 +1,422 @@
+"""بنچمارک آفلاین هندلرهای ربات
+
+یک دیتابیس با حجم دلخواه ساخته می‌شود و Updateهای ساختگی مستقیماً به
+Dispatcher.feed_update داده می‌شوند. Bot یک session بدون شبکه دارد که هر متد
+را بلافاصله با نتیجه‌ی ساختگی جواب می‌دهد، پس زمان‌های گزارش‌شده فقط هزینه‌ی
+هندلرها، middlewareها، FSM و دیتابیس است (صف outbox و محدودیت نرخ تلگرام
+عمداً نصب نمی‌شوند).
+
+    python benchmark.py --users 100000 --reports 1000000 --tasks 200000
+    python benchmark.py --flows start,show_reports --iterations 500 --json bench.json
+    python benchmark.py --baseline bench.json      # خروج با کد ۱ اگر p95 بدتر شده باشد
+
+دیتابیس ساخته‌شده (پیش‌فرض در پوشه‌ی temp) در اجرای بعدی دوباره استفاده
+می‌شود؛ برای ساخت دوباره --fresh بدهید.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+from datetime import datetime
+
+from aiogram import BaseMiddleware, Bot
+from aiogram.client.session.base import BaseSession
+from aiogram.types import Chat, Message, Update
+
+import async_database
+import database
+import timeutil
+from Dozio import create_dispatcher
+from textnorm import normalize
+
+DEFAULT_DB = os.path.join(tempfile.gettempdir(), 'dozio-bench.db')
+TEAM_SIZE = 50
+TELEGRAM_ID_BASE = 10_000_000
+BATCH = 20_000
+YEAR = 365 * timeutil.DAY
+
+VOCAB = (
+    "گزارش پروژه مشتری فروش جلسه طراحی پشتیبانی سفارش ارسال پیگیری تماس قرارداد "
+    "محتوا کمپین بازاریابی آموزش انبار فاکتور پرداخت تحویل بررسی تست انتشار سایت "
+    "اینستاگرام تبلیغات هماهنگی نمونه کیفیت بودجه تیم هفته امروز انجام ادامه مشکل "
+    "نهایی اولیه فوری گرافیک ویدیو پست استوری"
+).split()
+
+
+def _words(rng, low, high):
+    return " ".join(rng.choice(VOCAB) for _ in range(rng.randint(low, high)))
+
+
+# --- ساخت دیتابیس
+
+def seed(users, reports, tasks, team_size=TEAM_SIZE, seed=1):
+    """پر کردن دیتابیس database.DB_NAME (که باید خالی باشد) با داده‌ی ساختگی
+
+    کاربر ۱ مدیر اصلی است، پس از او users/team_size مدیر میانی و بقیه عضو
+    تیم‌ها هستند. گزارش‌ها در یک سال گذشته پخش شده‌اند و نیمی امتیاز دارند.
+    """
+    rng = random.Random(seed)
+    now = timeutil.now()
+    today = timeutil.day_start(now)
+    database.init_db()
+    managers = max(1, (users - 1) // team_size)
+    members = range(managers + 2, users + 1)
+
+    with database.transaction() as c:
+        c.execute("INSERT INTO tenants (id, name, created_at) VALUES (1, 'benchmark', ?)", (now,))
+        c.execute(
+            "INSERT INTO users (id, telegram_id, username, name, role, supervisor_id, tenant_id) VALUES (1, ?, ?, ?, 'admin', NULL, 1)",
+            (TELEGRAM_ID_BASE + 1, "bench_1", "مدیر اصلی")
+        )
+        c.executemany(
+            "INSERT INTO users (id, telegram_id, username, name, role, supervisor_id, tenant_id) VALUES (?, ?, ?, ?, ?, ?, 1)",
+            [(
+                i, TELEGRAM_ID_BASE + i, f"bench_{i}", f"کاربر {i}",
+                'manager' if i <= managers + 1 else 'member',
+                1 if i <= managers + 1 else 2 + i % managers,
+            ) for i in range(2, users + 1)]
+        )
+
+    for start in range(0, reports, BATCH):
+        rows = [(
+            rid, rng.randint(2, users), _words(rng, 8, 30),
+            now - rng.randrange(YEAR), rng.choice((None, rng.randint(1, 10))),
+        ) for rid in range(start + 1, min(reports, start + BATCH) + 1)]
+        with database.transaction() as c:
+            c.executemany("INSERT INTO reports (id, user_id, content, timestamp, score, tenant_id) VALUES (?, ?, ?, ?, ?, 1)", rows)
+            c.executemany("INSERT INTO reports_fts (rowid, content) VALUES (?, ?)",
+                          [(r[0], normalize(r[2])) for r in rows])
+
+    for start in range(0, tasks if members else 0, BATCH):
+        rows = []
+        for tid in range(start + 1, min(tasks, start + BATCH) + 1):
+            member = rng.choice(members)
+            reminder = rng.choice((('none', None), ('hour', 6), ('day', 1), ('day', 3)))
+            rows.append((
+                tid, _words(rng, 2, 5), _words(rng, 0, 15), 2 + member % managers, member,
+                today + rng.randint(-30, 60) * timeutil.DAY, *reminder,
+                int(rng.random() < 0.3), now - rng.randrange(YEAR // 4),
+            ))
+        with database.transaction() as c:
+            c.executemany('''
+                INSERT INTO tasks (id, title, description, assigned_by, assigned_to, deadline,
+                                   reminder_type, reminder_value, is_done, created_at, tenant_id)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 1)
+            ''', rows)
+            c.executemany("INSERT INTO tasks_fts (rowid, title, description) VALUES (?, ?, ?)",
+                          [(r[0], normalize(r[1]), normalize(r[2])) for r in rows])
+
+    # آمار تجمیعی یک‌جا ساخته می‌شود، نه با _bump_stats برای هر گزارش
+    with database.transaction() as c:
+        c.create_function("month_key", 1, timeutil.month_key, deterministic=True)
+        c.create_function("week_key", 1, timeutil.week_key, deterministic=True)
+        c.execute("DELETE FROM report_stats")
+        c.execute('''
+            INSERT INTO report_stats (scope, subject_id, period, reports, scored, score_sum, tenant_id)
+            SELECT CASE WHEN h.depth = 0 THEN 'user' ELSE 'team' END, h.ancestor_id,
+                   CASE p.kind WHEN 'month' THEN month_key(r.timestamp)
+                               WHEN 'week' THEN week_key(r.timestamp) ELSE 'all' END,
+                   COUNT(*), COUNT(r.score), COALESCE(SUM(r.score), 0), 1
+            FROM reports r
+            JOIN user_closure h ON h.descendant_id = r.user_id
+            CROSS JOIN (SELECT 'month' AS kind UNION ALL SELECT 'week' UNION ALL SELECT 'all') p
+            GROUP BY 1, 2, 3
+        ''')
+
+
+def load_actors(limit=10_000):
+    """کاربرانی که فلوها از طرف آن‌ها اجرا می‌شوند: {'admin': [...], 'manager': [...], 'member': [...]}"""
+    c = database.get_connection()
+    actors = {}
+    for role in ('admin', 'manager', 'member'):
+        rows = c.execute('''
+            SELECT telegram_id FROM users u
+            WHERE role = ? AND telegram_id IS NOT NULL
+              AND (role != 'manager' OR EXISTS (SELECT 1 FROM users m WHERE m.supervisor_id = u.id))
+            ORDER BY random() LIMIT ?
+        ''', (role, limit)).fetchall()
+        actors[role] = [row[0] for row in rows]
+    return actors
+
+
+# --- Bot بدون شبکه
+
+class OfflineSession(BaseSession):
+    """هر متد API بلافاصله جواب ساختگی می‌گیرد؛ آخرین کیبورد هر چت نگه داشته می‌شود"""
+
+    def __init__(self):
+        super().__init__()
+        self.calls = Counter()
+        self.markups = {}
+        self._message_ids = itertools.count(1)
+
+    async def make_request(self, bot, method, timeout=None):
+        self.calls[type(method).__name__] += 1
+        chat_id = getattr(method, 'chat_id', None)
+        markup = getattr(method, 'reply_markup', None)
+        if chat_id is not None and markup is not None:
+            self.markups[chat_id] = markup
+        if method.__returning__ is not Message:
+            return True
+        return Message(
+            message_id=next(self._message_ids), date=datetime.now(),
+            chat=Chat(id=chat_id, type='private'), text=getattr(method, 'text', None),
+        )
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        yield b""
+
+    async def close(self):
+        pass
+
+
+class HandlerTimer(BaseMiddleware):
+    """زمان اجرای هر هندلر (بدون outer middlewareها) به تفکیک نام تابع"""
+
+    def __init__(self, samples):
+        self.samples = samples
+
+    async def __call__(self, handler, event, data):
+        start = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            self.samples[data['handler'].callback.__name__].append(time.perf_counter() - start)
+
+
+class Driver:
+    """ساخت Updateهای ساختگی و فرستادن آن‌ها به dispatcher"""
+
+    def __init__(self, dp, bot):
+        self.dp = dp
+        self.bot = bot
+        self.update_latency = []
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1_000_000)
+
+    def _user(self, telegram_id):
+        return {'id': telegram_id, 'is_bot': False, 'first_name': f"کاربر {telegram_id}",
+                'username': f"bench_{telegram_id - TELEGRAM_ID_BASE}"}
+
+    def _message(self, telegram_id, text):
+        return {
+            'message_id': next(self._message_ids), 'date': int(time.time()),
+            'chat': {'id': telegram_id, 'type': 'private'},
+            'from': self._user(telegram_id), 'text': text,
+        }
+
+    async def _feed(self, payload):
+        update = Update.model_validate({'update_id': next(self._update_ids), **payload}, context={'bot': self.bot})
+        start = time.perf_counter()
+        await self.dp.feed_update(self.bot, update)
+        self.update_latency.append(time.perf_counter() - start)
+
+    async def send(self, telegram_id, text):
+        await self._feed({'message': self._message(telegram_id, text)})
+
+    async def click(self, telegram_id, data):
+        await self._feed({'callback_query': {
+            'id': str(next(self._update_ids)), 'from': self._user(telegram_id), 'chat_instance': 'bench',
+            'message': self._message(telegram_id, "..."), 'data': data,
+        }})
+
+
+# --- فلوها: هر کدام (نقش کاربر، تابع)
+
+async def _start(driver, tid, rng):
+    await driver.send(tid, "/start")
+
+
+async def _show_reports(driver, tid, rng):
+    await driver.send(tid, "📥 مشاهده گزارش‌ها")
+
+
+async def _handle_tasks(driver, tid, rng):
+    await driver.send(tid, "🗂 مشاهده تسک‌های فعال")
+
+
+async def _deadlines(driver, tid, rng):
+    await driver.send(tid, "⏰ سررسیدها")
+
+
+async def _search(driver, tid, rng):
+    await driver.send(tid, "/search " + " ".join(rng.sample(VOCAB, 2)))
+
+
+async def _stats(driver, tid, rng):
+    await driver.send(tid, "/stats")
+
+
+async def _task_creation(driver, tid, rng):
+    await driver.send(tid, "➕ تعریف تسک")
+    await driver.send(tid, _words(rng, 2, 5))
+    await driver.send(tid, _words(rng, 3, 15))
+    await driver.send(tid, timeutil.jalali_date(timeutil.add_days(timeutil.day_start(timeutil.now()), 7)))
+    await driver.send(tid, "3 روز")
+    # اولین نفر از کیبوردی که ربات واقعاً نشان داده
+    markup = driver.bot.session.markups.get(tid)
+    buttons = [b.callback_data for row in getattr(markup, 'inline_keyboard', []) for b in row]
+    await driver.click(tid, next((d for d in buttons if d.startswith("assign_mem_")), "assign_mem_0"))
+
+
+FLOWS = {
+    'start': ('member', _start),
+    'show_reports': ('manager', _show_reports),
+    'handle_tasks': ('member', _handle_tasks),
+    'deadlines': ('manager', _deadlines),
+    'search': ('manager', _search),
+    'stats': ('manager', _stats),
+    'task_creation': ('manager', _task_creation),
+}
+
+
+def percentile(samples, q):
+    """nearest-rank؛ samples باید مرتب باشد"""
+    if not samples:
+        return 0.0
+    return samples[min(len(samples) - 1, max(0, int(round(q / 100 * len(samples))) - 1))]
+
+
+def summarize(samples):
+    samples = sorted(samples)
+    return {
+        'count': len(samples),
+        'p50_ms': percentile(samples, 50) * 1000,
+        'p95_ms': percentile(samples, 95) * 1000,
+        'p99_ms': percentile(samples, 99) * 1000,
+    }
+
+
+async def run_flow(dp, bot, actors, func, iterations, concurrency, rng):
+    """iterations بار اجرای فلو با concurrency کاربر همزمان؛ هر کاربر مجازی کاربرهای جدا دارد"""
+    driver = Driver(dp, bot)
+    pools = [actors[i::concurrency] for i in range(concurrency)]
+    counts = [iterations // concurrency + (i < iterations % concurrency) for i in range(concurrency)]
+
+    async def worker(pool, count):
+        for i in range(count):
+            await func(driver, pool[i % len(pool)], rng)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker(pool, n) for pool, n in zip(pools, counts) if pool))
+    elapsed = time.perf_counter() - start
+    return {**summarize(driver.update_latency), 'flows_per_s': iterations / elapsed if elapsed else 0.0}
+
+
+async def run(args):
+    rng = random.Random(args.seed)
+    actors = await async_database.run(load_actors)
+    session = OfflineSession()
+    bot = Bot(token="42:OFFLINE-BENCHMARK", session=session)
+    dp = create_dispatcher(bot)
+    handler_samples = defaultdict(list)
+    dp.message.middleware(HandlerTimer(handler_samples))
+    dp.callback_query.middleware(HandlerTimer(handler_samples))
+
+    flows = {}
+    for name in args.flows:
+        role, func = FLOWS[name]
+        if not actors[role]:
+            logging.warning("flow %s skipped: no %s in database", name, role)
+            continue
+        flows[name] = await run_flow(dp, bot, actors[role], func, args.iterations, min(args.concurrency, len(actors[role])), rng)
+    await dp.storage.close()
+    handlers = {name: summarize(samples) for name, samples in sorted(handler_samples.items())}
+    return {'flows': flows, 'handlers': handlers, 'api_calls': dict(session.calls)}
+
+
+def format_table(title, rows, extra=None):
+    lines = [f"{title:<24}{'count':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}" + (f"{extra:>12}" if extra else "")]
+    for name, r in rows.items():
+        line = f"{name:<24}{r['count']:>8}{r['p50_ms']:>10.2f}{r['p95_ms']:>10.2f}{r['p99_ms']:>10.2f}"
+        if extra:
+            line += f"{r[extra]:>12.1f}"
+        lines.append(line)
+    return "\n".join(lines)
+
+
+def regressions(result, baseline, tolerance):
+    """فلوهایی که p95 آن‌ها بیش از tolerance (نسبی) از baseline بدتر شده"""
+    found = []
+    for name, r in result['flows'].items():
+        old = baseline.get('flows', {}).get(name)
+        if old and r['p95_ms'] > old['p95_ms'] * (1 + tolerance):
+            found.append(f"{name}: p95 {old['p95_ms']:.2f} -> {r['p95_ms']:.2f} ms")
+    return found
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--db', default=DEFAULT_DB, help="فایل دیتابیس بنچمارک (هرگز bot.db نه)")
+    parser.add_argument('--fresh', action='store_true', help="حذف و ساخت دوباره‌ی دیتابیس")
+    parser.add_argument('--users', type=int, default=10_000)
+    parser.add_argument('--reports', type=int, default=100_000)
+    parser.add_argument('--tasks', type=int, default=20_000)
+    parser.add_argument('--flows', default=",".join(FLOWS),
+                        type=lambda s: [f for f in s.split(',') if f])
+    parser.add_argument('--iterations', type=int, default=200, help="تعداد اجرای هر فلو")
+    parser.add_argument('--concurrency', type=int, default=8, help="کاربران همزمان")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', help="ذخیره‌ی نتیجه برای مقایسه‌ی بعدی")
+    parser.add_argument('--baseline', help="نتیجه‌ی ذخیره‌شده‌ی قبلی برای مقایسه")
+    parser.add_argument('--tolerance', type=float, default=0.25, help="حداکثر بدتر شدن مجاز p95 (نسبی)")
+    args = parser.parse_args(argv)
+    unknown = set(args.flows) - set(FLOWS)
+    if unknown:
+        parser.error(f"unknown flows: {', '.join(sorted(unknown))}; available: {', '.join(FLOWS)}")
+    if os.path.abspath(args.db) == os.path.abspath(database.DB_NAME):
+        parser.error("benchmark must not run against the bot database")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    # Dozio هنگام import سطح لاگ را INFO می‌کند
+    logging.getLogger().setLevel(logging.WARNING)
+    if args.fresh:
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(args.db + suffix):
+                os.remove(args.db + suffix)
+    fresh = not os.path.exists(args.db)
+    database.DB_NAME = args.db
+    if fresh:
+        start = time.perf_counter()
+        seed(args.users, args.reports, args.tasks, seed=args.seed)
+        print(f"seeded {args.db}: {args.users} users, {args.reports} reports, {args.tasks} tasks "
+              f"in {time.perf_counter() - start:.1f}s")
+    else:
+        database.init_db()
+        print(f"reusing {args.db} (--fresh to rebuild)")
+
+    async def _main():
+        try:
+            return await run(args)
+        finally:
+            await async_database.close()
+
+    result = asyncio.run(_main())
+    print()
+    print(format_table("flow (per update)", result['flows'], extra='flows_per_s') + "  flows/s")
+    print()
+    print(format_table("handler", result['handlers']))
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            found = regressions(result, json.load(f), args.tolerance)
+        if found:
+            print("\nregressions:\n  " + "\n  ".join(found))
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,68 @@
+"""کش درون‌پروسه‌ای LRU با انقضای زمانی"""
+import time
+from collections import OrderedDict
+
+MISSING = object()
+
+
+class TTLCache:
+    """کش محدود (LRU) که هر مقدار آن پس از ttl ثانیه منقضی می‌شود.
+
+    مقدار None هم کش می‌شود (مثلاً «این کاربر ثبت‌نام نکرده»)، پس برای
+    تشخیص نبودن کلید با MISSING مقایسه کنید.
+    """
+
+    def __init__(self, maxsize=1024, ttl=300.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        # با هر invalidate زیاد می‌شود تا نتیجه‌ی کوئری‌های همزمانِ قدیمی نوشته نشود
+        self.generation = 0
+        self._data = OrderedDict()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key):
+        item = self._data.get(key)
+        if item is not None:
+            expires_at, value = item
+            if expires_at > time.monotonic():
+                self._data.move_to_end(key)
+                self.hits += 1
+                return value
+            del self._data[key]
+        self.misses += 1
+        return MISSING
+
+    def set(self, key, value, generation=None):
+        if generation is not None and generation != self.generation:
+            return
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def invalidate(self, key):
+        self.generation += 1
+        self._data.pop(key, None)
+
+    def invalidate_where(self, predicate):
+        """حذف همه‌ی مقادیری که predicate برایشان True است"""
+        self.generation += 1
+        for key in [k for k, (_, v) in self._data.items() if predicate(v)]:
+            del self._data[key]
+
+    def clear(self):
+        self.generation += 1
+        self._data.clear()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / total if total else 0.0,
+        }
@@ -1 +1,45 @@
-BOT_TOKEN = "7780876648:AAGyKlexNXgjB1Xz141DC8Bbk3ccleKGjb8"
\ No newline at end of file
+import os
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# توکن هیچ پیش‌فرضی ندارد؛ بدون آن ربات اجرا نمی‌شود (require_bot_token)
+BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN", "")
+
+# حالت اجرا: 'polling' یا 'webhook'
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+# حداکثر تعداد آپدیت‌هایی که همزمان پردازش می‌شوند
+MAX_CONCURRENT_UPDATES = int(os.getenv("MAX_CONCURRENT_UPDATES", "32"))
+# تعداد پروسه‌های worker (sharding.py)؛ 1 یعنی همه‌چیز در یک پروسه مثل قبل
+WORKERS = int(os.getenv("WORKERS", "1"))
+# منطقه‌ی زمانی نمایش تاریخ‌ها و تعبیر ددلاین‌ها؛ در دیتابیس همه‌چیز epoch است
+TIMEZONE = os.getenv("BOT_TIMEZONE", "Asia/Tehran")
+# گزارش‌های قدیمی‌تر از این تعداد روز به جدول فشرده‌ی reports_archive منتقل می‌شوند؛ 0 یعنی هرگز
+REPORT_RETENTION_DAYS = int(os.getenv("REPORT_RETENTION_DAYS", "365"))
+# آیا هر کاربر تازه می‌تواند با /neworg سازمان جدید بسازد؛ در غیر این صورت فقط با لینک دعوت
+# (اولین کاربر دیتابیس خالی همیشه مدیر اصلی اولین سازمان می‌شود)
+ALLOW_NEW_TENANTS = os.getenv("ALLOW_NEW_TENANTS", "1") == "1"
+# اعلان‌های سرپرست در این بازه (ثانیه) جمع و در یک پیام فرستاده می‌شوند
+NOTIFY_WINDOW = int(os.getenv("NOTIFY_WINDOW", "600"))
+# ساعت ارسال خلاصه‌ی روزانه برای کسانی که /notify را روی «روزانه» گذاشته‌اند
+DIGEST_HOUR = int(os.getenv("DIGEST_HOUR", "20"))
+
+# --- webhook
+# آدرس عمومی ربات (مثلاً https://bot.example.com)؛ اگر خالی باشد setWebhook صدا زده نمی‌شود
+# و فقط سرور محلی بالا می‌آید (برای تست با POST کردن آپدیت‌های ضبط‌شده)
+WEBHOOK_BASE_URL = os.getenv("WEBHOOK_BASE_URL", "")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+WEBAPP_HOST = os.getenv("WEBAPP_HOST", "0.0.0.0")
+WEBAPP_PORT = int(os.getenv("WEBAPP_PORT", "8080"))
+# خروجی Prometheus روی همین سرور؛ مسیر خالی یعنی غیرفعال. اگر توکن داده شود
+# درخواست باید هدر Authorization: Bearer <token> داشته باشد
+METRICS_PATH = os.getenv("METRICS_PATH", "/metrics")
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+
+
+def require_bot_token():
+    """خروج با پیام روشن اگر TELEGRAM_BOT_TOKEN تنظیم نشده باشد (هنگام شروع ربات)"""
+    if not BOT_TOKEN:
+        raise SystemExit("TELEGRAM_BOT_TOKEN is not set; put the token from @BotFather in the environment or .env")
@@ -1,233 +1,949 @@
+import json
 import sqlite3
+import threading
+import zlib
+from contextlib import contextmanager
+
+import migrations
+from textnorm import normalize, fts_query
+from timeutil import month_key, week_key
 
 DB_NAME = 'bot.db'
+# تعداد اتصال‌های ماندگار (هر ترد اجرای کوئری یک اتصال مخصوص خودش دارد)
+POOL_SIZE = 4
+
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-16000",
+)
+
+_local = threading.local()
+_connections = []
+_connections_lock = threading.Lock()
+
+
+def get_connection():
+    """اتصال ماندگار ترد فعلی؛ فقط بار اول باز و تنظیم می‌شود"""
+    conn = getattr(_local, 'conn', None)
+    if conn is None or _local.db_name != DB_NAME:
+        conn = sqlite3.connect(DB_NAME, timeout=5, isolation_level=None, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        _local.conn = conn
+        _local.db_name = DB_NAME
+        with _connections_lock:
+            _connections.append(conn)
+    return conn
+
+
+def close_connections():
+    """بستن همه اتصال‌های باز (هنگام خاموش شدن ربات)"""
+    with _connections_lock:
+        for conn in _connections:
+            conn.close()
+        _connections.clear()
+    _local.__dict__.clear()
+
+
+@contextmanager
+def transaction():
+    """تراکنش صریح روی اتصال ترد فعلی؛ در صورت خطا rollback می‌شود
+
+    اگر اتصال از قبل داخل تراکنش باشد (write_batch) یک savepoint باز می‌شود تا
+    خطای یک نوشتن فقط همان را برگرداند.
+    """
+    conn = get_connection()
+    if conn.in_transaction:
+        conn.execute("SAVEPOINT nested")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK TO nested")
+            conn.execute("RELEASE nested")
+            raise
+        conn.execute("RELEASE nested")
+        return
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
+
+
+def write_batch(calls):
+    """group commit: چند تابع نوشتن (func, args, kwargs) در یک تراکنش و یک fsync
+
+    روی ترد نویسنده‌ی async_database اجرا می‌شود که اتصالش synchronous=FULL است،
+    پس بعد از برگشتن این تابع همه‌ی نوشتن‌ها روی دیسک‌اند. خروجی برای هر
+    فراخوانی (True، نتیجه) یا (False، استثنا)؛ خطای COMMIT به همه می‌رسد.
+    """
+    conn = get_connection()
+    if getattr(_local, 'writer', None) is not conn:
+        conn.execute("PRAGMA synchronous=FULL")
+        _local.writer = conn
+    results = []
+    with transaction():
+        for func, args, kwargs in calls:
+            try:
+                results.append((True, func(*args, **kwargs)))
+            except Exception as e:
+                results.append((False, e))
+    return results
+
 
 def init_db():
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    # جدول کاربران با username
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            telegram_id INTEGER UNIQUE,
-            username TEXT,
-            name TEXT,
-            role TEXT,                   -- 'admin', 'manager', 'member'
-            supervisor_id INTEGER        -- For member: manager.id, For manager: admin.id
-        )
-    ''')
-    # جدول تسک‌ها
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS tasks (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            title TEXT,
-            description TEXT,
-            assigned_by INTEGER,
-            assigned_to INTEGER,
-            deadline TEXT,
-            reminder_type TEXT DEFAULT 'none',
-            reminder_value INTEGER DEFAULT NULL,
-            is_done INTEGER DEFAULT 0,
-            is_urgent INTEGER DEFAULT 0,
-            created_at TEXT
-        )
-    ''')
-    # جدول گزارش‌ها
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS reports (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            task_id INTEGER,
-            user_id INTEGER,
-            content TEXT,
-            timestamp TEXT,
-            score INTEGER
-        )
-    ''')
-    conn.commit()
-    conn.close()
+    """به‌روزرسانی اسکیمای دیتابیس تا آخرین نسخه و بررسی انحراف آن"""
+    conn = get_connection()
+    migrations.migrate(conn)
+    migrations.check_schema(conn)
 
 # --- USERS ---
 def get_user_by_telegram_id(telegram_id):
-    conn = sqlite3.connect(DB_NAME)
-    conn.row_factory = sqlite3.Row
-    c = conn.cursor()
-    c.execute("SELECT * FROM users WHERE telegram_id = ?", (telegram_id,))
-    user = c.fetchone()
-    conn.close()
-    return user
-
-def get_user_by_username(username):
+    c = get_connection()
+    return c.execute("SELECT * FROM users WHERE telegram_id = ?", (telegram_id,)).fetchone()
+
+def get_user_by_username(username, tenant_id):
+    """کاربر سازمان tenant_id با این یوزرنیم (یوزرنیم فقط درون یک سازمان یکتا است)"""
     if not username:
         return None
-    conn = sqlite3.connect(DB_NAME)
-    conn.row_factory = sqlite3.Row
-    c = conn.cursor()
-    c.execute("SELECT * FROM users WHERE username = ?", (username,))
-    user = c.fetchone()
-    conn.close()
-    return user
-
-def create_user(telegram_id, username, name, role='member', supervisor_id=None):
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
+    c = get_connection()
+    return c.execute(
+        "SELECT * FROM users WHERE tenant_id = ? AND username = ?", (tenant_id, username)
+    ).fetchone()
+
+def get_pending_users_by_username(username, limit=2):
+    """ثبت‌های در انتظار (فقط یوزرنیم، بدون telegram_id) این یوزرنیم در همه‌ی سازمان‌ها"""
+    if not username:
+        return []
+    c = get_connection()
+    return c.execute(
+        "SELECT * FROM users WHERE username = ? AND telegram_id IS NULL ORDER BY id LIMIT ?", (username, limit)
+    ).fetchall()
+
+def _upsert_user(c, telegram_id, username, name, role, supervisor_id, tenant_id, position=None):
+    # یوزرنیم خالی یعنی «ندارد»؛ نباید با کاربران بی‌یوزرنیم دیگر یکی گرفته شود
+    username = username or None
+    users = c.execute(
+        'SELECT telegram_id, tenant_id FROM users WHERE telegram_id=? OR (username=? AND username IS NOT NULL)',
+        (telegram_id, username)
+    ).fetchall()
+    # حساب تلگرامی که در سازمان دیگری ثبت شده جابه‌جا نمی‌شود؛ ثبت‌های در انتظار
+    # (فقط یوزرنیم) سازمان‌های دیگر به این یکی ربطی ندارند
+    if any(u['tenant_id'] != tenant_id and u['telegram_id'] is not None for u in users):
+        return False
     # اگر قبلاً وجود داشته، فقط آپدیت کن
-    c.execute('SELECT id FROM users WHERE telegram_id=? OR (username=? AND username IS NOT NULL)', (telegram_id, username))
-    user = c.fetchone()
-    if user:
+    if any(u['tenant_id'] == tenant_id for u in users):
         c.execute('''
             UPDATE users
-            SET username=?, name=?, role=?, supervisor_id=?
-            WHERE telegram_id=? OR (username=? AND username IS NOT NULL)
-        ''', (username, name, role, supervisor_id, telegram_id, username))
+            SET telegram_id=COALESCE(?, telegram_id), username=?, name=?, role=?, supervisor_id=?,
+                position=COALESCE(?, position)
+            WHERE tenant_id = ? AND (telegram_id=? OR (username=? AND username IS NOT NULL))
+        ''', (telegram_id, username, name, role, supervisor_id, position, tenant_id, telegram_id, username))
     else:
         c.execute('''
-            INSERT INTO users (telegram_id, username, name, role, supervisor_id)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (telegram_id, username, name, role, supervisor_id))
-    conn.commit()
-    conn.close()
+            INSERT INTO users (telegram_id, username, name, role, supervisor_id, tenant_id, position)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', (telegram_id, username, name, role, supervisor_id, tenant_id, position))
+    return True
+
+def create_user(telegram_id, username, name, role='member', supervisor_id=None, tenant_id=None, position=None):
+    """ثبت کاربر در سازمان tenant_id یا به‌روزرسانی او؛ اگر عضو سازمان دیگری باشد False
+
+    position (سمت) جدا از نام ذخیره می‌شود؛ None سمت قبلی را تغییر نمی‌دهد.
+    """
+    with transaction() as c:
+        return _upsert_user(c, telegram_id, username, name, role, supervisor_id, tenant_id, position)
 
 
 def delete_user_by_telegram_id(telegram_id):
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    c.execute("DELETE FROM users WHERE telegram_id = ?", (telegram_id,))
-    conn.commit()
-    conn.close()
-
-def get_all_users_by_role(role):
-    conn = sqlite3.connect(DB_NAME)
-    conn.row_factory = sqlite3.Row
-    c = conn.cursor()
-    c.execute("SELECT * FROM users WHERE role = ?", (role,))
-    users = c.fetchall()
-    conn.close()
-    return users
+    with transaction() as c:
+        c.execute("DELETE FROM users WHERE telegram_id = ?", (telegram_id,))
+
+def get_users_by_keys(telegram_ids, usernames):
+    """کاربران با هر یک از آیدی‌ها یا یوزرنیم‌های داده‌شده در یک کوئری"""
+    c = get_connection()
+    return c.execute('''
+        SELECT * FROM users
+        WHERE telegram_id IN (SELECT value FROM json_each(?))
+           OR username IN (SELECT value FROM json_each(?))
+    ''', (json.dumps(list(telegram_ids)), json.dumps(list(usernames)))).fetchall()
+
+# سرپرست از روی آیدی/یوزرنیم (که ممکن است در دسته‌ی قبلی همین ورود ثبت شده باشد)
+_IMPORT_SUPERVISOR = '''COALESCE(
+    (SELECT id FROM users WHERE telegram_id = :sup_telegram_id AND tenant_id = :tenant_id),
+    (SELECT id FROM users WHERE username = :sup_username AND tenant_id = :tenant_id),
+    :default_supervisor_id
+)'''
+
+def import_users(levels):
+    """ثبت یا به‌روزرسانی گروهی کاربران در یک تراکنش
+
+    levels فهرستی از دسته‌های ردیف است (خروجی team_import.to_params)؛ هر دسته
+    با executemany نوشته می‌شود و سرپرست ردیف‌های هر دسته در دسته‌های قبلی
+    است. منطق تطبیق همان create_user است: اول با telegram_id، بعد با یوزرنیم،
+    و فقط در سازمان خود ردیف (tenant_id).
+    """
+    with transaction() as c:
+        for level in levels:
+            with_id = [row for row in level if row['telegram_id'] is not None]
+            username_only = [row for row in level if row['telegram_id'] is None]
+            # کاربری که قبلاً فقط با یوزرنیم ثبت شده، آیدی عددی‌اش را می‌گیرد
+            c.executemany('''
+                UPDATE users SET telegram_id = :telegram_id
+                WHERE username = :username AND telegram_id IS NULL AND tenant_id = :tenant_id
+                  AND NOT EXISTS (SELECT 1 FROM users WHERE telegram_id = :telegram_id)
+            ''', [row for row in with_id if row['username']])
+            c.executemany(f'''
+                INSERT INTO users (telegram_id, username, name, position, role, supervisor_id, tenant_id)
+                VALUES (:telegram_id, :username, :name, :position, :role, {_IMPORT_SUPERVISOR}, :tenant_id)
+                ON CONFLICT(telegram_id) DO UPDATE SET
+                    username = COALESCE(excluded.username, username),
+                    name = excluded.name,
+                    position = COALESCE(excluded.position, position),
+                    role = excluded.role,
+                    supervisor_id = excluded.supervisor_id
+                WHERE users.tenant_id = excluded.tenant_id
+            ''', with_id)
+            c.executemany(f'''
+                UPDATE users SET name = :name, position = COALESCE(:position, position), role = :role,
+                                 supervisor_id = {_IMPORT_SUPERVISOR}
+                WHERE username = :username AND tenant_id = :tenant_id
+            ''', username_only)
+            c.executemany(f'''
+                INSERT INTO users (username, name, position, role, supervisor_id, tenant_id)
+                SELECT :username, :name, :position, :role, {_IMPORT_SUPERVISOR}, :tenant_id
+                WHERE NOT EXISTS (SELECT 1 FROM users WHERE username = :username AND tenant_id = :tenant_id)
+            ''', username_only)
+    return sum(len(level) for level in levels)
+
+def get_all_users_by_role(role, tenant_id):
+    c = get_connection()
+    return c.execute("SELECT * FROM users WHERE tenant_id = ? AND role = ?", (tenant_id, role)).fetchall()
 
 def get_team_users(manager_id):
     """لیست اعضای تیم یک مدیر میانی"""
-    conn = sqlite3.connect(DB_NAME)
-    conn.row_factory = sqlite3.Row
-    c = conn.cursor()
-    c.execute("SELECT * FROM users WHERE supervisor_id = ? AND role = 'member'", (manager_id,))
-    users = c.fetchall()
-    conn.close()
-    return users
+    c = get_connection()
+    return c.execute("SELECT * FROM users WHERE supervisor_id = ? AND role = 'member'", (manager_id,)).fetchall()
 
 def get_managers_for_admin(admin_id):
     """لیست همه مدیرهای میانی یک مدیر اصلی"""
-    conn = sqlite3.connect(DB_NAME)
-    conn.row_factory = sqlite3.Row
-    c = conn.cursor()
-    c.execute("SELECT * FROM users WHERE supervisor_id = ? AND role = 'manager'", (admin_id,))
-    managers = c.fetchall()
-    conn.close()
-    return managers
+    c = get_connection()
+    return c.execute("SELECT * FROM users WHERE supervisor_id = ? AND role = 'manager'", (admin_id,)).fetchall()
+
+# دریافت‌کننده‌های مجاز تسک: مدیر اصلی به مدیران میانی و مدیر میانی به اعضای تیم خودش
+def _assignee_scope(assigner_role, assigner_id):
+    if assigner_role == 'admin':
+        return "tenant_id = (SELECT tenant_id FROM users WHERE id = ?) AND role = 'manager'", [assigner_id]
+    return "supervisor_id = ? AND role = 'member'", [assigner_id]
+
+def get_assignees(assigner_role, assigner_id, prefix=None, after_id=None, before_id=None, limit=20):
+    """دریافت‌کننده‌های مجاز به ترتیب (name, id)؛ صفحه‌بندی keyset و جستجوی پیشوندی روی ایندکس نام"""
+    where, params = _assignee_scope(assigner_role, assigner_id)
+    if prefix:
+        # بازه به جای LIKE تا ایندکس (با collation پیش‌فرض) استفاده شود
+        where += " AND name >= ? AND name < ?"
+        params += [prefix, prefix + '\U0010ffff']
+    order = "ASC"
+    if after_id is not None:
+        where += " AND (name, id) > (SELECT name, id FROM users WHERE id = ?)"
+        params.append(after_id)
+    elif before_id is not None:
+        where += " AND (name, id) < (SELECT name, id FROM users WHERE id = ?)"
+        params.append(before_id)
+        order = "DESC"
+    c = get_connection()
+    rows = c.execute(
+        f"SELECT id, telegram_id, name FROM users WHERE {where} ORDER BY name {order}, id {order} LIMIT ?",
+        params + [limit]
+    ).fetchall()
+    return rows[::-1] if order == "DESC" else rows
+
+def filter_assignees(assigner_role, assigner_id, user_ids=None):
+    """شناسه‌هایی از user_ids که assigner می‌تواند به آن‌ها تسک بدهد (بدون user_ids: همه)"""
+    where, params = _assignee_scope(assigner_role, assigner_id)
+    if user_ids is not None:
+        where += " AND id IN (SELECT value FROM json_each(?))"
+        params.append(json.dumps(list(user_ids)))
+    c = get_connection()
+    return [row[0] for row in c.execute(f"SELECT id FROM users WHERE {where} ORDER BY name, id", params)]
+
+# --- TENANTS ---
+def count_tenants():
+    c = get_connection()
+    return c.execute("SELECT COUNT(*) FROM tenants").fetchone()[0]
+
+def get_tenant(tenant_id):
+    c = get_connection()
+    return c.execute("SELECT * FROM tenants WHERE id = ?", (tenant_id,)).fetchone()
+
+def get_tenant_ids():
+    c = get_connection()
+    return [row[0] for row in c.execute("SELECT id FROM tenants ORDER BY id")]
+
+def create_tenant(name, telegram_id, username, admin_name, created_at):
+    """ساخت سازمان جدید و مدیر اصلی آن در یک تراکنش؛ شناسه‌ی سازمان، یا None اگر این حساب جای دیگری عضو است"""
+    with transaction() as c:
+        if c.execute("SELECT 1 FROM users WHERE telegram_id = ?", (telegram_id,)).fetchone():
+            return None
+        tenant_id = c.execute(
+            "INSERT INTO tenants (name, created_at) VALUES (?, ?)", (name, created_at)
+        ).lastrowid
+        _upsert_user(c, telegram_id, username, admin_name, 'admin', None, tenant_id)
+    return tenant_id
+
+def create_invite(token, tenant_id, role, supervisor_id, created_at, expires_at, uses):
+    with transaction() as c:
+        c.execute('''
+            INSERT INTO invites (token, tenant_id, role, supervisor_id, created_at, expires_at, uses_left)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', (token, tenant_id, role, supervisor_id, created_at, expires_at, uses))
+
+def accept_invite(token, telegram_id, username, name, now):
+    """عضویت با لینک دعوت در یک تراکنش
+
+    ردیف دعوت (با نام سازمان در tenant_name) برمی‌گرداند؛ None اگر لینک نامعتبر،
+    منقضی یا تمام‌شده باشد و False اگر این حساب عضو سازمان دیگری است.
+    """
+    with transaction() as c:
+        invite = c.execute('''
+            SELECT i.*, t.name AS tenant_name FROM invites i
+            JOIN tenants t ON t.id = i.tenant_id
+            WHERE i.token = ? AND i.expires_at > ? AND i.uses_left > 0
+        ''', (token, now)).fetchone()
+        if invite is None:
+            return None
+        if not _upsert_user(c, telegram_id, username, name, invite['role'], invite['supervisor_id'], invite['tenant_id']):
+            return False
+        c.execute("UPDATE invites SET uses_left = uses_left - 1 WHERE token = ?", (token,))
+    return invite
+
+# --- HIERARCHY ---
+def get_org_users(tenant_id):
+    """همه‌ی کاربران یک سازمان در یک کوئری (برای ساختن درخت کل سازمان)"""
+    c = get_connection()
+    return c.execute(
+        "SELECT id, telegram_id, username, name, position, role, supervisor_id FROM users WHERE tenant_id = ?",
+        (tenant_id,)
+    ).fetchall()
+
+def get_subtree(root_id):
+    """کاربر root_id و همه‌ی زیرمجموعه‌هایش در هر عمقی، با فاصله از root"""
+    c = get_connection()
+    return c.execute('''
+        SELECT u.id, u.telegram_id, u.username, u.name, u.position, u.role, u.supervisor_id, h.depth
+        FROM user_closure h
+        JOIN users u ON u.id = h.descendant_id
+        WHERE h.ancestor_id = ?
+    ''', (root_id,)).fetchall()
+
+def in_tenant(tenant_id, user_id):
+    c = get_connection()
+    return c.execute("SELECT 1 FROM users WHERE id = ? AND tenant_id = ?", (user_id, tenant_id)).fetchone() is not None
+
+def is_under(ancestor_id, descendant_id):
+    """آیا descendant_id در هر عمقی زیرمجموعه‌ی ancestor_id است (خود کاربر نه)"""
+    c = get_connection()
+    return c.execute(
+        "SELECT 1 FROM user_closure WHERE ancestor_id = ? AND descendant_id = ? AND depth > 0",
+        (ancestor_id, descendant_id)
+    ).fetchone() is not None
 
 # --- TASKS ---
-def get_tasks_for_user(telegram_id):
-    conn = sqlite3.connect(DB_NAME)
-    conn.row_factory = sqlite3.Row
-    c = conn.cursor()
-    c.execute('''
-        SELECT t.id, t.title, t.description, t.deadline, t.reminder_type, t.reminder_value
+def get_tasks_for_user(telegram_id, after_id=None, before_id=None, limit=None):
+    """تسک‌های فعال کاربر به ترتیب id؛ با after_id/before_id صفحه‌بندی keyset می‌شود
+
+    روی ایندکس جزئی idx_tasks_assigned_to_active، پس هزینه به تعداد تسک‌های باز
+    بستگی دارد نه به کل تاریخچه؛ reports تعداد گزارش‌های ثبت‌شده روی هر تسک است.
+    """
+    c = get_connection()
+    sql = '''
+        SELECT t.id, t.title, t.description, t.deadline, t.reminder_type, t.reminder_value,
+               (SELECT COUNT(*) FROM reports r WHERE r.task_id = t.id) AS reports
         FROM tasks t
         JOIN users u ON u.id = t.assigned_to
         WHERE u.telegram_id = ? AND t.is_done = 0
-    ''', (telegram_id,))
-    tasks = c.fetchall()
-    conn.close()
-    return tasks
+    '''
+    params = [telegram_id]
+    if before_id is not None:
+        # صفحه‌ی قبل: نزدیک‌ترین‌ها به cursor را بگیر و بعد برعکس کن
+        sql += " AND t.id < ? ORDER BY t.id DESC"
+        params.append(before_id)
+    else:
+        if after_id is not None:
+            sql += " AND t.id > ?"
+            params.append(after_id)
+        sql += " ORDER BY t.id ASC"
+    if limit is not None:
+        sql += " LIMIT ?"
+        params.append(limit)
+    rows = c.execute(sql, params).fetchall()
+    return rows[::-1] if before_id is not None else rows
 
 def create_task(title, description, assigned_by, assigned_to, deadline, reminder_type, reminder_value, is_urgent, created_at):
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    c.execute('''
-        INSERT INTO tasks (title, description, assigned_by, assigned_to, deadline, reminder_type, reminder_value, is_urgent, created_at)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-    ''', (title, description, assigned_by, assigned_to, deadline, reminder_type, reminder_value, is_urgent, created_at))
-    conn.commit()
-    conn.close()
+    with transaction() as c:
+        cur = c.execute('''
+            INSERT INTO tasks (title, description, assigned_by, assigned_to, deadline, reminder_type, reminder_value, is_urgent, created_at, tenant_id)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, (SELECT tenant_id FROM users WHERE id = ?))
+        ''', (title, description, assigned_by, assigned_to, deadline, reminder_type, reminder_value, is_urgent, created_at, assigned_to))
+        c.execute(
+            "INSERT INTO tasks_fts (rowid, title, description) VALUES (?, ?, ?)",
+            (cur.lastrowid, normalize(title), normalize(description))
+        )
+    return cur.lastrowid
+
+def create_tasks(assignee_ids, title, description, assigned_by, deadline, reminder_type, reminder_value, is_urgent, created_at):
+    """ساخت یک تسک برای یک یا چند نفر در یک تراکنش
+
+    برای بیش از یک نفر یک ردیف task_groups هم ساخته می‌شود تا پیشرفت کل گروه
+    قابل پیگیری باشد. خروجی (group_id، ردیف‌های ساخته‌شده همراه با
+    user_telegram_id برای اعلان و زمان‌بندی یادآوری).
+    """
+    with transaction() as c:
+        group_id = None
+        if len(assignee_ids) > 1:
+            group_id = c.execute(
+                "INSERT INTO task_groups (title, assigned_by, created_at, tenant_id) VALUES (?, ?, ?, (SELECT tenant_id FROM users WHERE id = ?))",
+                (title, assigned_by, created_at, assigned_by)
+            ).lastrowid
+        params = [
+            (title, description, assigned_by, assignee_id, deadline, reminder_type, reminder_value, is_urgent, created_at, group_id, assignee_id)
+            for assignee_id in assignee_ids
+        ]
+        sql = '''
+            INSERT INTO tasks (title, description, assigned_by, assigned_to, deadline, reminder_type, reminder_value, is_urgent, created_at, group_id, tenant_id)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, (SELECT tenant_id FROM users WHERE id = ?))
+        '''
+        if group_id:
+            c.executemany(sql, params)
+            where, key = "t.group_id = ?", group_id
+        else:
+            # executemany شناسه‌ی ردیف را برنمی‌گرداند
+            where, key = "t.id = ?", c.execute(sql, params[0]).lastrowid
+        c.execute(
+            f"INSERT INTO tasks_fts (rowid, title, description) SELECT t.id, ?, ? FROM tasks t WHERE {where}",
+            (normalize(title), normalize(description), key)
+        )
+        rows = c.execute(f'''
+            SELECT t.*, u.telegram_id as user_telegram_id, u.name as user_name
+            FROM tasks t
+            JOIN users u ON t.assigned_to = u.id
+            WHERE {where}
+        ''', (key,)).fetchall()
+    return group_id, rows
+
+def get_task_groups(assigned_by, limit=10):
+    """تسک‌های گروهی اخیر یک مدیر با تعداد کل و انجام‌شده"""
+    c = get_connection()
+    return c.execute('''
+        SELECT g.id, g.title, g.created_at, COUNT(t.id) AS total, SUM(t.is_done) AS done
+        FROM task_groups g
+        JOIN tasks t ON t.group_id = g.id
+        WHERE g.assigned_by = ?
+        GROUP BY g.id
+        ORDER BY g.id DESC
+        LIMIT ?
+    ''', (assigned_by, limit)).fetchall()
+
+def get_pending_in_groups(group_ids):
+    """نام کسانی که تسک گروهی‌شان هنوز انجام نشده، برای چند گروه در یک کوئری"""
+    c = get_connection()
+    return c.execute('''
+        SELECT t.group_id, u.name
+        FROM tasks t
+        JOIN users u ON u.id = t.assigned_to
+        WHERE t.group_id IN (SELECT value FROM json_each(?)) AND t.is_done = 0
+        ORDER BY t.group_id, u.name
+    ''', (json.dumps(list(group_ids)),)).fetchall()
 
 def get_all_active_tasks():
-    conn = sqlite3.connect(DB_NAME)
-    conn.row_factory = sqlite3.Row
-    c = conn.cursor()
-    c.execute('''
+    c = get_connection()
+    return c.execute('''
         SELECT t.*, u.telegram_id as user_telegram_id, u.name as user_name
         FROM tasks t
         JOIN users u ON t.assigned_to = u.id
         WHERE t.is_done = 0
-    ''')
-    tasks = c.fetchall()
-    conn.close()
-    return tasks
-
-def mark_task_done(task_id):
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    c.execute('UPDATE tasks SET is_done = 1 WHERE id = ?', (task_id,))
-    conn.commit()
-    conn.close()
+    ''').fetchall()
+
+def get_active_task(task_id):
+    """یک تسک فعال به همراه اطلاعات دریافت‌کننده (برای ارسال یادآوری)"""
+    c = get_connection()
+    return c.execute('''
+        SELECT t.*, u.telegram_id as user_telegram_id, u.name as user_name
+        FROM tasks t
+        JOIN users u ON t.assigned_to = u.id
+        WHERE t.id = ? AND t.is_done = 0
+    ''', (task_id,)).fetchone()
+
+def set_task_reminded(task_id, reminded_at):
+    with transaction() as c:
+        c.execute('UPDATE tasks SET last_reminded_at = ? WHERE id = ?', (reminded_at, task_id))
+
+def get_tasks_due(start=None, end=None, scope_id=None, tenant_id=None, limit=50):
+    """تسک‌های فعال با ددلاین در بازه‌ی [start, end) به ترتیب ددلاین (epoch)
+
+    بدون scope_id همه‌ی تسک‌های سازمان tenant_id روی ایندکس جزئی
+    idx_tasks_tenant_active_deadline؛ با scope_id فقط تسک‌های آن کاربر و زیرمجموعه‌هایش.
+    """
+    c = get_connection()
+    join, where, params = "", "", []
+    if scope_id is not None:
+        join = "JOIN user_closure h ON h.descendant_id = t.assigned_to AND h.ancestor_id = ?"
+        params.append(scope_id)
+    else:
+        where += " AND t.tenant_id = ?"
+        params.append(tenant_id)
+    if start is not None:
+        where += " AND t.deadline >= ?"
+        params.append(start)
+    if end is not None:
+        where += " AND t.deadline < ?"
+        params.append(end)
+    return c.execute(f'''
+        SELECT t.id, t.title, t.deadline, t.assigned_to, u.name AS user_name
+        FROM tasks t
+        {join}
+        JOIN users u ON u.id = t.assigned_to
+        WHERE t.is_done = 0 AND t.deadline IS NOT NULL {where}
+        ORDER BY t.deadline, t.id
+        LIMIT ?
+    ''', params + [limit]).fetchall()
+
+def mark_task_done(task_id, assigned_to, done_at):
+    """علامت انجام تسک assigned_to با یک UPDATE شرطی
+
+    ردیف تسک (برای اعلان به assigned_by) یا None اگر قبلاً انجام شده یا مال این کاربر نیست؛
+    دو کلیک همزمان فقط یک بار انجامش می‌کنند.
+    """
+    with transaction() as c:
+        return c.execute('''
+            UPDATE tasks SET is_done = 1, done_at = ?
+            WHERE id = ? AND assigned_to = ? AND is_done = 0
+            RETURNING id, title, assigned_by, assigned_to,
+                      (SELECT name FROM users WHERE id = tasks.assigned_to) AS user_name
+        ''', (done_at, task_id, assigned_to)).fetchone()
+
+def claim_newly_overdue(tenant_id, day):
+    """تسک‌های انجام‌نشده‌ای که ددلاینشان بعد از آخرین روز بررسی‌شده‌ی سازمان تا روز day
+    (epoch شروع روز) بوده است؛ day به عنوان روز بررسی‌شده ثبت می‌شود
+
+    پس روزهایی که ربات ساعت بررسی خاموش بوده دفعه‌ی بعد جبران می‌شوند و هیچ روزی دو
+    بار بررسی نمی‌شود. سازمانی که هنوز بررسی نشده فقط از روز day شروع می‌کند.
+    """
+    with transaction() as c:
+        last = c.execute("SELECT overdue_checked_day FROM tenants WHERE id = ?", (tenant_id,)).fetchone()
+        last = last[0] if last and last[0] is not None else day - 1
+        if last >= day:
+            return []
+        rows = c.execute('''
+            SELECT t.id, t.title, t.assigned_by, t.assigned_to, u.name AS user_name
+            FROM tasks t
+            JOIN users u ON u.id = t.assigned_to
+            WHERE t.tenant_id = ? AND t.is_done = 0 AND t.deadline > ? AND t.deadline <= ?
+        ''', (tenant_id, last, day)).fetchall()
+        c.execute("UPDATE tenants SET overdue_checked_day = ? WHERE id = ?", (day, tenant_id))
+    return rows
 
 # --- REPORTS ---
-def create_report(task_id, user_id, content, timestamp):
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    c.execute('''
-        INSERT INTO reports (task_id, user_id, content, timestamp)
-        VALUES (?, ?, ?, ?)
-    ''', (task_id, user_id, content, timestamp))
-    conn.commit()
-    conn.close()
+def create_report(task_id, user_id, content, timestamp, attachments=()):
+    """ثبت گزارش؛ task_id فقط اگر تسک مال خود نویسنده باشد ذخیره می‌شود (وگرنه NULL)
+
+    attachments: فهرست (kind, file_id, file_unique_id) که در همان تراکنش ثبت می‌شوند.
+    """
+    with transaction() as c:
+        cur = c.execute('''
+            INSERT INTO reports (task_id, user_id, content, timestamp, tenant_id)
+            VALUES ((SELECT id FROM tasks WHERE id = ? AND assigned_to = ?), ?, ?, ?,
+                    (SELECT tenant_id FROM users WHERE id = ?))
+        ''', (task_id, user_id, user_id, content, timestamp, user_id))
+        c.execute("INSERT INTO reports_fts (rowid, content) VALUES (?, ?)", (cur.lastrowid, normalize(content)))
+        if attachments:
+            c.executemany(
+                "INSERT INTO report_attachments (report_id, kind, file_id, file_unique_id) VALUES (?, ?, ?, ?)",
+                [(cur.lastrowid, *item) for item in attachments]
+            )
+        _bump_stats(c, user_id, timestamp, reports=1)
+    return cur.lastrowid
+
+def get_report_attachments(report_id):
+    c = get_connection()
+    return c.execute(
+        "SELECT kind, file_id FROM report_attachments WHERE report_id = ? ORDER BY id", (report_id,)
+    ).fetchall()
+
+def get_report(report_id):
+    c = get_connection()
+    return c.execute("SELECT * FROM reports WHERE id = ?", (report_id,)).fetchone()
 
 def rate_report(report_id, score):
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    c.execute('UPDATE reports SET score = ? WHERE id = ?', (score, report_id))
-    conn.commit()
-    conn.close()
-
-def get_reports_for_supervisor(supervisor_id, all_admin=False):
-    conn = sqlite3.connect(DB_NAME)
-    conn.row_factory = sqlite3.Row
-    c = conn.cursor()
+    with transaction() as c:
+        report = c.execute("SELECT user_id, timestamp, score FROM reports WHERE id = ?", (report_id,)).fetchone()
+        if report is None:
+            return
+        c.execute('UPDATE reports SET score = ? WHERE id = ?', (score, report_id))
+        # امتیاز دوباره جایگزین امتیاز قبلی می‌شود
+        _bump_stats(
+            c, report['user_id'], report['timestamp'],
+            scored=(score is not None) - (report['score'] is not None),
+            score_sum=(score or 0) - (report['score'] or 0),
+        )
+
+def _report_keyset(before_id, after_id, table='reports'):
+    """شرط keyset روی (timestamp, id) نسبت به گزارش cursor و جهت مرتب‌سازی"""
+    if after_id is not None:
+        return f"AND (r.timestamp, r.id) > (SELECT timestamp, id FROM {table} WHERE id = ?)", [after_id], "ASC"
+    if before_id is not None:
+        return f"AND (r.timestamp, r.id) < (SELECT timestamp, id FROM {table} WHERE id = ?)", [before_id], "DESC"
+    return "", [], "DESC"
+
+def get_reports_for_supervisor(supervisor_id, all_admin=False, before_id=None, after_id=None, limit=20):
+    """گزارش‌ها از جدید به قدیم؛ before_id صفحه‌ی قدیمی‌تر و after_id صفحه‌ی جدیدتر را می‌دهد"""
+    c = get_connection()
+    keyset, params, order = _report_keyset(before_id, after_id)
     if all_admin:
-        # مدیر اصلی: تمام گزارش‌های کاربران و مدیرها را می‌بیند (غیراز خودش)
-        c.execute('''
-            SELECT r.id, r.content, r.timestamp, r.score, u.name
-            FROM reports r
-            JOIN users u ON r.user_id = u.id
-            WHERE u.role IN ('manager', 'member')
-            ORDER BY r.timestamp DESC
-            LIMIT 20
-        ''')
+        # مدیر اصلی: تمام گزارش‌های کاربران و مدیرهای سازمانش را می‌بیند (غیراز خودش)
+        # CROSS JOIN ترتیب حلقه را ثابت می‌کند تا ایندکس (tenant_id, timestamp) بدون مرتب‌سازی پیمایش شود
+        join = "CROSS JOIN"
+        where = "r.tenant_id = (SELECT tenant_id FROM users WHERE id = ?) AND u.role IN ('manager', 'member')"
+        params = [supervisor_id] + params
     else:
-        # مدیر میانی: فقط گزارش اعضای تیم خودش
-        c.execute('''
-            SELECT r.id, r.content, r.timestamp, r.score, u.name
-            FROM reports r
-            JOIN users u ON r.user_id = u.id
-            WHERE u.supervisor_id = ? AND u.role = 'member'
-            ORDER BY r.timestamp DESC
-            LIMIT 20
-        ''', (supervisor_id,))
-    result = c.fetchall()
-    conn.close()
-    return result
-
-def get_reports_for_user(user_id):
-    """نمایش گزارش‌های ثبت شده توسط خود کاربر"""
-    conn = sqlite3.connect(DB_NAME)
-    conn.row_factory = sqlite3.Row
-    c = conn.cursor()
+        # مدیر میانی: گزارش همه‌ی زیرمجموعه‌هایش در هر عمقی
+        join = "JOIN user_closure h ON h.descendant_id = r.user_id JOIN"
+        where = "h.ancestor_id = ? AND h.depth > 0"
+        params = [supervisor_id] + params
+    rows = c.execute(f'''
+        SELECT r.id, r.content, r.timestamp, r.score, u.name,
+               (SELECT title FROM tasks WHERE id = r.task_id) AS task_title,
+               (SELECT COUNT(*) FROM report_attachments a WHERE a.report_id = r.id) AS attachments
+        FROM reports r
+        {join} users u ON r.user_id = u.id
+        WHERE {where} {keyset}
+        ORDER BY r.timestamp {order}, r.id {order}
+        LIMIT ?
+    ''', params + [limit]).fetchall()
+    return rows[::-1] if order == "ASC" else rows
+
+def get_reports_for_user(user_id, before_id=None, after_id=None, limit=20):
+    """نمایش گزارش‌های ثبت شده توسط خود کاربر (از جدید به قدیم)"""
+    c = get_connection()
+    keyset, params, order = _report_keyset(before_id, after_id)
+    rows = c.execute(f'''
+        SELECT r.id, r.content, r.timestamp, r.score,
+               (SELECT title FROM tasks WHERE id = r.task_id) AS task_title,
+               (SELECT COUNT(*) FROM report_attachments a WHERE a.report_id = r.id) AS attachments
+        FROM reports r
+        WHERE r.user_id = ? {keyset}
+        ORDER BY r.timestamp {order}, r.id {order}
+        LIMIT ?
+    ''', [user_id] + params + [limit]).fetchall()
+    return rows[::-1] if order == "ASC" else rows
+
+# --- ARCHIVE ---
+def archive_reports(tenant_id, before, limit=500):
+    """انتقال حداکثر limit گزارش سازمان tenant_id قدیمی‌تر از before (epoch) به reports_archive در یک تراکنش کوتاه
+
+    متن با zlib فشرده می‌شود؛ report_stats دست نمی‌خورد و ردیف FTS حذف می‌شود.
+    تعداد گزارش‌های منتقل‌شده را برمی‌گرداند (کمتر از limit یعنی کار تمام است).
+    """
+    with transaction() as c:
+        rows = c.execute('''
+            SELECT id, task_id, user_id, timestamp, score, tenant_id, content FROM reports
+            WHERE tenant_id = ? AND timestamp < ? ORDER BY timestamp LIMIT ?
+        ''', (tenant_id, before, limit)).fetchall()
+        if not rows:
+            return 0
+        c.executemany('''
+            INSERT OR REPLACE INTO reports_archive (id, task_id, user_id, timestamp, score, tenant_id, content)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', [(*row[:6], zlib.compress((row['content'] or '').encode('utf-8'))) for row in rows])
+        ids = json.dumps([row['id'] for row in rows])
+        c.execute("DELETE FROM reports_fts WHERE rowid IN (SELECT value FROM json_each(?))", (ids,))
+        c.execute("DELETE FROM reports WHERE id IN (SELECT value FROM json_each(?))", (ids,))
+    return len(rows)
+
+def _unpack_archived(row):
+    report = dict(row)
+    report['content'] = zlib.decompress(report['content']).decode('utf-8')
+    return report
+
+def get_archived_report(report_id, tenant_id):
+    c = get_connection()
+    row = c.execute('''
+        SELECT r.id, r.user_id, r.content, r.timestamp, r.score, u.name,
+               (SELECT title FROM tasks WHERE id = r.task_id) AS task_title,
+               (SELECT COUNT(*) FROM report_attachments a WHERE a.report_id = r.id) AS attachments
+        FROM reports_archive r
+        LEFT JOIN users u ON u.id = r.user_id
+        WHERE r.id = ? AND r.tenant_id = ?
+    ''', (report_id, tenant_id)).fetchone()
+    return _unpack_archived(row) if row else None
+
+def get_archived_reports_for_user(user_id, before_id=None, after_id=None, limit=20):
+    """گزارش‌های آرشیوشده‌ی یک کاربر از جدید به قدیم؛ صفحه‌بندی مثل get_reports_for_user"""
+    c = get_connection()
+    keyset, params, order = _report_keyset(before_id, after_id, table='reports_archive')
+    rows = c.execute(f'''
+        SELECT r.id, r.content, r.timestamp, r.score,
+               (SELECT title FROM tasks WHERE id = r.task_id) AS task_title,
+               (SELECT COUNT(*) FROM report_attachments a WHERE a.report_id = r.id) AS attachments
+        FROM reports_archive r
+        WHERE r.user_id = ? {keyset}
+        ORDER BY r.timestamp {order}, r.id {order}
+        LIMIT ?
+    ''', [user_id] + params + [limit]).fetchall()
+    rows = [_unpack_archived(row) for row in rows]
+    return rows[::-1] if order == "ASC" else rows
+
+# --- EXPORT ---
+def _export_scope(table, column, scope_id, tenant_id):
+    # EXISTS همبسته (نه JOIN) تا پیمایش روی ایندکس جدول اصلی بماند و هر دسته کوتاه باشد
+    if scope_id is None:
+        return f"AND {table}.tenant_id = ?", [tenant_id]
+    return f"AND EXISTS (SELECT 1 FROM user_closure h WHERE h.ancestor_id = ? AND h.descendant_id = {column})", [scope_id]
+
+def export_reports(scope_id=None, tenant_id=None, start=None, end=None, after=None, limit=1000, archived=False):
+    """یک دسته از گزارش‌های بازه‌ی [start, end) به ترتیب (timestamp, id) برای خروجی فایل
+
+    after کلید (timestamp, id) آخرین ردیف دسته‌ی قبل است؛ هر دسته یک پیمایش بازه‌ای
+    کوتاه روی ایندکس timestamp است. با scope_id فقط آن کاربر و زیرمجموعه‌هایش و
+    بدون آن همه‌ی سازمان tenant_id. با archived=True همین دسته از reports_archive
+    خوانده و متنش باز می‌شود.
+    """
+    c = get_connection()
+    table = 'reports_archive' if archived else 'reports'
+    where, params = _export_scope("r", "r.user_id", scope_id, tenant_id)
+    if after is not None:
+        where += " AND (r.timestamp, r.id) > (?, ?)"
+        params += list(after)
+    if start is not None:
+        where += " AND r.timestamp >= ?"
+        params.append(start)
+    if end is not None:
+        where += " AND r.timestamp < ?"
+        params.append(end)
+    rows = c.execute(f'''
+        SELECT r.id, r.task_id, r.user_id, u.name, u.username, r.timestamp, r.score, r.content
+        FROM {table} r
+        LEFT JOIN users u ON u.id = r.user_id
+        WHERE 1 {where}
+        ORDER BY r.timestamp, r.id
+        LIMIT ?
+    ''', params + [limit]).fetchall()
+    return [_unpack_archived(row) for row in rows] if archived else rows
+
+def export_tasks(scope_id=None, tenant_id=None, start=None, end=None, after=None, limit=1000):
+    """یک دسته از تسک‌های ساخته‌شده در بازه‌ی [start, end) به ترتیب id؛ after شناسه‌ی آخرین ردیف قبلی"""
+    c = get_connection()
+    where, params = _export_scope("t", "t.assigned_to", scope_id, tenant_id)
+    if after is not None:
+        where += " AND t.id > ?"
+        params.append(after)
+    if start is not None:
+        where += " AND t.created_at >= ?"
+        params.append(start)
+    if end is not None:
+        where += " AND t.created_at < ?"
+        params.append(end)
+    return c.execute(f'''
+        SELECT t.id, t.group_id, t.title, t.description, t.assigned_to, u.name, u.username,
+               b.name AS assigned_by_name, t.created_at, t.deadline, t.is_done, t.is_urgent
+        FROM tasks t
+        LEFT JOIN users u ON u.id = t.assigned_to
+        LEFT JOIN users b ON b.id = t.assigned_by
+        WHERE 1 {where}
+        ORDER BY t.id
+        LIMIT ?
+    ''', params + [limit]).fetchall()
+
+# --- NOTIFICATIONS ---
+NOTIFY_MODES = ('instant', 'digest', 'off')
+
+def get_notify_target(user_id):
+    c = get_connection()
+    return c.execute("SELECT id, telegram_id, notify_mode FROM users WHERE id = ?", (user_id,)).fetchone()
+
+def set_notify_mode(user_id, mode):
+    if mode not in NOTIFY_MODES:
+        raise ValueError(mode)
+    with transaction() as c:
+        c.execute("UPDATE users SET notify_mode = ? WHERE id = ?", (mode, user_id))
+
+def get_digest_recipients():
+    """کاربرانی که خلاصه‌ی روزانه می‌خواهند (ایندکس جزئی idx_users_digest)"""
+    c = get_connection()
+    return c.execute('''
+        SELECT id, telegram_id FROM users
+        WHERE notify_mode = 'digest' AND telegram_id IS NOT NULL
+        ORDER BY id
+    ''').fetchall()
+
+def get_digest(user_id, since, today):
+    """خلاصه‌ی یک سرپرست در یک کوئری: برای هر نفر تعداد گزارش‌ها و تسک‌های انجام‌شده
+    از since، و تسک‌های عقب‌افتاده (ددلاین پیش از today)
+
+    گزارش‌ها از زیرمجموعه‌های مستقیم (supervisor_id) و تسک‌ها از آن‌هایی که خود او
+    داده (assigned_by) شمرده می‌شوند؛ هر سه شاخه روی ایندکس خوانده می‌شوند.
+    """
+    c = get_connection()
+    return c.execute('''
+        SELECT u.id, u.name,
+               SUM(e.kind = 'report') AS reports,
+               SUM(e.kind = 'done') AS done,
+               SUM(e.kind = 'overdue') AS overdue
+        FROM (
+            SELECT r.user_id AS user_id, 'report' AS kind
+            FROM users m
+            JOIN reports r ON r.user_id = m.id AND r.timestamp >= :since
+            WHERE m.supervisor_id = :user_id
+            UNION ALL
+            SELECT assigned_to, 'done' FROM tasks
+            WHERE assigned_by = :user_id AND done_at >= :since
+            UNION ALL
+            SELECT assigned_to, 'overdue' FROM tasks
+            WHERE assigned_by = :user_id AND is_done = 0 AND deadline < :today
+        ) e
+        JOIN users u ON u.id = e.user_id
+        GROUP BY u.id
+        ORDER BY u.name, u.id
+    ''', {'user_id': user_id, 'since': since, 'today': today}).fetchall()
+
+# --- FSM ---
+def get_fsm_record(key):
+    c = get_connection()
+    return c.execute("SELECT state, data, updated_at FROM fsm_storage WHERE key = ?", (key,)).fetchone()
+
+def save_fsm_records(upserts, deletes):
+    """ذخیره‌ی دسته‌ای استیت‌ها در یک تراکنش؛ upserts: (key, state, data, updated_at)"""
+    with transaction() as c:
+        c.executemany('''
+            INSERT INTO fsm_storage (key, state, data, updated_at) VALUES (?, ?, ?, ?)
+            ON CONFLICT(key) DO UPDATE SET state=excluded.state, data=excluded.data, updated_at=excluded.updated_at
+        ''', upserts)
+        c.executemany("DELETE FROM fsm_storage WHERE key = ?", [(k,) for k in deletes])
+
+def delete_expired_fsm_records(before):
+    with transaction() as c:
+        return c.execute("DELETE FROM fsm_storage WHERE updated_at < ?", (before,)).rowcount
+
+# --- SEARCH ---
+def search(query, scope_id=None, tenant_id=None, limit=10, offset=0):
+    """جستجوی تمام‌متن در گزارش‌ها و تسک‌ها، مرتب بر اساس bm25
+
+    با scope_id فقط موارد مربوط به خود آن کاربر و زیرمجموعه‌هایش برگردانده
+    می‌شود (None یعنی همه‌ی سازمان tenant_id، برای مدیر اصلی).
+    """
+    match = fts_query(query)
+    if not match:
+        return []
+    c = get_connection()
+    if scope_id is None:
+        report_tenant, task_tenant = "AND r.tenant_id = ?", "AND t.tenant_id = ?"
+        report_scope = task_scope = ""
+        scope = [tenant_id]
+    else:
+        report_tenant = task_tenant = ""
+        report_scope = "JOIN user_closure h ON h.descendant_id = r.user_id AND h.ancestor_id = ?"
+        task_scope = "JOIN user_closure h ON h.descendant_id = t.assigned_to AND h.ancestor_id = ?"
+        scope = [scope_id]
+    return c.execute(f'''
+        SELECT * FROM (
+            SELECT 'report' AS kind, r.id AS item_id, u.name, r.timestamp AS at, 0 AS is_done,
+                   snippet(reports_fts, 0, '«', '»', '…', 12) AS snippet, f.rank AS rank
+            FROM reports_fts f
+            JOIN reports r ON r.id = f.rowid {report_tenant}
+            JOIN users u ON u.id = r.user_id
+            {report_scope}
+            WHERE reports_fts MATCH ?
+            UNION ALL
+            SELECT 'task', t.id, u.name, t.deadline, t.is_done,
+                   snippet(tasks_fts, -1, '«', '»', '…', 12), f.rank
+            FROM tasks_fts f
+            JOIN tasks t ON t.id = f.rowid {task_tenant}
+            JOIN users u ON u.id = t.assigned_to
+            {task_scope}
+            WHERE tasks_fts MATCH ?
+        )
+        ORDER BY rank
+        LIMIT ? OFFSET ?
+    ''', scope + [match] + scope + [match, limit, offset]).fetchall()
+
+# --- STATS ---
+def stats_period(timestamp):
+    """کلید دوره‌ی ماهانه‌ی آمار برای یک timestamp (epoch)"""
+    return month_key(timestamp)
+
+def _bump_stats(c, user_id, timestamp, reports=0, scored=0, score_sum=0):
+    """به‌روزرسانی افزایشی آمار خود کاربر و همه‌ی بالادستی‌هایش (ماه، هفته و کل دوره)
+
+    باید داخل تراکنشی که گزارش را می‌نویسد صدا زده شود. آمار تیم‌ها بر اساس
+    ساختار سازمان در لحظه‌ی ثبت است و با جابه‌جایی کاربر بازنویسی نمی‌شود.
+    """
+    # بالادستی‌ها همه در سازمان خود کاربرند
     c.execute('''
-        SELECT content, timestamp, score FROM reports
-        WHERE user_id = ?
-        ORDER BY timestamp DESC
-        LIMIT 20
-    ''', (user_id,))
-    result = c.fetchall()
-    conn.close()
-    return result
+        INSERT INTO report_stats (scope, subject_id, period, reports, scored, score_sum, tenant_id)
+        SELECT CASE WHEN h.depth = 0 THEN 'user' ELSE 'team' END, h.ancestor_id, p.period, ?, ?, ?,
+               (SELECT tenant_id FROM users WHERE id = h.descendant_id)
+        FROM user_closure h
+        CROSS JOIN (SELECT ? AS period UNION ALL SELECT ? UNION ALL SELECT 'all') p
+        WHERE h.descendant_id = ?
+        ON CONFLICT(scope, subject_id, period) DO UPDATE SET
+            reports = reports + excluded.reports,
+            scored = scored + excluded.scored,
+            score_sum = score_sum + excluded.score_sum
+    ''', (reports, scored, score_sum, stats_period(timestamp), week_key(timestamp), user_id))
+
+def get_stats(scope, subject_id, limit=7):
+    """آمار کل دوره و آخرین ماه‌های یک کاربر یا تیم (جدیدترین ماه اول)"""
+    c = get_connection()
+    total = get_period_stats(scope, subject_id, 'all')
+    # کلید ماه‌ها با رقم شروع می‌شود و از 'all' و هفته‌ها ('W:...') کوچک‌تر است
+    months = c.execute('''
+        SELECT * FROM report_stats
+        WHERE scope = ? AND subject_id = ? AND period < ':'
+        ORDER BY period DESC LIMIT ?
+    ''', (scope, subject_id, limit)).fetchall()
+    return total, months
 
+def get_period_stats(scope, subject_id, period):
+    """ردیف آمار یک کاربر یا تیم در یک دوره ('all'، ماه یا هفته‌ی week_key)، یا None"""
+    c = get_connection()
+    return c.execute(
+        "SELECT * FROM report_stats WHERE scope = ? AND subject_id = ? AND period = ?",
+        (scope, subject_id, period)
+    ).fetchone()
+
+def get_leaderboard(scope, period, under_id=None, by='avg', min_scored=1, limit=10, tenant_id=None):
+    """رتبه‌بندی کاربران یا تیم‌ها در یک دوره فقط از روی جدول آمار
+
+    by='avg' بر اساس میانگین امتیاز (با حداقل min_scored گزارش امتیازدار)
+    و by='reports' بر اساس تعداد گزارش. نتیجه به سازمان tenant_id و با under_id
+    به زیرمجموعه‌های یک کاربر محدود می‌شود؛ در هر دو حالت پیمایش روی کلید اصلی
+    (tenant_id, scope, period) است.
+    """
+    c = get_connection()
+    join, where, params = "", "", [tenant_id, scope, period]
+    if under_id is not None:
+        join = "JOIN user_closure h ON h.descendant_id = s.subject_id"
+        where = "AND h.ancestor_id = ? AND h.depth > 0"
+        params.append(under_id)
+    if by == 'avg':
+        where += " AND s.scored >= ?"
+        params.append(min_scored)
+        order = "avg_score DESC, s.scored DESC"
+    else:
+        order = "s.reports DESC, avg_score DESC"
+    return c.execute(f'''
+        SELECT s.subject_id, u.name, s.reports, s.scored, s.score_sum,
+               CASE WHEN s.scored THEN 1.0 * s.score_sum / s.scored END AS avg_score
+        FROM report_stats s
+        JOIN users u ON u.id = s.subject_id
+        {join}
+        WHERE s.tenant_id = ? AND s.scope = ? AND s.period = ? {where}
+        ORDER BY {order}
+        LIMIT ?
+    ''', params + [limit]).fetchall()
@@ -0,0 +1,192 @@
+"""خروجی فایل گزارش‌ها و تسک‌ها برای اکسل و ابزارهای دیگر
+
+ردیف‌ها دسته به دسته با کوئری keyset (database.export_reports/export_tasks)
+خوانده و همان لحظه در یک فایل موقت نوشته می‌شوند، پس حافظه به تعداد کل ردیف‌ها
+بستگی ندارد و هیچ کوئری‌ای ترد دیتابیس را طولانی نگه نمی‌دارد. فایل آخر کار
+به صورت سند تلگرام فرستاده و پاک می‌شود.
+
+گزارش‌های آرشیوشده (reports_archive) هم با همان ترتیب keyset جدا خوانده و با
+گزارش‌های جدول اصلی ادغام می‌شوند و ستون archived آن‌ها را مشخص می‌کند.
+
+دو قالب: CSV با BOM (تا اکسل متن فارسی را درست باز کند) و JSONL فشرده با gzip.
+"""
+import asyncio
+import csv
+import gzip
+import json
+import os
+import tempfile
+import time
+
+import timeutil
+from async_database import export_reports, export_tasks
+from textnorm import normalize
+
+BATCH_SIZE = 1000
+# فاصله‌ی به‌روزرسانی پیام پیشرفت (ثانیه)
+PROGRESS_INTERVAL = 3
+# سقف آپلود سند برای Bot API ابری ۵۰ مگابایت است
+MAX_EXPORT_BYTES = 50 * 1024 * 1024
+
+KINDS = {'reports': 'reports', 'گزارش': 'reports', 'tasks': 'tasks', 'تسک': 'tasks'}
+FORMATS = {'csv': 'csv', 'jsonl': 'jsonl', 'json': 'jsonl'}
+USAGE = (
+    "فرمت صحیح:\n"
+    "/export reports|tasks [csv|jsonl] [روز]\n"
+    "/export reports|tasks [csv|jsonl] <از> <تا>\n\n"
+    "روز: تعداد روزهای اخیر (مثلاً 30)؛ از/تا: تاریخ شمسی مثل 1404/01/01 (روز «تا» هم حساب می‌شود).\n"
+    "بدون بازه، همه‌ی ردیف‌ها."
+)
+
+# کاربرانی که خروجی‌شان در حال ساخت است؛ هر کاربر یک خروجی همزمان
+in_progress = set()
+
+
+def _iso(ts):
+    return timeutil.to_datetime(ts).isoformat() if ts is not None else None
+
+
+def _report_row(r, archived=False):
+    return {
+        'id': r['id'], 'user_id': r['user_id'], 'name': r['name'], 'username': r['username'],
+        'time': _iso(r['timestamp']), 'jalali': timeutil.jalali_datetime(r['timestamp']),
+        'score': r['score'], 'task_id': r['task_id'], 'content': r['content'], 'archived': archived,
+    }
+
+
+def _task_row(t):
+    return {
+        'id': t['id'], 'group_id': t['group_id'], 'title': t['title'], 'description': t['description'],
+        'assigned_to': t['assigned_to'], 'name': t['name'], 'username': t['username'],
+        'assigned_by': t['assigned_by_name'], 'created': _iso(t['created_at']),
+        'deadline': timeutil.jalali_date(t['deadline']) if t['deadline'] is not None else None,
+        'done': bool(t['is_done']), 'urgent': bool(t['is_urgent']),
+    }
+
+
+def parse_args(args):
+    """آرگومان‌های /export -> (kind, fmt, start, end)؛ در صورت ورودی نادرست ValueError"""
+    args = [normalize(a).lower() for a in args]
+    if not args or args[0] not in KINDS:
+        raise ValueError("kind")
+    kind, rest = KINDS[args[0]], args[1:]
+    fmt = 'csv'
+    if rest and rest[0] in FORMATS:
+        fmt, rest = FORMATS[rest[0]], rest[1:]
+    start = end = None
+    today = timeutil.day_start(timeutil.now())
+    if len(rest) == 1 and rest[0].isdigit():
+        start = timeutil.add_days(today, -int(rest[0]))
+    elif len(rest) == 2:
+        start = timeutil.parse_jalali_numeric(rest[0])
+        end = timeutil.add_days(timeutil.parse_jalali_numeric(rest[1]), 1)
+    elif rest:
+        raise ValueError("range")
+    return kind, fmt, start, end
+
+
+async def _report_rows(archived, scope_id, tenant_id, start, end, batch_size):
+    """گزارش‌های یک جدول (اصلی یا آرشیو) یکی‌یکی، با خواندن دسته‌ای keyset"""
+    after = None
+    while True:
+        rows = await export_reports(scope_id, tenant_id, start, end, after, batch_size, archived=archived)
+        for row in rows:
+            yield row
+        if len(rows) < batch_size:
+            return
+        after = (rows[-1]['timestamp'], rows[-1]['id'])
+
+
+def _merge_key(row):
+    # منبع تمام‌شده (None) همیشه آخر است
+    return (row['timestamp'], row['id']) if row is not None else (float('inf'),)
+
+
+async def _merged_reports(scope_id, tenant_id, start, end, batch_size):
+    """ادغام گزارش‌های جدول اصلی و آرشیو به ترتیب (timestamp, id)، دسته به دسته"""
+    sources = [_report_rows(archived, scope_id, tenant_id, start, end, batch_size) for archived in (False, True)]
+    heads = [await anext(source, None) for source in sources]
+    batch = []
+    while heads[0] is not None or heads[1] is not None:
+        i = 0 if _merge_key(heads[0]) <= _merge_key(heads[1]) else 1
+        batch.append(_report_row(heads[i], archived=bool(i)))
+        heads[i] = await anext(sources[i], None)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+async def iter_batches(kind, scope_id=None, tenant_id=None, start=None, end=None, batch_size=BATCH_SIZE):
+    """دسته‌های ردیف (dict) به ترتیب زمان/شناسه؛ هر دسته یک کوئری کوتاه جدا است
+
+    با scope_id فقط آن کاربر و زیرمجموعه‌هایش، و بدون آن همه‌ی سازمان tenant_id.
+    گزارش‌ها شامل گزارش‌های آرشیوشده هم هستند.
+    """
+    if kind == 'reports':
+        async for rows in _merged_reports(scope_id, tenant_id, start, end, batch_size):
+            yield rows
+        return
+    after = None
+    while True:
+        rows = await export_tasks(scope_id, tenant_id, start, end, after, batch_size)
+        if rows:
+            after = rows[-1]['id']
+            yield [_task_row(row) for row in rows]
+        if len(rows) < batch_size:
+            return
+
+
+class _Writer:
+    def __init__(self, fmt):
+        fd, self.path = tempfile.mkstemp(prefix="dozio-export-", suffix=".csv" if fmt == 'csv' else ".jsonl.gz")
+        os.close(fd)
+        self.fmt = fmt
+        if fmt == 'csv':
+            self.file = open(self.path, 'w', encoding='utf-8-sig', newline='')
+            self.csv = None
+        else:
+            self.file = gzip.open(self.path, 'wt', encoding='utf-8')
+
+    def write(self, rows):
+        if self.fmt == 'csv':
+            if self.csv is None:
+                self.csv = csv.DictWriter(self.file, fieldnames=list(rows[0]))
+                self.csv.writeheader()
+            self.csv.writerows(rows)
+        else:
+            self.file.writelines(json.dumps(row, ensure_ascii=False) + "\n" for row in rows)
+
+    def close(self):
+        self.file.close()
+
+
+async def write_export(kind, fmt, scope_id=None, tenant_id=None, start=None, end=None, progress=None):
+    """ساخت فایل خروجی؛ (مسیر فایل، تعداد ردیف) را برمی‌گرداند و پاک کردن فایل با فراخواننده است
+
+    progress (اختیاری) یک تابع async است که هر PROGRESS_INTERVAL ثانیه با تعداد ردیف‌های
+    نوشته‌شده صدا زده می‌شود.
+    """
+    writer = _Writer(fmt)
+    count = 0
+    last = time.monotonic()
+    try:
+        async for rows in iter_batches(kind, scope_id, tenant_id, start, end):
+            # نوشتن و فشرده‌سازی خارج از حلقه‌ی رویداد
+            await asyncio.to_thread(writer.write, rows)
+            count += len(rows)
+            if progress and time.monotonic() - last >= PROGRESS_INTERVAL:
+                last = time.monotonic()
+                await progress(count)
+    except BaseException:
+        writer.close()
+        os.remove(writer.path)
+        raise
+    writer.close()
+    return writer.path, count
+
+
+def file_name(kind, fmt):
+    stamp = timeutil.to_datetime(timeutil.now()).strftime('%Y%m%d-%H%M')
+    return f"{kind}-{stamp}." + ("csv" if fmt == 'csv' else "jsonl.gz")
@@ -0,0 +1,147 @@
+"""ذخیره‌ی ماندگار استیت‌های FSM در همان فایل SQLite ربات
+
+- خواندن: از کش درون‌پروسه‌ای؛ فقط بار اول هر کاربر یک کوئری با کلید اصلی
+- نوشتن: فقط کش و علامت «کثیف»؛ هر FLUSH_INTERVAL ثانیه همه‌ی تغییرات در یک
+  تراکنش نوشته می‌شوند (نه یک commit برای هر update_data)
+- استیت‌هایی که TTL ثانیه دست نخورده‌اند منقضی و پاک می‌شوند
+"""
+import asyncio
+import copy
+import json
+import logging
+import time
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage
+
+import metrics
+from async_database import get_fsm_record, save_fsm_records, delete_expired_fsm_records
+
+FLUSH_INTERVAL = 0.5
+# گفتگوی رها شده بعد از یک روز پاک می‌شود
+TTL = 24 * 3600
+EXPIRE_INTERVAL = 600
+
+
+def _serialize_key(key):
+    return ":".join(str(part) if part is not None else "" for part in (
+        key.bot_id, key.chat_id, key.user_id, key.thread_id, key.business_connection_id, key.destiny,
+    ))
+
+
+class _Record:
+    __slots__ = ("state", "data", "updated_at")
+
+    def __init__(self, state=None, data=None, updated_at=0):
+        self.state = state
+        self.data = data or {}
+        self.updated_at = updated_at
+
+    def expired(self, now, ttl):
+        return bool(self.updated_at) and self.updated_at < now - ttl
+
+
+class SQLiteStorage(BaseStorage):
+    def __init__(self, flush_interval=FLUSH_INTERVAL, ttl=TTL):
+        self.flush_interval = flush_interval
+        self.ttl = ttl
+        self._cache = {}
+        self._dirty = set()
+        self._loading = {}
+        self._worker = None
+
+    async def _record(self, key):
+        skey = _serialize_key(key)
+        record = self._cache.get(skey)
+        if record is None:
+            # چند آپدیت همزمان یک کاربر فقط یک کوئری می‌زنند
+            pending = self._loading.get(skey)
+            if pending is None:
+                pending = self._loading[skey] = asyncio.ensure_future(get_fsm_record(skey))
+                pending.add_done_callback(lambda _: self._loading.pop(skey, None))
+            row = await pending
+            record = self._cache.get(skey)
+            if record is None:
+                record = _Record()
+                if row is not None:
+                    record = _Record(row['state'], json.loads(row['data'] or '{}'), row['updated_at'])
+                self._cache[skey] = record
+        if record.expired(time.time(), self.ttl):
+            record.state, record.data = None, {}
+        return skey, record
+
+    def _touch(self, skey, record):
+        record.updated_at = int(time.time())
+        self._dirty.add(skey)
+        if self._worker is None:
+            self._worker = asyncio.create_task(self._run())
+
+    async def set_state(self, key, state=None):
+        skey, record = await self._record(key)
+        record.state = state.state if isinstance(state, State) else state
+        metrics.fsm_transitions.inc(record.state or "none")
+        self._touch(skey, record)
+
+    async def get_state(self, key):
+        _, record = await self._record(key)
+        return record.state
+
+    async def set_data(self, key, data):
+        skey, record = await self._record(key)
+        record.data = copy.deepcopy(dict(data))
+        self._touch(skey, record)
+
+    async def get_data(self, key):
+        _, record = await self._record(key)
+        return copy.deepcopy(record.data)
+
+    async def flush(self):
+        """نوشتن همه‌ی تغییرات در انتظار در یک تراکنش"""
+        if not self._dirty:
+            return
+        dirty, self._dirty = self._dirty, set()
+        upserts, deletes = [], []
+        for skey in dirty:
+            record = self._cache.get(skey)
+            if record is None or (record.state is None and not record.data):
+                deletes.append(skey)
+            else:
+                upserts.append((skey, record.state, json.dumps(record.data, ensure_ascii=False), record.updated_at))
+        try:
+            await save_fsm_records(upserts, deletes)
+        except Exception:
+            self._dirty |= dirty
+            raise
+
+    async def expire(self):
+        """پاک کردن استیت‌های منقضی از دیتابیس و کش"""
+        now = time.time()
+        removed = await delete_expired_fsm_records(int(now - self.ttl))
+        # رکوردهای تمیزی که مدتی دست نخورده‌اند از کش خارج می‌شوند و در صورت نیاز دوباره خوانده می‌شوند
+        idle_before = now - EXPIRE_INTERVAL
+        for skey in [k for k, r in self._cache.items() if k not in self._dirty and r.updated_at < idle_before]:
+            del self._cache[skey]
+        if removed:
+            logging.info("fsm storage: %d expired states removed", removed)
+
+    async def _run(self):
+        last_expire = time.monotonic()
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+                if time.monotonic() - last_expire > EXPIRE_INTERVAL:
+                    last_expire = time.monotonic()
+                    await self.expire()
+            except Exception:
+                logging.exception("fsm storage flush failed")
+
+    async def close(self):
+        if self._worker:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+        await self.flush()
@@ -0,0 +1,118 @@
+"""درخت سازمان با عمق دلخواه
+
+رابطه‌ی supervisor_id در جدول user_closure به صورت closure table نگه داشته
+می‌شود و تریگرهای روی users آن را به‌روز نگه می‌دارند. پس یک زیردرخت کامل با
+یک کوئری خوانده می‌شود و «آیا X زیرمجموعه‌ی Y است» فقط یک lookup روی کلید
+اصلی است.
+"""
+from collections import defaultdict
+
+from async_database import USER_CACHE_TTL, add_invalidation_listener, get_org_users, get_subtree, in_tenant, is_under
+from cache import MISSING, TTLCache
+
+# هر خط درخت کوتاه است، پس صفحه‌ها بزرگ‌تر از فیدهای دیگرند
+ORG_PAGE_SIZE = 30
+
+# درخت مرتب‌شده بر اساس (tenant_id، ریشه)؛ ریشه‌ی None یعنی کل سازمان. هر تغییری
+# در جدول users همه را باطل می‌کند، پس ورق زدن فقط بار اول درخت را می‌سازد
+ORG_TREE_CACHE_SIZE = 256
+tree_cache = TTLCache(maxsize=ORG_TREE_CACHE_SIZE, ttl=USER_CACHE_TTL)
+add_invalidation_listener(lambda *args, **kwargs: tree_cache.clear(), local=True)
+
+ROLE_ICONS = {'admin': '👑', 'manager': '🟦', 'member': '🟩'}
+
+
+def tree_order(users, root_ids=None):
+    """مرتب‌سازی DFS کاربران؛ هر گره یک dict با کلید اضافه‌ی depth است
+
+    اگر root_ids داده نشود، کاربرانی که سرپرستشان در users نیست ریشه‌اند.
+    """
+    by_id = {u['id']: dict(u) for u in users}
+    children = defaultdict(list)
+    roots = []
+    for node in sorted(by_id.values(), key=lambda n: n['id']):
+        if root_ids is not None:
+            if node['id'] in root_ids:
+                roots.append(node)
+            else:
+                children[node['supervisor_id']].append(node)
+        elif node['supervisor_id'] in by_id:
+            children[node['supervisor_id']].append(node)
+        else:
+            roots.append(node)
+
+    ordered = []
+    seen = set()
+    stack = [(node, 0) for node in reversed(roots)]
+    while stack:
+        node, depth = stack.pop()
+        if node['id'] in seen:
+            continue
+        seen.add(node['id'])
+        node['depth'] = depth
+        ordered.append(node)
+        stack.extend((child, depth + 1) for child in reversed(children[node['id']]))
+    return ordered
+
+
+def display_name(user):
+    """نام کاربر با سمتش (اگر ثبت شده)"""
+    return f"{user['name']} ({user['position']})" if user['position'] else user['name']
+
+
+def render_node(node):
+    depth = node['depth']
+    branch = "    " * (depth - 1) + "└ " if depth else ""
+    icon = ROLE_ICONS.get(node['role'], '⬜')
+    return f"{branch}{icon} {display_name(node)} (ID:{node['telegram_id']})\n"
+
+
+class OrgTree:
+    """گره‌های درخت به ترتیب DFS و جایگاه هر گره، تا پیدا کردن cursor یک lookup باشد"""
+    __slots__ = ("nodes", "positions")
+
+    def __init__(self, nodes):
+        self.nodes = nodes
+        self.positions = {node['id']: i for i, node in enumerate(nodes)}
+
+    def __len__(self):
+        return len(self.nodes)
+
+
+def page_rows(tree, direction=None, cursor=None, limit=ORG_PAGE_SIZE):
+    """ردیف‌های ورودی build_page برای یک صفحه از درخت؛ cursor شناسه‌ی یک گره است"""
+    nodes = tree.nodes
+    index = tree.positions.get(cursor)
+    if index is None or not direction:
+        return nodes[:limit + 1], None
+    if direction == 'b':
+        return nodes[max(0, index - limit - 1):index], direction
+    return nodes[index + 1:index + limit + 2], direction
+
+
+async def org_tree(user):
+    """درخت قابل مشاهده برای user: کل سازمان برای مدیر اصلی، زیردرخت خودش برای بقیه
+
+    نتیجه تا تغییر بعدی users در tree_cache می‌ماند؛ گره‌ها مشترک‌اند و نباید تغییر کنند.
+    """
+    root = None if user['role'] == 'admin' else user['id']
+    key = (user['tenant_id'], root)
+    tree = tree_cache.get(key)
+    if tree is not MISSING:
+        return tree
+    generation = tree_cache.generation
+    if root is None:
+        tree = OrgTree(tree_order(await get_org_users(user['tenant_id'])))
+    else:
+        tree = OrgTree(tree_order(await get_subtree(root), root_ids={root}))
+    tree_cache.set(key, tree, generation=generation)
+    return tree
+
+
+async def can_manage(user, target_id):
+    """آیا user می‌تواند روی کاربر target_id کار مدیریتی (مثل امتیازدهی) انجام دهد"""
+    if not user or target_id == user['id']:
+        return False
+    if user['role'] == 'admin':
+        return await in_tenant(user['tenant_id'], target_id)
+    return await is_under(user['id'], target_id)
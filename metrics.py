@@ -0,0 +1,240 @@
+"""شمارنده‌ها و هیستوگرام‌های درون‌پروسه‌ای ربات
+
+مقدارها فقط در حافظه‌اند و با ری‌استارت صفر می‌شوند. دو خروجی دارند:
+متن Prometheus روی مسیر METRICS_PATH سرور webhook، و خلاصه‌ی فارسی دستور
+/metrics برای مدیر اصلی.
+
+در حالت چندپروسه‌ای هر worker مقدارهایش را با snapshot() برای supervisor
+می‌فرستد و supervisor همه را با برچسب worker در یک خروجی Prometheus می‌گذارد.
+
+ثبت مقدار از تردهای pool دیتابیس هم انجام می‌شود، پس هر متریک قفل خودش را دارد.
+"""
+import bisect
+import threading
+import time
+from collections import defaultdict
+
+# ثانیه؛ از ۱ میلی‌ثانیه تا ۵ ثانیه
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+STARTED_AT = time.time()
+
+
+def _labels(names, values):
+    if not names:
+        return ""
+    pairs = ",".join('{}="{}"'.format(n, str(v).replace('\\', '\\\\').replace('"', '\\"')) for n, v in zip(names, values))
+    return "{" + pairs + "}"
+
+
+def _sources(workers, kind, name, local):
+    """(برچسب‌های اضافه، مقدارها): مقدارهای همین پروسه، یا هر worker با برچسب worker"""
+    if workers is None:
+        return [((), (), local())]
+    return [(("worker",), (str(w),), snap[kind].get(name, {})) for w, snap in sorted(workers.items())]
+
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] += amount
+
+    def values(self):
+        with self._lock:
+            return dict(self._values)
+
+    def render(self, workers=None):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for extra, prefix, values in _sources(workers, 'counters', self.name, self.values):
+            for key, value in sorted(values.items()):
+                lines.append(f"{self.name}{_labels(extra + self.labels, prefix + key)} {value}")
+        return lines
+
+
+class _Series:
+    __slots__ = ("buckets", "count", "sum", "max")
+
+    def __init__(self):
+        self.buckets = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def quantile(self, q):
+        """تخمین چندک از روی bucketها (درون‌یابی خطی، مثل histogram_quantile)"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            if seen + n >= rank and n:
+                low = BUCKETS[i - 1] if i else 0.0
+                high = BUCKETS[i] if i < len(BUCKETS) else self.max
+                return min(low + (high - low) * (rank - seen) / n, self.max)
+            seen += n
+        return self.max
+
+
+class Histogram:
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._series = defaultdict(_Series)
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        with self._lock:
+            s = self._series[label_values]
+            s.buckets[bisect.bisect_left(BUCKETS, value)] += 1
+            s.count += 1
+            s.sum += value
+            if value > s.max:
+                s.max = value
+
+    def series(self):
+        with self._lock:
+            copies = {}
+            for key, s in self._series.items():
+                c = copies[key] = _Series()
+                c.buckets, c.count, c.sum, c.max = list(s.buckets), s.count, s.sum, s.max
+            return copies
+
+    def time(self, *label_values):
+        return _Timer(self, label_values)
+
+    def render(self, workers=None):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for extra, prefix, series in _sources(workers, 'histograms', self.name, self.series):
+            names = extra + self.labels
+            for key, s in sorted(series.items()):
+                key = prefix + key
+                cumulative = 0
+                for bound, n in zip(BUCKETS + (float('inf'),), s.buckets):
+                    cumulative += n
+                    le = "+Inf" if bound == float('inf') else repr(bound)
+                    lines.append(f"{self.name}_bucket{_labels(names + ('le',), key + (le,))} {cumulative}")
+                lines.append(f"{self.name}_sum{_labels(names, key)} {s.sum}")
+                lines.append(f"{self.name}_count{_labels(names, key)} {s.count}")
+        return lines
+
+
+class _Timer:
+    __slots__ = ("histogram", "label_values", "start")
+
+    def __init__(self, histogram, label_values):
+        self.histogram = histogram
+        self.label_values = label_values
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, *self.label_values)
+
+
+updates = Counter("bot_updates_total", "Updates received", ("type",))
+update_errors = Counter("bot_update_errors_total", "Updates whose processing raised", ("type",))
+handler_errors = Counter("bot_handler_errors_total", "Handler exceptions", ("handler",))
+handler_latency = Histogram("bot_handler_seconds", "Handler run time", ("handler",))
+db_latency = Histogram("bot_db_query_seconds", "database.py call run time on the pool thread", ("query",))
+db_wait = Histogram("bot_db_queue_wait_seconds", "Time a database call waited for a free pool thread")
+db_errors = Counter("bot_db_errors_total", "database.py calls that raised", ("query",))
+fsm_transitions = Counter("bot_fsm_transitions_total", "FSM state changes", ("state",))
+reports_archived = Counter("bot_reports_archived_total", "Reports moved to reports_archive")
+notify_events = Counter("bot_notify_events_total", "Events queued for supervisor notifications", ("kind",))
+notify_sent = Counter("bot_notifications_sent_total", "Coalesced notifications and daily digests sent", ("kind",))
+db_group_commits = Counter("bot_db_group_commits_total", "Write batches committed by the group-commit buffer")
+db_group_writes = Counter("bot_db_group_writes_total", "Writes committed through the group-commit buffer")
+
+METRICS = (
+    updates, update_errors, handler_errors, handler_latency, db_latency, db_wait, db_errors, fsm_transitions,
+    reports_archived, notify_events, notify_sent, db_group_commits, db_group_writes,
+)
+
+# name -> (help, تابع بدون ورودی که عدد برمی‌گرداند)؛ برای صف خروجی، کش و ...
+_gauges = {}
+
+
+def register_gauge(name, help, func):
+    _gauges[name] = (help, func)
+
+
+def snapshot():
+    """مقدارهای همین پروسه به شکل قابل pickle، برای فرستادن به supervisor"""
+    return {
+        'counters': {m.name: m.values() for m in METRICS if isinstance(m, Counter)},
+        'histograms': {m.name: m.series() for m in METRICS if isinstance(m, Histogram)},
+        'gauges': {name: (help, func()) for name, (help, func) in _gauges.items()},
+        'uptime': time.time() - STARTED_AT,
+    }
+
+
+def render_prometheus(workers=None):
+    """خروجی متنی قابل خواندن برای Prometheus (text format 0.0.4)
+
+    workers: {شماره‌ی worker: snapshot()}؛ اگر داده شود متریک‌های ربات از آن‌ها خوانده
+    می‌شوند و gaugeهای همین پروسه (supervisor) بدون برچسب کنارشان می‌آیند.
+    """
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render(workers))
+    if workers is not None:
+        gauges = {}
+        for w, snap in sorted(workers.items()):
+            for name, (help, value) in snap['gauges'].items():
+                gauges.setdefault(name, (help, []))[1].append((w, value))
+            gauges.setdefault('bot_worker_uptime_seconds', ("Worker process uptime", []))[1].append((w, round(snap['uptime'])))
+        for name, (help, values) in sorted(gauges.items()):
+            lines += [f"# HELP {name} {help}", f"# TYPE {name} gauge"]
+            lines += [f'{name}{{worker="{w}"}} {value}' for w, value in values]
+    for name, (help, func) in sorted(_gauges.items()):
+        lines += [f"# HELP {name} {help}", f"# TYPE {name} gauge", f"{name} {func()}"]
+    lines += ["# TYPE bot_uptime_seconds gauge", f"bot_uptime_seconds {time.time() - STARTED_AT:.0f}"]
+    return "\n".join(lines) + "\n"
+
+
+def _ms(seconds):
+    return f"{seconds * 1000:.1f}"
+
+
+def summary_text(limit=8):
+    """متن /metrics: پرهزینه‌ترین هندلرها (زمان کل) و کندترین کوئری‌ها (p95)"""
+    uptime = int(time.time() - STARTED_AT)
+    total_updates = sum(updates.values().values())
+    total_errors = sum(update_errors.values().values())
+    parts = [
+        f"📈 متریک‌ها از {uptime // 3600} ساعت و {uptime % 3600 // 60} دقیقه پیش\n"
+        f"آپدیت‌ها: {total_updates}، خطا: {total_errors}، تغییر استیت FSM: {sum(fsm_transitions.values().values())}"
+    ]
+
+    errors = handler_errors.values()
+    handlers = sorted(handler_latency.series().items(), key=lambda kv: kv[1].sum, reverse=True)[:limit]
+    if handlers:
+        lines = ["🔥 هندلرها (بر اساس زمان کل):", "نام — تعداد، میانگین / p95 / بیشینه (ms)"]
+        for (name,), s in handlers:
+            err = f"، ❌ {errors[(name,)]}" if errors.get((name,)) else ""
+            lines.append(f"• {name} — {s.count}، {_ms(s.sum / s.count)} / {_ms(s.quantile(0.95))} / {_ms(s.max)}{err}")
+        parts.append("\n".join(lines))
+
+    queries = sorted(db_latency.series().items(), key=lambda kv: kv[1].quantile(0.95), reverse=True)[:limit]
+    if queries:
+        lines = ["🐢 کندترین کوئری‌ها (بر اساس p95):"]
+        for (name,), s in queries:
+            lines.append(f"• {name} — {s.count}، {_ms(s.sum / s.count)} / {_ms(s.quantile(0.95))} / {_ms(s.max)}")
+        wait = db_wait.series().get(())
+        if wait:
+            lines.append(f"انتظار برای ترد دیتابیس: p95 {_ms(wait.quantile(0.95))} ms")
+        parts.append("\n".join(lines))
+
+    if _gauges:
+        parts.append("\n".join(f"{name}: {func():g}" for name, (_, func) in sorted(_gauges.items())))
+    return "\n\n".join(parts)
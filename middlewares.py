@@ -0,0 +1,54 @@
+import asyncio
+
+from aiogram import BaseMiddleware
+
+import metrics
+from async_database import get_user_by_telegram_id
+
+
+class UserMiddleware(BaseMiddleware):
+    """کاربر ثبت‌شده را یک بار برای هر آپدیت پیدا می‌کند و با نام user به هندلر می‌دهد
+
+    اگر فرستنده در دیتابیس نباشد user برابر None است.
+    """
+
+    async def __call__(self, handler, event, data):
+        from_user = data.get("event_from_user")
+        data["user"] = await get_user_by_telegram_id(from_user.id) if from_user else None
+        return await handler(event, data)
+
+
+class ConcurrencyLimitMiddleware(BaseMiddleware):
+    """حداکثر limit آپدیت را همزمان به هندلرها می‌دهد؛ بقیه منتظر می‌مانند"""
+
+    def __init__(self, limit):
+        self._semaphore = asyncio.Semaphore(limit)
+
+    async def __call__(self, handler, event, data):
+        async with self._semaphore:
+            return await handler(event, data)
+
+
+class UpdateMetricsMiddleware(BaseMiddleware):
+    """شمارش آپدیت‌ها و آپدیت‌های خطادار به تفکیک نوع (outer middleware روی dp.update)"""
+
+    async def __call__(self, handler, event, data):
+        metrics.updates.inc(event.event_type)
+        try:
+            return await handler(event, data)
+        except Exception:
+            metrics.update_errors.inc(event.event_type)
+            raise
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """زمان اجرا و خطاهای هر هندلر به تفکیک نام تابع (inner middleware روی message، callback_query و inline_query)"""
+
+    async def __call__(self, handler, event, data):
+        name = data['handler'].callback.__name__
+        try:
+            with metrics.handler_latency.time(name):
+                return await handler(event, data)
+        except Exception:
+            metrics.handler_errors.inc(name)
+            raise
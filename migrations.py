@@ -0,0 +1,566 @@
+"""مهاجرت‌های نسخه‌دار اسکیمای دیتابیس
+
+هر مهاجرت یک شماره‌ی نسخه دارد و فقط یک بار اجرا می‌شود؛ نسخه‌ی فعلی در
+جدول schema_version نگه داشته می‌شود. برای تغییر اسکیما فقط یک تابع جدید
+به انتهای MIGRATIONS اضافه کنید و هرگز مهاجرت‌های قبلی را ویرایش نکنید.
+"""
+import sqlite3
+from datetime import datetime
+
+from textnorm import normalize
+from timeutil import iso_to_epoch, week_key
+
+
+class SchemaDriftError(RuntimeError):
+    """اسکیمای دیتابیس با اسکیمای مورد انتظار کد یکسان نیست"""
+
+
+def _columns(c, table):
+    return {row[1] for row in c.execute(f"PRAGMA table_info({table})")}
+
+
+def _add_column(c, table, column, decl):
+    if column not in _columns(c, table):
+        c.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+
+
+def _rebuild_table(c, table, create_sql, select_sql, indexes):
+    """بازسازی جدول با تعریف جدید (SQLite نوع ستون را با ALTER عوض نمی‌کند)
+
+    create_sql باید جدول {table}_new را بسازد و select_sql ردیف‌های آن را از
+    جدول قدیمی بخواند. ایندکس‌ها با حذف جدول قدیمی از بین می‌روند و دوباره
+    ساخته می‌شوند؛ شمارنده‌ی AUTOINCREMENT حفظ می‌شود تا id تکراری داده نشود.
+    """
+    seq = c.execute("SELECT seq FROM sqlite_sequence WHERE name = ?", (table,)).fetchone()
+    c.execute(create_sql)
+    c.execute(f"INSERT INTO {table}_new {select_sql}")
+    c.execute(f"DROP TABLE {table}")
+    c.execute(f"ALTER TABLE {table}_new RENAME TO {table}")
+    if seq:
+        c.execute("DELETE FROM sqlite_sequence WHERE name = ?", (table,))
+        c.execute("INSERT INTO sqlite_sequence (name, seq) VALUES (?, ?)", (table, seq[0]))
+    for index in indexes:
+        c.execute(index)
+
+
+def _m001_base_tables(c):
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            telegram_id INTEGER UNIQUE,
+            username TEXT,
+            name TEXT,
+            role TEXT,                   -- 'admin', 'manager', 'member'
+            supervisor_id INTEGER        -- For member: manager.id, For manager: admin.id
+        )
+    ''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS tasks (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            title TEXT,
+            description TEXT,
+            assigned_by INTEGER,
+            assigned_to INTEGER,
+            deadline TEXT,
+            reminder_type TEXT DEFAULT 'none',
+            reminder_value INTEGER DEFAULT NULL,
+            is_done INTEGER DEFAULT 0,
+            is_urgent INTEGER DEFAULT 0,
+            created_at TEXT
+        )
+    ''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS reports (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            task_id INTEGER,
+            user_id INTEGER,
+            content TEXT,
+            timestamp TEXT,
+            score INTEGER
+        )
+    ''')
+    # دیتابیس‌های قدیمی ستون username را ندارند
+    _add_column(c, 'users', 'username', 'TEXT')
+
+
+def _m002_secondary_indexes(c):
+    # get_user_by_username
+    c.execute("CREATE INDEX IF NOT EXISTS idx_users_username ON users(username)")
+    # get_team_users / get_managers_for_admin
+    c.execute("CREATE INDEX IF NOT EXISTS idx_users_supervisor_role ON users(supervisor_id, role)")
+    # get_all_users_by_role
+    c.execute("CREATE INDEX IF NOT EXISTS idx_users_role ON users(role)")
+    # get_tasks_for_user / get_all_active_tasks
+    c.execute("CREATE INDEX IF NOT EXISTS idx_tasks_assigned_to_done ON tasks(assigned_to, is_done)")
+    # فید گزارش‌های مدیر اصلی: ORDER BY timestamp DESC LIMIT 20
+    c.execute("CREATE INDEX IF NOT EXISTS idx_reports_timestamp ON reports(timestamp)")
+    # فید گزارش‌های هر کاربر و تیم
+    c.execute("CREATE INDEX IF NOT EXISTS idx_reports_user_timestamp ON reports(user_id, timestamp)")
+
+
+def _m003_task_reminders(c):
+    # زمان آخرین یادآوری ارسال‌شده؛ برای جبران یادآوری‌های از دست رفته پس از ری‌استارت
+    _add_column(c, 'tasks', 'last_reminded_at', 'TEXT')
+
+
+def _m004_fsm_storage(c):
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS fsm_storage (
+            key TEXT PRIMARY KEY,        -- StorageKey سریال‌شده
+            state TEXT,
+            data TEXT,                   -- JSON
+            updated_at INTEGER           -- epoch ثانیه
+        )
+    ''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_fsm_storage_updated_at ON fsm_storage(updated_at)")
+
+
+def _m005_user_closure(c):
+    # closure table رابطه‌ی supervisor_id: هر جفت (جد، نواده) با فاصله‌ی آن‌ها،
+    # به علاوه‌ی ردیف (خود، خود، 0) برای هر کاربر
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS user_closure (
+            ancestor_id INTEGER NOT NULL,
+            descendant_id INTEGER NOT NULL,
+            depth INTEGER NOT NULL,
+            PRIMARY KEY (ancestor_id, descendant_id)
+        ) WITHOUT ROWID
+    ''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_user_closure_descendant ON user_closure(descendant_id)")
+    c.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_users_closure_insert AFTER INSERT ON users
+        BEGIN
+            INSERT INTO user_closure (ancestor_id, descendant_id, depth) VALUES (NEW.id, NEW.id, 0);
+            INSERT INTO user_closure (ancestor_id, descendant_id, depth)
+                SELECT ancestor_id, NEW.id, depth + 1 FROM user_closure WHERE descendant_id = NEW.supervisor_id;
+        END
+    ''')
+    c.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_users_closure_cycle BEFORE UPDATE OF supervisor_id ON users
+        WHEN NEW.supervisor_id IS NOT NULL AND EXISTS (
+            SELECT 1 FROM user_closure WHERE ancestor_id = NEW.id AND descendant_id = NEW.supervisor_id
+        )
+        BEGIN
+            SELECT RAISE(ABORT, 'supervisor_id would create a cycle');
+        END
+    ''')
+    # جابه‌جایی یک زیردرخت: قطع از اجداد قبلی و اتصال به اجداد جدید
+    c.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_users_closure_move AFTER UPDATE OF supervisor_id ON users
+        WHEN OLD.supervisor_id IS NOT NEW.supervisor_id
+        BEGIN
+            DELETE FROM user_closure
+            WHERE descendant_id IN (SELECT descendant_id FROM user_closure WHERE ancestor_id = NEW.id)
+              AND ancestor_id IN (SELECT ancestor_id FROM user_closure WHERE descendant_id = NEW.id AND ancestor_id != NEW.id);
+            INSERT INTO user_closure (ancestor_id, descendant_id, depth)
+                SELECT a.ancestor_id, d.descendant_id, a.depth + d.depth + 1
+                FROM user_closure a, user_closure d
+                WHERE a.descendant_id = NEW.supervisor_id AND d.ancestor_id = NEW.id;
+        END
+    ''')
+    c.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_users_closure_delete AFTER DELETE ON users
+        BEGIN
+            DELETE FROM user_closure WHERE descendant_id = OLD.id OR ancestor_id = OLD.id;
+        END
+    ''')
+    # پر کردن از روی داده‌های موجود؛ سقف عمق جلوی حلقه‌ی بی‌پایان در داده‌ی دوری را می‌گیرد
+    c.execute('''
+        INSERT OR IGNORE INTO user_closure (ancestor_id, descendant_id, depth)
+        WITH RECURSIVE chain(ancestor_id, descendant_id, depth) AS (
+            SELECT id, id, 0 FROM users
+            UNION ALL
+            SELECT s.id, chain.descendant_id, chain.depth + 1
+            FROM chain
+            JOIN users u ON u.id = chain.ancestor_id
+            JOIN users s ON s.id = u.supervisor_id
+            WHERE chain.depth < (SELECT COUNT(*) FROM users)
+        )
+        SELECT ancestor_id, descendant_id, MIN(depth) FROM chain GROUP BY ancestor_id, descendant_id
+    ''')
+
+
+def _m006_report_stats(c):
+    # آمار تجمیعی گزارش‌ها؛ scope='user' گزارش‌های خود کاربر و scope='team' گزارش‌های
+    # همه‌ی زیرمجموعه‌هایش. period ماه میلادی (YYYY-MM) یا 'all' برای کل دوره است.
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS report_stats (
+            scope TEXT NOT NULL,
+            subject_id INTEGER NOT NULL,
+            period TEXT NOT NULL,
+            reports INTEGER NOT NULL DEFAULT 0,
+            scored INTEGER NOT NULL DEFAULT 0,
+            score_sum INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (scope, subject_id, period)
+        ) WITHOUT ROWID
+    ''')
+    # جدول‌های امتیاز: همه‌ی کاربران یک scope در یک دوره
+    c.execute("CREATE INDEX IF NOT EXISTS idx_report_stats_period ON report_stats(scope, period)")
+    c.execute('''
+        INSERT OR IGNORE INTO report_stats (scope, subject_id, period, reports, scored, score_sum)
+        SELECT CASE WHEN h.depth = 0 THEN 'user' ELSE 'team' END, h.ancestor_id,
+               CASE p.kind WHEN 'month' THEN substr(r.timestamp, 1, 7) ELSE 'all' END,
+               COUNT(*), COUNT(r.score), COALESCE(SUM(r.score), 0)
+        FROM reports r
+        JOIN user_closure h ON h.descendant_id = r.user_id
+        CROSS JOIN (SELECT 'month' AS kind UNION ALL SELECT 'all') p
+        GROUP BY 1, 2, 3
+    ''')
+
+
+def _m007_fulltext_search(c):
+    # متن یکسان‌سازی‌شده (textnorm.normalize) با rowid برابر id ردیف اصلی؛
+    # همگام‌سازی در مسیر نوشتن database.py انجام می‌شود چون یکسان‌سازی در پایتون است
+    c.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS reports_fts USING fts5(
+            content, tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+        )
+    ''')
+    c.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS tasks_fts USING fts5(
+            title, description, tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+        )
+    ''')
+    rows = c.execute("SELECT id, content FROM reports")
+    while batch := rows.fetchmany(1000):
+        c.executemany(
+            "INSERT INTO reports_fts (rowid, content) VALUES (?, ?)",
+            [(row[0], normalize(row[1])) for row in batch]
+        )
+    rows = c.execute("SELECT id, title, description FROM tasks")
+    while batch := rows.fetchmany(1000):
+        c.executemany(
+            "INSERT INTO tasks_fts (rowid, title, description) VALUES (?, ?, ?)",
+            [(row[0], normalize(row[1]), normalize(row[2])) for row in batch]
+        )
+
+
+def _m008_epoch_timestamps(c):
+    # زمان‌های ISO بدون منطقه‌ی زمانی به epoch (ثانیه) به وقت config.TIMEZONE؛
+    # ددلاین (فقط تاریخ) به epoch ساعت ۰۰:۰۰ همان روز تبدیل می‌شود
+    c.create_function("iso_to_epoch", 1, iso_to_epoch, deterministic=True)
+    _rebuild_table(c, 'tasks', '''
+        CREATE TABLE tasks_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            title TEXT,
+            description TEXT,
+            assigned_by INTEGER,
+            assigned_to INTEGER,
+            deadline INTEGER,
+            reminder_type TEXT DEFAULT 'none',
+            reminder_value INTEGER DEFAULT NULL,
+            is_done INTEGER DEFAULT 0,
+            is_urgent INTEGER DEFAULT 0,
+            created_at INTEGER,
+            last_reminded_at INTEGER
+        )
+    ''', '''
+        SELECT id, title, description, assigned_by, assigned_to, iso_to_epoch(deadline),
+               reminder_type, reminder_value, is_done, is_urgent,
+               iso_to_epoch(created_at), iso_to_epoch(last_reminded_at)
+        FROM tasks
+    ''', [
+        "CREATE INDEX idx_tasks_assigned_to_done ON tasks(assigned_to, is_done)",
+        # تسک‌های عقب‌افتاده و نزدیک به ددلاین
+        "CREATE INDEX idx_tasks_active_deadline ON tasks(deadline) WHERE is_done = 0",
+    ])
+    _rebuild_table(c, 'reports', '''
+        CREATE TABLE reports_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            task_id INTEGER,
+            user_id INTEGER,
+            content TEXT,
+            timestamp INTEGER,
+            score INTEGER
+        )
+    ''', '''
+        SELECT id, task_id, user_id, content, iso_to_epoch(timestamp), score FROM reports
+    ''', [
+        "CREATE INDEX idx_reports_timestamp ON reports(timestamp)",
+        "CREATE INDEX idx_reports_user_timestamp ON reports(user_id, timestamp)",
+    ])
+
+
+def _m009_task_groups(c):
+    # یک تسک که همزمان به چند نفر داده شده؛ هر نفر ردیف tasks خودش را دارد
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS task_groups (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            title TEXT,
+            assigned_by INTEGER,
+            created_at INTEGER
+        )
+    ''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_task_groups_assigned_by ON task_groups(assigned_by)")
+    _add_column(c, 'tasks', 'group_id', 'INTEGER')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_tasks_group_id ON tasks(group_id) WHERE group_id IS NOT NULL")
+
+
+def _m010_assignee_name_index(c):
+    # انتخاب دریافت‌کننده‌ی تسک: صفحه‌بندی keyset و جستجوی پیشوندی روی (name, id) در
+    # اعضای یک تیم یا همه‌ی مدیران میانی؛ ایندکس‌های قبلی پیشوند این‌ها هستند
+    c.execute("DROP INDEX IF EXISTS idx_users_supervisor_role")
+    c.execute("DROP INDEX IF EXISTS idx_users_role")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_users_supervisor_role_name ON users(supervisor_id, role, name)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_users_role_name ON users(role, name)")
+
+
+def _m011_reports_archive(c):
+    # گزارش‌های قدیمی (retention.py)؛ content متن UTF-8 فشرده با zlib است. آمار
+    # report_stats دست نمی‌خورد و ردیف FTS گزارش آرشیوشده حذف می‌شود
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS reports_archive (
+            id INTEGER PRIMARY KEY,
+            task_id INTEGER,
+            user_id INTEGER,
+            timestamp INTEGER,
+            score INTEGER,
+            content BLOB
+        )
+    ''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_reports_archive_user_timestamp ON reports_archive(user_id, timestamp)")
+
+
+def _m012_tenants(c):
+    # چند سازمان در یک دیتابیس؛ هر کاربر (و تسک‌ها و گزارش‌هایش) فقط در یک سازمان است.
+    # داده‌های موجود سازمان ۱ می‌شوند
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS tenants (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT,
+            created_at INTEGER
+        )
+    ''')
+    # لینک دعوت (deep link ‏/start inv_<token>)؛ نقش و سرپرست عضو جدید را تعیین می‌کند
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS invites (
+            token TEXT PRIMARY KEY,
+            tenant_id INTEGER NOT NULL,
+            role TEXT NOT NULL,
+            supervisor_id INTEGER,
+            created_at INTEGER,
+            expires_at INTEGER,
+            uses_left INTEGER
+        )
+    ''')
+    for table in ('users', 'tasks', 'reports', 'task_groups', 'reports_archive'):
+        _add_column(c, table, 'tenant_id', 'INTEGER')
+    if c.execute("SELECT 1 FROM users LIMIT 1").fetchone():
+        c.execute("INSERT OR IGNORE INTO tenants (id, name, created_at) VALUES (1, 'Dozio', CAST(strftime('%s', 'now') AS INTEGER))")
+        for table in ('users', 'tasks', 'reports', 'task_groups', 'reports_archive'):
+            c.execute(f"UPDATE {table} SET tenant_id = 1 WHERE tenant_id IS NULL")
+    # ایندکس‌های «همه‌ی سازمان» (نمای مدیر اصلی) حالا با سازمان شروع می‌شوند
+    c.execute("DROP INDEX IF EXISTS idx_users_role_name")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_users_tenant_role_name ON users(tenant_id, role, name)")
+    c.execute("DROP INDEX IF EXISTS idx_reports_timestamp")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_reports_tenant_timestamp ON reports(tenant_id, timestamp)")
+    c.execute("DROP INDEX IF EXISTS idx_tasks_active_deadline")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_tasks_tenant_active_deadline ON tasks(tenant_id, deadline) WHERE is_done = 0")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_reports_archive_tenant_timestamp ON reports_archive(tenant_id, timestamp)")
+
+
+def _m013_notifications(c):
+    # اعلان به سرپرست (notifications.py): 'instant' پیام تجمیعی، 'digest' خلاصه‌ی روزانه، 'off' هیچ
+    _add_column(c, 'users', 'notify_mode', "TEXT DEFAULT 'instant'")
+    _add_column(c, 'tasks', 'done_at', 'INTEGER')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_users_digest ON users(id) WHERE notify_mode = 'digest'")
+    # خلاصه‌ی روزانه: تسک‌های انجام‌شده و عقب‌افتاده‌ی هر مدیر بر اساس assigned_by
+    c.execute("CREATE INDEX IF NOT EXISTS idx_tasks_assigned_by_done_at ON tasks(assigned_by, done_at) WHERE done_at IS NOT NULL")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_tasks_assigned_by_active_deadline ON tasks(assigned_by, deadline) WHERE is_done = 0")
+
+
+def _m014_active_task_indexes(c):
+    # فهرست تسک‌های فعال کاربر (keyset روی id) فقط روی تسک‌های باز؛ تسک‌های انجام‌شده در ایندکس نیستند
+    c.execute("DROP INDEX IF EXISTS idx_tasks_assigned_to_done")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_tasks_assigned_to_active ON tasks(assigned_to, id) WHERE is_done = 0")
+    # گزارش‌های ثبت‌شده روی یک تسک
+    c.execute("CREATE INDEX IF NOT EXISTS idx_reports_task ON reports(task_id) WHERE task_id IS NOT NULL")
+
+
+def _m015_report_attachments(c):
+    # فقط شناسه‌های فایل تلگرام (attachments.py)؛ ترتیب پیوست‌ها همان ترتیب id است.
+    # پیوست گزارش آرشیوشده هم می‌ماند چون id گزارش در reports_archive تغییر نمی‌کند
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS report_attachments (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            report_id INTEGER NOT NULL,
+            kind TEXT NOT NULL,
+            file_id TEXT NOT NULL,
+            file_unique_id TEXT
+        )
+    ''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_report_attachments_report ON report_attachments(report_id)")
+
+
+def _m016_weekly_stats(c):
+    # دوره‌ی هفتگی در report_stats (W:YYYY-MM-DD شنبه‌ی شروع هفته) تا «گزارش‌های تیم از
+    # شنبه» هم مثل آمار ماهانه فقط از جدول تجمیعی خوانده شود
+    c.create_function("week_key", 1, week_key, deterministic=True)
+    c.execute('''
+        INSERT OR IGNORE INTO report_stats (scope, subject_id, period, reports, scored, score_sum)
+        SELECT CASE WHEN h.depth = 0 THEN 'user' ELSE 'team' END, h.ancestor_id, week_key(r.timestamp),
+               COUNT(*), COUNT(r.score), COALESCE(SUM(r.score), 0)
+        FROM reports r
+        JOIN user_closure h ON h.descendant_id = r.user_id
+        GROUP BY 1, 2, 3
+    ''')
+
+
+def _m017_users_tenant_username(c):
+    # get_user_by_username و ورود گروهی: یوزرنیم همیشه درون یک سازمان جست‌وجو می‌شود
+    c.execute("CREATE INDEX IF NOT EXISTS idx_users_tenant_username ON users(tenant_id, username)")
+
+
+def _m018_report_stats_tenant(c):
+    # جدول امتیاز کل سازمان (نمای مدیر اصلی) یک پیمایش بازه‌ای روی کلید اصلی باشد، نه
+    # JOIN با users؛ آمار کاربران حذف‌شده (بدون سازمان) کنار گذاشته می‌شود
+    _rebuild_table(c, 'report_stats', '''
+        CREATE TABLE report_stats_new (
+            tenant_id INTEGER NOT NULL,
+            scope TEXT NOT NULL,
+            subject_id INTEGER NOT NULL,
+            period TEXT NOT NULL,
+            reports INTEGER NOT NULL DEFAULT 0,
+            scored INTEGER NOT NULL DEFAULT 0,
+            score_sum INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (tenant_id, scope, period, subject_id)
+        ) WITHOUT ROWID
+    ''', '''
+        SELECT u.tenant_id, s.scope, s.subject_id, s.period, s.reports, s.scored, s.score_sum
+        FROM report_stats s
+        JOIN users u ON u.id = s.subject_id
+        WHERE u.tenant_id IS NOT NULL
+    ''', [
+        # get_stats و ON CONFLICT در _bump_stats
+        "CREATE UNIQUE INDEX idx_report_stats_subject ON report_stats(scope, subject_id, period)",
+    ])
+
+
+def _m019_overdue_checked_day(c):
+    # آخرین روز ددلاینی که notifications.check_overdue برای سازمان بررسی کرده (epoch شروع روز)
+    _add_column(c, 'tenants', 'overdue_checked_day', 'INTEGER')
+
+
+def _m020_user_position(c):
+    # سمت کاربر جدا از نام؛ فقط هنگام نمایش کنار نام می‌آید (hierarchy.display_name).
+    # سمت‌هایی که قبلاً داخل نام ذخیره شده‌اند همان‌جا می‌مانند
+    _add_column(c, 'users', 'position', 'TEXT')
+
+
+# (نسخه، توضیح، تابع) — فقط به انتها اضافه شود
+MIGRATIONS = [
+    (1, "base tables", _m001_base_tables),
+    (2, "secondary indexes", _m002_secondary_indexes),
+    (3, "task reminder bookkeeping", _m003_task_reminders),
+    (4, "fsm storage", _m004_fsm_storage),
+    (5, "user hierarchy closure", _m005_user_closure),
+    (6, "report stats", _m006_report_stats),
+    (7, "full-text search", _m007_fulltext_search),
+    (8, "epoch timestamps", _m008_epoch_timestamps),
+    (9, "task groups", _m009_task_groups),
+    (10, "assignee name index", _m010_assignee_name_index),
+    (11, "reports archive", _m011_reports_archive),
+    (12, "tenants", _m012_tenants),
+    (13, "notifications", _m013_notifications),
+    (14, "active task indexes", _m014_active_task_indexes),
+    (15, "report attachments", _m015_report_attachments),
+    (16, "weekly stats", _m016_weekly_stats),
+    (17, "users tenant username index", _m017_users_tenant_username),
+    (18, "report stats tenant", _m018_report_stats_tenant),
+    (19, "overdue checked day", _m019_overdue_checked_day),
+    (20, "user position", _m020_user_position),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def current_version(c):
+    row = c.execute("SELECT MAX(version) FROM schema_version").fetchone()
+    return row[0] or 0
+
+
+def migrate(conn):
+    """اجرای مهاجرت‌های اعمال‌نشده؛ هر مهاجرت در تراکنش جداگانه.
+
+    conn باید در حالت autocommit باشد (isolation_level=None).
+    """
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            name TEXT,
+            applied_at TEXT
+        )
+    ''')
+    version = current_version(conn)
+    if version > LATEST_VERSION:
+        raise SchemaDriftError(
+            f"نسخه‌ی دیتابیس ({version}) از آخرین نسخه‌ی شناخته‌شده ({LATEST_VERSION}) جدیدتر است"
+        )
+    for number, name, func in MIGRATIONS:
+        if number <= version:
+            continue
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # ممکن است پروسه‌ی دیگری همزمان همین مهاجرت را اعمال کرده باشد
+            if current_version(conn) >= number:
+                conn.execute("ROLLBACK")
+                continue
+            func(conn)
+            conn.execute(
+                "INSERT INTO schema_version (version, name, applied_at) VALUES (?, ?, ?)",
+                (number, name, datetime.now().isoformat())
+            )
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+
+def describe_schema(conn):
+    """توصیف مقایسه‌پذیر جدول‌ها، ستون‌ها، ایندکس‌ها و تریگرها"""
+    schema = {}
+    objects = conn.execute('''
+        SELECT type, name, tbl_name FROM sqlite_master
+        WHERE name NOT LIKE 'sqlite_%' AND type IN ('table', 'index', 'trigger', 'view')
+    ''').fetchall()
+    for obj_type, name, table in objects:
+        if obj_type == 'table':
+            schema[('table', name)] = {
+                row[1]: (row[2].upper(), row[3], row[4], row[5])
+                for row in conn.execute(f"PRAGMA table_info({name})")
+            }
+        elif obj_type == 'index':
+            unique, partial = conn.execute(
+                "SELECT \"unique\", partial FROM pragma_index_list(?) WHERE name = ?", (table, name)
+            ).fetchone() or (None, None)
+            columns = tuple(row[2] for row in conn.execute(f"PRAGMA index_info({name})"))
+            schema[('index', name)] = (table, columns, unique, partial)
+        else:
+            schema[(obj_type, name)] = table
+    return schema
+
+
+def expected_schema():
+    """اسکیمای مرجع: همه‌ی مهاجرت‌ها روی یک دیتابیس خالی در حافظه"""
+    conn = sqlite3.connect(':memory:', isolation_level=None)
+    try:
+        migrate(conn)
+        return describe_schema(conn)
+    finally:
+        conn.close()
+
+
+def check_schema(conn):
+    """در صورت اختلاف اسکیمای زنده با اسکیمای مورد انتظار SchemaDriftError می‌دهد"""
+    expected = expected_schema()
+    live = describe_schema(conn)
+    problems = []
+    for key in sorted(expected.keys() | live.keys()):
+        if key not in live:
+            problems.append(f"missing {key[0]} {key[1]}")
+        elif key not in expected:
+            problems.append(f"unexpected {key[0]} {key[1]}")
+        elif expected[key] != live[key]:
+            problems.append(f"{key[0]} {key[1]} differs: expected {expected[key]!r}, found {live[key]!r}")
+    if problems:
+        raise SchemaDriftError("schema drift detected:\n  " + "\n  ".join(problems))
@@ -0,0 +1,245 @@
+"""اعلان فعالیت تیم به سرپرست‌ها
+
+سه رویداد: گزارش تازه (به supervisor_id نویسنده)، تسک انجام‌شده و تسکی که
+ددلاینش گذشته (هر دو به assigned_by). رویدادها در حافظه برای هر گیرنده جمع
+می‌شوند و NOTIFY_WINDOW ثانیه بعد از اولین رویداد در یک پیام فرستاده می‌شوند؛
+مدیر پرمشغله به جای یک پیام برای هر گزارش حداکثر یک پیام در هر بازه می‌گیرد.
+
+هر سرپرست با /notify حالت خودش را انتخاب می‌کند:
+- instant: همان پیام تجمیعی (پیش‌فرض)
+- digest: پیام لحظه‌ای ندارد؛ ساعت DIGEST_HOUR یک خلاصه‌ی روزانه می‌گیرد که با
+  یک کوئری (database.get_digest) از خود جدول‌ها ساخته می‌شود، نه از رویدادها
+- off: هیچ
+
+تسک‌های عقب‌افتاده روزی یک بار در ساعت OVERDUE_HOUR بررسی می‌شوند؛ آخرین روز
+بررسی‌شده‌ی هر سازمان در دیتابیس است، پس روزهایی که ربات آن ساعت خاموش بوده در
+بررسی بعدی (یا هنگام شروع، اگر ساعتش گذشته باشد) جبران می‌شوند. رویدادهای جمع‌شده
+هنگام توقف ربات فرستاده می‌شوند؛ خلاصه‌ی روزانه‌ی از دست رفته جبران نمی‌شود.
+"""
+import asyncio
+import heapq
+import logging
+import time
+from collections import Counter
+
+import metrics
+import timeutil
+from async_database import claim_newly_overdue, get_digest, get_digest_recipients, get_notify_target, get_tenant_ids
+from config import DIGEST_HOUR, NOTIFY_WINDOW
+from outbox import bulk
+from pagination import split_text
+
+# بررسی تسک‌هایی که تا دیروز ددلاینشان بوده، هم‌ساعت یادآوری روز ددلاین
+OVERDUE_HOUR = 9
+# حداکثر تعداد عنوان تسک در یک پیام تجمیعی؛ بقیه فقط شمرده می‌شوند
+MAX_TITLES = 10
+
+MODES = {'instant': 'instant', 'فوری': 'instant', 'digest': 'digest', 'روزانه': 'digest', 'off': 'off', 'خاموش': 'off'}
+MODE_TITLES = {'instant': "فوری (تجمیعی)", 'digest': "خلاصه‌ی روزانه", 'off': "خاموش"}
+USAGE = (
+    "/notify فوری — گزارش‌ها، تسک‌های انجام‌شده و عقب‌افتاده‌ی تیم، چند دقیقه یک‌بار در یک پیام\n"
+    "/notify روزانه — فقط یک خلاصه در روز\n"
+    "/notify خاموش — بدون اعلان"
+)
+
+
+class _Batch:
+    """رویدادهای جمع‌شده‌ی یک گیرنده تا زمان ارسال"""
+    __slots__ = ("reports", "done", "done_count", "overdue", "overdue_count")
+
+    def __init__(self):
+        self.reports = Counter()
+        self.done = []
+        self.done_count = 0
+        self.overdue = []
+        self.overdue_count = 0
+
+    def text(self):
+        lines = ["🔔 فعالیت تیم"]
+        if self.reports:
+            names = "، ".join(name if n == 1 else f"{name} ({n})" for name, n in self.reports.most_common())
+            lines.append(f"\n📝 {sum(self.reports.values())} گزارش جدید: {names}")
+        for icon, label, items, count in (
+            ("✅", "تسک انجام شد", self.done, self.done_count),
+            ("⚠️", "تسک از ددلاین گذشت", self.overdue, self.overdue_count),
+        ):
+            if count:
+                lines.append(f"\n{icon} {count} {label}:")
+                lines.extend(f"• {title} — {name}" for title, name in items)
+                if count > len(items):
+                    lines.append(f"• و {count - len(items)} مورد دیگر")
+        return "\n".join(lines)
+
+
+def digest_text(rows):
+    lines = ["🗞 خلاصه‌ی روزانه‌ی تیم\n"]
+    for row in rows:
+        parts = []
+        if row['reports']:
+            parts.append(f"📝 {row['reports']} گزارش")
+        if row['done']:
+            parts.append(f"✅ {row['done']} انجام‌شده")
+        if row['overdue']:
+            parts.append(f"⚠️ {row['overdue']} عقب‌افتاده")
+        lines.append(f"👤 {row['name']}: " + "، ".join(parts))
+    return "\n".join(lines)
+
+
+def next_at(hour, now):
+    """epoch نزدیک‌ترین ساعت hour بعد از now"""
+    today = timeutil.day_start(now)
+    at = timeutil.at_hour(today, hour)
+    return at if at > now else timeutil.at_hour(timeutil.add_days(today, 1), hour)
+
+
+class Notifier:
+    def __init__(self, bot, window=NOTIFY_WINDOW, digest_hour=DIGEST_HOUR):
+        self.bot = bot
+        self.window = window
+        self.digest_hour = digest_hour
+        # user_id گیرنده -> _Batch؛ و heap زمان ارسال هر batch
+        self._batches = {}
+        self._heap = []
+        self._wakeup = asyncio.Event()
+        self._runners = []
+        self._sending = set()
+
+    def __len__(self):
+        return len(self._batches)
+
+    # --- رویدادها (از هندلرها؛ فقط حافظه، بدون کوئری و ارسال)
+    def report(self, user):
+        if user['supervisor_id']:
+            self._batch(user['supervisor_id'], 'report').reports[user['name']] += 1
+
+    def task_done(self, task):
+        """task: ردیف برگشتی mark_task_done"""
+        if task['assigned_by'] and task['assigned_by'] != task['assigned_to']:
+            batch = self._batch(task['assigned_by'], 'done')
+            batch.done_count += 1
+            if len(batch.done) < MAX_TITLES:
+                batch.done.append((task['title'], task['user_name']))
+
+    def task_overdue(self, task):
+        if task['assigned_by'] and task['assigned_by'] != task['assigned_to']:
+            batch = self._batch(task['assigned_by'], 'overdue')
+            batch.overdue_count += 1
+            if len(batch.overdue) < MAX_TITLES:
+                batch.overdue.append((task['title'], task['user_name']))
+
+    def _batch(self, user_id, kind):
+        metrics.notify_events.inc(kind)
+        batch = self._batches.get(user_id)
+        if batch is None:
+            batch = self._batches[user_id] = _Batch()
+            heapq.heappush(self._heap, (time.monotonic() + self.window, user_id))
+            self._wakeup.set()
+        return batch
+
+    # --- اجرا
+    def start(self):
+        self._runners = [asyncio.create_task(self._run_flush()), asyncio.create_task(self._run_daily())]
+
+    async def stop(self):
+        for runner in self._runners:
+            runner.cancel()
+            try:
+                await runner
+            except asyncio.CancelledError:
+                pass
+        self._runners = []
+        # رویدادهای جمع‌شده از دست نروند
+        for user_id in list(self._batches):
+            self._spawn(self._flush(user_id))
+        self._heap.clear()
+        if self._sending:
+            await asyncio.gather(*self._sending, return_exceptions=True)
+
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self._sending.add(task)
+        task.add_done_callback(self._sending.discard)
+
+    async def _run_flush(self):
+        while True:
+            now = time.monotonic()
+            while self._heap and self._heap[0][0] <= now:
+                _, user_id = heapq.heappop(self._heap)
+                # ارسال‌ها موازی‌اند؛ نرخ را صف outbox کنترل می‌کند
+                self._spawn(self._flush(user_id))
+            timeout = max(self._heap[0][0] - time.monotonic(), 0) if self._heap else None
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _flush(self, user_id):
+        batch = self._batches.pop(user_id, None)
+        if batch is None:
+            return
+        try:
+            # حالت گیرنده فقط یک بار برای کل batch خوانده می‌شود
+            target = await get_notify_target(user_id)
+        except Exception:
+            logging.exception("notification to user %s failed", user_id)
+            return
+        if target and target['telegram_id'] and target['notify_mode'] == 'instant':
+            await self._send(target['telegram_id'], batch.text(), 'instant')
+
+    async def _send(self, chat_id, text, kind):
+        try:
+            with bulk():
+                for chunk in split_text(text):
+                    await self.bot.send_message(chat_id, chunk)
+        except Exception:
+            # مثلاً کاربر ربات را بلاک کرده است
+            logging.exception("%s notification to chat %s failed", kind, chat_id)
+        else:
+            metrics.notify_sent.inc(kind)
+
+    async def _run_daily(self):
+        jobs = [(OVERDUE_HOUR, self.check_overdue), (self.digest_hour, self.send_digests)]
+        now = timeutil.now()
+        if now >= timeutil.at_hour(timeutil.day_start(now), OVERDUE_HOUR):
+            # بررسی امروز شاید هنگام خاموش بودن ربات از دست رفته باشد؛ تکرارش بی‌اثر است
+            await self._run_job(self.check_overdue)
+        while True:
+            now = timeutil.now()
+            due = [(next_at(hour, now), job) for hour, job in jobs]
+            when = min(at for at, _ in due)
+            await asyncio.sleep(when - now)
+            # کارهای هم‌ساعت (مثلاً DIGEST_HOUR == OVERDUE_HOUR) همه اجرا می‌شوند
+            for at, job in due:
+                if at == when:
+                    await self._run_job(job)
+
+    async def _run_job(self, job):
+        try:
+            await job()
+        except Exception:
+            logging.exception("daily notification job failed")
+
+    async def check_overdue(self):
+        """تسک‌های انجام‌نشده‌ای که ددلاینشان از آخرین بررسی تا دیروز بوده، سازمان به سازمان"""
+        yesterday = timeutil.add_days(timeutil.day_start(timeutil.now()), -1)
+        for tenant_id in await get_tenant_ids():
+            for task in await claim_newly_overdue(tenant_id, yesterday):
+                self.task_overdue(task)
+
+    async def send_digests(self):
+        """خلاصه‌ی ۲۴ ساعت گذشته برای هر گیرنده‌ی حالت digest؛ یک کوئری برای هر نفر
+
+        کوئری‌ها پشت سر هم و ارسال‌ها موازی (در صف outbox) انجام می‌شوند؛ تعداد
+        خلاصه‌های غیرخالی را برمی‌گرداند.
+        """
+        now = timeutil.now()
+        since, today = now - timeutil.DAY, timeutil.day_start(now)
+        count = 0
+        for recipient in await get_digest_recipients():
+            rows = await get_digest(recipient['id'], since, today)
+            if rows:
+                self._spawn(self._send(recipient['telegram_id'], digest_text(rows), 'digest'))
+                count += 1
+        logging.info("notifier: %d daily digests queued", count)
+        return count
@@ -0,0 +1,284 @@
+"""صف مرکزی پیام‌های خروجی با رعایت محدودیت‌های نرخ تلگرام
+
+OutboundQueue به صورت request middleware روی session ربات نصب می‌شود، پس
+همه‌ی ارسال‌ها (message.answer، bot.send_message و ...) از آن عبور می‌کنند:
+
+- سطل توکن سراسری (حدود ۳۰ پیام در ثانیه) و سطل جدا برای هر چت
+- رعایت retry_after در خطای TelegramRetryAfter بدون معطل کردن چت‌های دیگر؛ اگر
+  چند چت جدا در مدت کوتاهی retry_after بگیرند محدودیت سراسری است و ارسال‌های
+  انبوه کل ربات هم مکث می‌کنند
+- تلاش دوباره با backoff برای خطاهای شبکه و سرور
+- اولویت پاسخ‌های تعاملی بر ارسال‌های انبوه (یادآوری، اعلان، پیام همگانی)
+
+ارسال‌های انبوه باید داخل ``with bulk():`` انجام شوند.
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramNetworkError, TelegramRetryAfter, TelegramServerError
+
+INTERACTIVE = 0
+BULK = 1
+
+GLOBAL_RATE = 30            # پیام در ثانیه برای کل ربات
+CHAT_RATE = 1               # پیام در ثانیه برای هر چت خصوصی
+GROUP_RATE = 20 / 60        # پیام در ثانیه برای هر گروه
+CHAT_BURST = 3
+MAX_RETRIES = 5
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 30
+CONCURRENCY = 16
+# retry_after در FLOOD_CHATS چت جدا ظرف FLOOD_WINDOW ثانیه: مکث ارسال‌های انبوه
+FLOOD_WINDOW = 10
+FLOOD_CHATS = 3
+
+# فقط متدهایی که پیام در چت می‌گذارند محدود می‌شوند (getUpdates و answerCallbackQuery نه)
+LIMITED_PREFIXES = ("Send", "Copy", "Forward", "Edit")
+
+_priority = ContextVar("outbox_priority", default=INTERACTIVE)
+
+
+@contextmanager
+def bulk():
+    """ارسال‌های داخل این بلوک با اولویت پایین (انبوه) در صف قرار می‌گیرند"""
+    token = _priority.set(BULK)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now):
+        """چند ثانیه تا در دسترس بودن یک توکن مانده است"""
+        self._refill(now)
+        wait = 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+        return max(wait, self.blocked_until - now)
+
+    def consume(self, now):
+        self._refill(now)
+        self.tokens -= 1
+
+    def block(self, seconds):
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+    def idle(self, now):
+        self._refill(now)
+        return self.tokens >= self.capacity and self.blocked_until <= now
+
+
+class _Item:
+    __slots__ = ("make_request", "bot", "method", "chat_id", "priority", "seq", "future", "enqueued_at", "attempt")
+
+    def __init__(self, make_request, bot, method, chat_id, priority, seq):
+        self.make_request = make_request
+        self.bot = bot
+        self.method = method
+        self.chat_id = chat_id
+        self.priority = priority
+        self.seq = seq
+        self.future = asyncio.get_running_loop().create_future()
+        self.enqueued_at = time.monotonic()
+        self.attempt = 0
+
+
+class OutboundQueue(BaseRequestMiddleware):
+    def __init__(self, global_rate=GLOBAL_RATE, chat_rate=CHAT_RATE, group_rate=GROUP_RATE,
+                 max_retries=MAX_RETRIES, concurrency=CONCURRENCY):
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_rate = chat_rate
+        self.group_rate = group_rate
+        self.max_retries = max_retries
+        self.concurrency = concurrency
+        self._chats = {}
+        self._heap = []
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._semaphore = None
+        self._pump_task = None
+        self._tasks = set()
+        self._delayed = 0
+        self._inflight = 0
+        self._latencies = deque(maxlen=1000)
+        # (زمان، chat_id) خطاهای retry_after اخیر و پایان مکث ارسال‌های انبوه
+        self._floods = deque()
+        self.bulk_blocked_until = 0.0
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+        self.throttled = 0
+
+    async def __call__(self, make_request, bot, method):
+        chat_id = getattr(method, "chat_id", None)
+        if chat_id is None or not type(method).__name__.startswith(LIMITED_PREFIXES):
+            return await make_request(bot, method)
+        if self._pump_task is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+            self._pump_task = asyncio.create_task(self._pump())
+        item = _Item(make_request, bot, method, chat_id, _priority.get(), next(self._seq))
+        self._push(item)
+        return await item.future
+
+    def depth(self):
+        """تعداد پیام‌های منتظر (در صف، در انتظار تلاش دوباره، یا در حال ارسال)"""
+        return len(self._heap) + self._delayed + self._inflight
+
+    def stats(self):
+        latencies = sorted(self._latencies)
+
+        def pct(p):
+            return latencies[min(len(latencies) - 1, int(p * len(latencies)))] if latencies else 0.0
+
+        return {
+            "depth": self.depth(),
+            "sent": self.sent,
+            "failed": self.failed,
+            "retried": self.retried,
+            "throttled": self.throttled,
+            "latency_p50": pct(0.50),
+            "latency_p95": pct(0.95),
+        }
+
+    async def close(self, timeout=5):
+        """تخلیه‌ی صف (حداکثر timeout ثانیه) و توقف"""
+        deadline = time.monotonic() + timeout
+        while self.depth() and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        if self._pump_task:
+            self._pump_task.cancel()
+            try:
+                await self._pump_task
+            except asyncio.CancelledError:
+                pass
+            self._pump_task = None
+        for _, _, item in self._heap:
+            if not item.future.done():
+                item.future.cancel()
+        self._heap.clear()
+
+    def _push(self, item):
+        heapq.heappush(self._heap, (item.priority, item.seq, item))
+        self._wakeup.set()
+
+    def _defer(self, item, delay):
+        self._delayed += 1
+
+        def requeue():
+            self._delayed -= 1
+            self._push(item)
+
+        asyncio.get_running_loop().call_later(delay, requeue)
+
+    def _chat_bucket(self, chat_id):
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) >= 10000:
+                now = time.monotonic()
+                self._chats = {k: b for k, b in self._chats.items() if not b.idle(now)}
+            # شناسه‌ی منفی یعنی گروه یا کانال
+            rate = self.group_rate if isinstance(chat_id, int) and chat_id < 0 else self.chat_rate
+            bucket = self._chats[chat_id] = TokenBucket(rate, CHAT_BURST)
+        return bucket
+
+    async def _pump(self):
+        while True:
+            if not self._heap:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            item = self._heap[0][2]
+            if item.future.done():
+                heapq.heappop(self._heap)
+                continue
+            now = time.monotonic()
+            bucket = self._chat_bucket(item.chat_id)
+            chat_wait = bucket.delay(now)
+            if chat_wait > 0:
+                # فقط همین چت منتظر می‌ماند؛ بقیه‌ی صف ادامه پیدا می‌کند
+                heapq.heappop(self._heap)
+                self._defer(item, chat_wait)
+                continue
+            global_wait = self.global_bucket.delay(now)
+            if item.priority == BULK:
+                # سر صف انبوه است پس پیام تعاملی منتظر نیست؛ پیام تعاملی تازه صف را بیدار می‌کند
+                global_wait = max(global_wait, self.bulk_blocked_until - now)
+            if global_wait > 0:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), global_wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            heapq.heappop(self._heap)
+            self.global_bucket.consume(now)
+            bucket.consume(now)
+            await self._semaphore.acquire()
+            self._inflight += 1
+            task = asyncio.create_task(self._send(item))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _send(self, item):
+        try:
+            result = await item.make_request(item.bot, item.method)
+        except TelegramRetryAfter as e:
+            self.throttled += 1
+            logging.warning("flood control in chat %s, retry after %ss", item.chat_id, e.retry_after)
+            self._chat_bucket(item.chat_id).block(e.retry_after)
+            self._note_flood(item.chat_id, e.retry_after)
+            self._defer(item, e.retry_after)
+        except (TelegramNetworkError, TelegramServerError) as e:
+            item.attempt += 1
+            if item.attempt > self.max_retries:
+                self.failed += 1
+                self._resolve(item, exception=e)
+            else:
+                self.retried += 1
+                self._defer(item, min(BACKOFF_BASE * 2 ** (item.attempt - 1), BACKOFF_MAX))
+        except Exception as e:
+            self.failed += 1
+            self._resolve(item, exception=e)
+        else:
+            self.sent += 1
+            self._latencies.append(time.monotonic() - item.enqueued_at)
+            self._resolve(item, result=result)
+        finally:
+            self._inflight -= 1
+            self._semaphore.release()
+
+    def _note_flood(self, chat_id, retry_after):
+        now = time.monotonic()
+        self._floods.append((now, chat_id))
+        while self._floods[0][0] < now - FLOOD_WINDOW:
+            self._floods.popleft()
+        chats = len({chat for _, chat in self._floods})
+        if chats >= FLOOD_CHATS and now + retry_after > self.bulk_blocked_until:
+            logging.warning("flood control in %d chats, pausing bulk sends for %ss", chats, retry_after)
+            self.bulk_blocked_until = now + retry_after
+
+    @staticmethod
+    def _resolve(item, result=None, exception=None):
+        if item.future.done():
+            return
+        if exception is not None:
+            item.future.set_exception(exception)
+        else:
+            item.future.set_result(result)
@@ -0,0 +1,114 @@
+"""صفحه‌بندی keyset فیدها و تقسیم متن‌های طولانی (محدودیت ۴۰۹۶ کاراکتری تلگرام)
+
+جهت‌ها از دید کاربر است: 'f' صفحه‌ی بعد (پایین‌تر در فهرست) و 'b' صفحه‌ی قبل.
+cursor همیشه id آخرین/اولین آیتم نمایش داده شده است، پس هزینه‌ی هر صفحه به
+عمق آن در تاریخچه بستگی ندارد.
+"""
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+
+MAX_MESSAGE_LENGTH = 4096
+PAGE_SIZE = 10
+# آیتم‌های طولانی‌تر کوتاه می‌شوند تا هر صفحه حداقل یک آیتم کامل داشته باشد
+MAX_ITEM_LENGTH = 1500
+
+
+def split_text(text, limit=MAX_MESSAGE_LENGTH):
+    """تقسیم متن به تکه‌های حداکثر limit کاراکتری، ترجیحاً روی مرز پاراگراف یا خط"""
+    chunks = []
+    while len(text) > limit:
+        cut = text.rfind('\n\n', 0, limit)
+        if cut <= 0:
+            cut = text.rfind('\n', 0, limit)
+        if cut <= 0:
+            cut = limit
+        chunks.append(text[:cut])
+        text = text[cut:].lstrip('\n')
+    if text or not chunks:
+        chunks.append(text)
+    return chunks
+
+
+async def answer_long(message, text, **kwargs):
+    """ارسال متن طولانی در چند پیام؛ reply_markup و بقیه‌ی تنظیمات فقط روی پیام آخر"""
+    chunks = split_text(text)
+    for chunk in chunks[:-1]:
+        await message.answer(chunk)
+    await message.answer(chunks[-1], **kwargs)
+
+
+def truncate(text, limit=MAX_ITEM_LENGTH):
+    return text if len(text) <= limit else text[:limit - 1] + "…"
+
+
+def keyset_args(descending, direction, cursor):
+    """آرگومان‌های before_id/after_id تابع دیتابیس برای جهت و cursor داده شده"""
+    if not direction:
+        return {}
+    forward = direction == 'f'
+    # در فید نزولی (جدید به قدیم) صفحه‌ی بعد یعنی id/زمان کوچک‌تر
+    if forward == descending:
+        return {'before_id': cursor}
+    return {'after_id': cursor}
+
+
+def offset_window(direction, cursor, limit=PAGE_SIZE):
+    """(offset, count) برای نتایج رتبه‌بندی‌شده که keyset ندارند؛ cursor جایگاه آیتم است
+
+    ردیف‌ها باید پیش از build_page کلید id برابر جایگاهشان بگیرند.
+    """
+    if direction == 'f':
+        return cursor + 1, limit + 1
+    if direction == 'b':
+        start = max(0, cursor - limit - 1)
+        return start, cursor - start
+    return 0, limit + 1
+
+
+def parse_callback(data):
+    """'pg:<feed>:<direction>:<cursor>' -> (feed, direction, cursor)"""
+    _, feed, direction, cursor = data.split(':')
+    return feed, direction, int(cursor)
+
+
+def build_page(rows, render_item, prefix, direction=None, limit=PAGE_SIZE, header="", footer="", item_buttons=None):
+    """متن و کیبورد یک صفحه
+
+    rows باید به ترتیب نمایش و تا limit + 1 ردیف باشد؛ ردیف اضافه فقط نشان
+    می‌دهد که در آن جهت صفحه‌ی دیگری هم هست. اگر متن صفحه از حد پیام تلگرام
+    بیشتر شود، آیتم‌های دورتر از cursor به صفحه‌ی بعدی منتقل می‌شوند.
+    item_buttons (اختیاری) برای هر آیتم نمایش‌داده‌شده یک ردیف دکمه (یا ردیف خالی) می‌سازد.
+    """
+    items = list(rows)
+    if direction == 'b':
+        has_prev, has_next = len(items) > limit, True
+        items = items[-limit:]
+    else:
+        has_prev, has_next = direction == 'f', len(items) > limit
+        items = items[:limit]
+
+    budget = MAX_MESSAGE_LENGTH - len(header) - len(footer)
+    texts = [truncate(render_item(item)) for item in items]
+    order = range(len(items) - 1, -1, -1) if direction == 'b' else range(len(items))
+    kept = []
+    for i in order:
+        if len(texts[i]) > budget and kept:
+            if direction == 'b':
+                has_prev = True
+            else:
+                has_next = True
+            break
+        budget -= len(texts[i])
+        kept.append(i)
+    kept.sort()
+
+    text = header + "".join(texts[i] for i in kept) + footer
+    keyboard_rows = [row for row in (item_buttons(items[i]) for i in kept) if row] if item_buttons else []
+    buttons = []
+    if has_prev:
+        buttons.append(InlineKeyboardButton(text="◀️ قبلی", callback_data=f"{prefix}:b:{items[kept[0]]['id']}"))
+    if has_next:
+        buttons.append(InlineKeyboardButton(text="بعدی ▶️", callback_data=f"{prefix}:f:{items[kept[-1]]['id']}"))
+    if buttons:
+        keyboard_rows.append(buttons)
+    keyboard = InlineKeyboardMarkup(inline_keyboard=keyboard_rows) if keyboard_rows else None
+    return text, keyboard
@@ -0,0 +1,65 @@
+"""انتقال دوره‌ای گزارش‌های قدیمی به آرشیو فشرده
+
+گزارش‌های قدیمی‌تر از REPORT_RETENTION_DAYS از جدول reports به reports_archive
+منتقل می‌شوند تا جدول و ایندکس‌های فیدها کوچک بمانند. انتقال در دسته‌های
+کوچک، هر دسته در یک تراکنش کوتاه روی ترد دیتابیس انجام می‌شود و بین دسته‌ها
+مکث کوتاهی هست تا نوشتن‌های کاربران پشت قفل نمانند.
+
+report_stats دست نمی‌خورد، پس /stats و جدول‌های امتیاز همان قبلی‌اند. گزارش
+آرشیوشده در فیدها و /search نیست و مدیر اصلی آن را با /archive می‌بیند.
+"""
+import asyncio
+import logging
+
+import metrics
+import timeutil
+from async_database import archive_reports, get_tenant_ids
+from config import REPORT_RETENTION_DAYS
+
+BATCH_SIZE = 500
+# مکث بین دو دسته و فاصله‌ی دو دور کامل (ثانیه)
+BATCH_PAUSE = 0.2
+INTERVAL = 3600
+
+
+class ReportArchiver:
+    def __init__(self, retention_days=REPORT_RETENTION_DAYS, batch_size=BATCH_SIZE):
+        self.retention_days = retention_days
+        self.batch_size = batch_size
+        self._runner = None
+
+    async def archive_once(self):
+        """یک دور کامل: همه‌ی گزارش‌های قدیمی‌تر از افق، سازمان به سازمان و دسته به دسته؛ تعداد منتقل‌شده را برمی‌گرداند"""
+        before = timeutil.day_start(timeutil.now()) - self.retention_days * timeutil.DAY
+        total = 0
+        for tenant_id in await get_tenant_ids():
+            while True:
+                moved = await archive_reports(tenant_id, before, self.batch_size)
+                total += moved
+                metrics.reports_archived.inc(amount=moved)
+                if moved < self.batch_size:
+                    break
+                await asyncio.sleep(BATCH_PAUSE)
+        return total
+
+    def start(self):
+        if self.retention_days > 0:
+            self._runner = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._runner:
+            self._runner.cancel()
+            try:
+                await self._runner
+            except asyncio.CancelledError:
+                pass
+
+    async def _run(self):
+        while True:
+            try:
+                moved = await self.archive_once()
+                if moved:
+                    logging.info("report archiver: %d reports archived", moved)
+            except Exception:
+                logging.exception("report archiving failed")
+            await asyncio.sleep(INTERVAL)
@@ -0,0 +1,141 @@
+"""زمان‌بند یادآوری تسک‌ها
+
+زمان یادآوری بعدی هر تسک فعال در یک heap نگه داشته می‌شود؛ حلقه فقط تا
+سررسید نزدیک‌ترین یادآوری می‌خوابد و برای هر یادآوری O(log n) کار می‌کند.
+جدول tasks فقط یک بار هنگام شروع خوانده می‌شود و بعد از آن با schedule و
+discard به‌روز می‌شود.
+"""
+import asyncio
+import heapq
+import logging
+import time
+
+import timeutil
+from async_database import get_all_active_tasks, get_active_task, set_task_reminded
+from outbox import bulk
+
+# یادآوری روز ددلاین در این ساعت ارسال می‌شود
+DEADLINE_REMINDER_HOUR = 9
+
+# ثانیه
+INTERVALS = {
+    'hour': 3600,
+    'day': timeutil.DAY,
+}
+
+
+def next_fire_time(task):
+    """زمان یادآوری بعدی یک تسک (epoch) یا None اگر یادآوری دیگری ندارد
+
+    یادآوری‌های دوره‌ای از آخرین یادآوری (یا زمان ساخت تسک) حساب می‌شوند؛
+    اگر زمان حاصل گذشته باشد یعنی یادآوری در زمان خاموش بودن ربات از دست
+    رفته و باید بلافاصله (فقط یک بار) ارسال شود.
+    """
+    last = task['last_reminded_at']
+    candidates = []
+    unit = INTERVALS.get(task['reminder_type'])
+    if unit and task['reminder_value']:
+        base = last or task['created_at']
+        if base:
+            candidates.append(base + unit * task['reminder_value'])
+    if task['deadline'] is not None:
+        deadline_at = timeutil.at_hour(task['deadline'], DEADLINE_REMINDER_HOUR)
+        if last is None or last < deadline_at:
+            candidates.append(deadline_at)
+    return min(candidates) if candidates else None
+
+
+def reminder_text(task, now):
+    deadline = task['deadline']
+    today = timeutil.day_start(now)
+    if deadline is not None and deadline < today:
+        status = "⚠️ مهلت این تسک گذشته است!"
+    elif deadline == today:
+        status = "📅 امروز روز ددلاین است."
+    else:
+        status = ""
+    return (
+        "⏰ یادآوری تسک\n\n"
+        f"📌 {task['title']}\n"
+        f"⏰ مهلت: {timeutil.jalali_date(deadline)}\n"
+        f"{status}"
+    ).strip()
+
+
+class ReminderScheduler:
+    def __init__(self, bot):
+        self.bot = bot
+        self._heap = []
+        # task_id -> زمان معتبر فعلی؛ ورودی‌های heap که با این یکی نخوانند کهنه‌اند
+        self._next = {}
+        self._wakeup = asyncio.Event()
+        self._runner = None
+
+    def __len__(self):
+        return len(self._next)
+
+    async def load(self):
+        """خواندن همه‌ی تسک‌های فعال هنگام شروع ربات"""
+        for task in await get_all_active_tasks():
+            self.schedule(task)
+        logging.info("reminder scheduler: %d active tasks scheduled", len(self._next))
+
+    def schedule(self, task):
+        """(باز)زمان‌بندی یک تسک؛ task باید ستون‌های جدول tasks را داشته باشد"""
+        fire_at = next_fire_time(task)
+        if fire_at is None:
+            self.discard(task['id'])
+            return
+        self._next[task['id']] = fire_at
+        heapq.heappush(self._heap, (fire_at, task['id']))
+        if self._heap[0][1] == task['id']:
+            self._wakeup.set()
+
+    def discard(self, task_id):
+        """حذف تسک (مثلاً انجام شده)؛ ورودی heap به صورت تنبل نادیده گرفته می‌شود"""
+        self._next.pop(task_id, None)
+
+    def start(self):
+        self._runner = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._runner:
+            self._runner.cancel()
+            try:
+                await self._runner
+            except asyncio.CancelledError:
+                pass
+
+    async def _run(self):
+        while True:
+            now = time.time()
+            while self._heap and self._heap[0][0] <= now:
+                when, task_id = heapq.heappop(self._heap)
+                if self._next.get(task_id) != when:
+                    continue
+                del self._next[task_id]
+                try:
+                    await self._fire(task_id)
+                except Exception:
+                    logging.exception("reminder for task %s failed", task_id)
+            timeout = max(self._heap[0][0] - time.time(), 0) if self._heap else None
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _fire(self, task_id):
+        task = await get_active_task(task_id)
+        if task is None:
+            # تسک در این فاصله انجام یا حذف شده است
+            return
+        now = timeutil.now()
+        try:
+            # کاربری که فقط با یوزرنیم ثبت شده و هنوز ربات را استارت نکرده قابل پیام دادن نیست
+            if task['user_telegram_id']:
+                with bulk():
+                    await self.bot.send_message(task['user_telegram_id'], reminder_text(task, now))
+        finally:
+            await set_task_reminded(task_id, now)
+            self.schedule({**dict(task), 'last_reminded_at': now})
@@ -0,0 +1,323 @@
+"""اجرای ربات در چند پروسه (WORKERS > 1)
+
+پروسه‌ی اصلی (supervisor) هیچ هندلری اجرا نمی‌کند؛ فقط آپدیت‌ها را می‌گیرد
+(polling یا webhook) و هر آپدیت را بر اساس شناسه‌ی کاربر (user_id % WORKERS)
+به یکی از پروسه‌های worker می‌دهد. همه‌ی آپدیت‌های یک کاربر به یک پروسه
+می‌رسند، پس کش FSM و کش کاربر او همیشه در همان پروسه است، و کار سنگین یک
+کاربر (رندر فهرست‌های طولانی، خروجی فایل و ...) فقط کاربران همان worker را
+معطل می‌کند. همه‌ی workerها همان فایل SQLite را در حالت WAL باز می‌کنند.
+
+- کارهای پس‌زمینه (زمان‌بند یادآوری، آرشیو، اعلان‌ها) فقط در worker صفر اجرا
+  می‌شوند؛ در workerهای دیگر dp["scheduler"] و dp["notifier"] نماینده‌ای‌اند که
+  فراخوانی‌ها را از طریق supervisor به worker صفر می‌فرستد.
+- باطل شدن کش کاربران در یک worker به بقیه پخش می‌شود.
+- سقف سراسری ارسال پیام بین workerها تقسیم می‌شود.
+- worker مرده با تأخیر فزاینده دوباره بالا می‌آید؛ آپدیت‌هایی که در صف آن
+  مانده بودند از دست می‌روند (صف قفل‌شده‌ی یک پروسه‌ی kill‌شده قابل اعتماد نیست).
+- هر worker هر METRICS_INTERVAL ثانیه متریک‌هایش را می‌فرستد و supervisor همه را
+  با برچسب worker روی METRICS_PATH نشان می‌دهد (در حالت polling هم). دستور
+  /metrics در تلگرام فقط متریک‌های worker همان کاربر را نشان می‌دهد.
+"""
+import asyncio
+import logging
+import multiprocessing
+import queue
+import signal
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from aiogram import Bot
+from aiohttp import web
+
+import metrics
+from async_database import add_invalidation_listener, apply_invalidation, close as close_db, init_db
+from config import BOT_MODE, BOT_TOKEN, MAX_CONCURRENT_UPDATES, METRICS_PATH, WEBHOOK_PATH, WEBHOOK_SECRET
+from Dozio import create_dispatcher, setup_bot, shutdown, start_background
+from outbox import GLOBAL_RATE
+from webhook import metrics_handler, serve, set_webhook
+
+POLL_TIMEOUT = 30
+METRICS_INTERVAL = 5
+# تأخیر ری‌استارت worker: 1، 2، 4، ... ثانیه؛ اگر worker بیش از STABLE_AFTER ثانیه
+# سالم مانده بود از صفر شروع می‌شود
+RESTART_BACKOFF_MAX = 60
+STABLE_AFTER = 60
+STOP_TIMEOUT = 10
+
+
+def update_user_id(update):
+    """شناسه‌ی کاربر (یا چت) یک آپدیت خام برای انتخاب worker"""
+    for key, event in update.items():
+        if not isinstance(event, dict):
+            continue
+        user = event.get('from') or event.get('user')
+        if user:
+            return user['id']
+        chat = event.get('chat')
+        if chat:
+            return chat['id']
+    return update.get('update_id', 0)
+
+
+def shard_of(update, count):
+    return update_user_id(update) % count
+
+
+# --- worker
+
+class _Remote:
+    """نماینده‌ی scheduler یا notifier در workerهای غیر صفر
+
+    هر فراخوانی متد (مثل scheduler.schedule(task)) به صورت پیام به worker صفر
+    فرستاده می‌شود؛ متدهای این سرویس‌ها خروجی ندارند و منتظر نمی‌مانند.
+    """
+
+    def __init__(self, events, service):
+        self._events = events
+        self._service = service
+
+    def __getattr__(self, method):
+        def call(*args):
+            args = tuple(dict(a) if isinstance(a, sqlite3.Row) else a for a in args)
+            self._events.put(('call', self._service, method, args))
+        return call
+
+    def __len__(self):
+        return 0
+
+
+def _worker(index, count, inbox, events):
+    """نقطه‌ی شروع پروسه‌ی worker؛ Ctrl+C فقط به supervisor مربوط است"""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    logging.basicConfig(level=logging.INFO, format=f"worker-{index} %(levelname)s:%(name)s:%(message)s", force=True)
+    asyncio.run(_worker_main(index, count, inbox, events))
+
+
+async def _worker_main(index, count, inbox, events):
+    await init_db()
+    bot, dp, outbox = setup_bot(global_rate=GLOBAL_RATE / count)
+    if index == 0:
+        services = await start_background(dp)
+    else:
+        services = []
+        dp["scheduler"] = _Remote(events, 'scheduler')
+        dp["notifier"] = _Remote(events, 'notifier')
+    add_invalidation_listener(
+        lambda telegram_id, username, everything=False: events.put(('invalidate', telegram_id, username, everything))
+    )
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_UPDATES)
+    running = set()
+    # آخرین آپدیت در حال اجرای هر کاربر؛ آپدیت‌های یک کاربر به ترتیب اجرا می‌شوند
+    # (وقتی worker عقب می‌افتد صف او چند پیام پشت سر هم دارد که به استیت FSM هم وابسته‌اند)
+    tails = {}
+
+    async def feed(data, previous):
+        if previous is not None:
+            await asyncio.wait([previous])
+        async with semaphore:
+            try:
+                await dp.feed_raw_update(bot, data)
+            except Exception:
+                logging.exception("update %s failed", data.get('update_id'))
+
+    async def report_metrics():
+        while True:
+            events.put(('metrics', metrics.snapshot()))
+            await asyncio.sleep(METRICS_INTERVAL)
+
+    reporter = asyncio.create_task(report_metrics())
+    loop = asyncio.get_running_loop()
+    parent = multiprocessing.parent_process()
+    logging.info("worker %d of %d started", index, count)
+    try:
+        while True:
+            try:
+                message = await loop.run_in_executor(None, inbox.get, True, 1)
+            except queue.Empty:
+                if not parent.is_alive():
+                    logging.warning("supervisor is gone, stopping")
+                    break
+                continue
+            if message is None:
+                break
+            kind = message[0]
+            if kind == 'update':
+                user_id = update_user_id(message[1])
+                task = asyncio.create_task(feed(message[1], tails.get(user_id)))
+                tails[user_id] = task
+                running.add(task)
+                task.add_done_callback(running.discard)
+                task.add_done_callback(lambda t, user_id=user_id: tails.pop(user_id) if tails.get(user_id) is t else None)
+            elif kind == 'call':
+                _, service, method, args = message
+                getattr(dp[service], method)(*args)
+            elif kind == 'invalidate':
+                apply_invalidation(*message[1:])
+    finally:
+        reporter.cancel()
+        if running:
+            await asyncio.gather(*running, return_exceptions=True)
+        await shutdown(dp, outbox, services)
+        await bot.session.close()
+
+
+# --- supervisor
+
+class _Worker:
+    def __init__(self, index, ctx):
+        self.index = index
+        self.ctx = ctx
+        self.process = None
+        self.started_at = 0.0
+        self.failures = 0
+        self.restart_at = None
+        self.new_queues()
+
+    def new_queues(self):
+        # صف‌های یک پروسه‌ی مرده ممکن است قفل‌شده مانده باشند؛ هر بار صف تازه
+        self.inbox = self.ctx.Queue()
+        self.events = self.ctx.Queue()
+
+    def start(self, count):
+        self.process = self.ctx.Process(
+            target=_worker, args=(self.index, count, self.inbox, self.events), name=f"dozio-worker-{self.index}",
+        )
+        self.process.start()
+        self.started_at = time.monotonic()
+        self.restart_at = None
+
+
+class Supervisor:
+    def __init__(self, count):
+        ctx = multiprocessing.get_context('spawn')
+        self.workers = [_Worker(i, ctx) for i in range(count)]
+        self.snapshots = {}
+        self.restarts = 0
+        # خواندن صف‌های رویداد workerها (get مسدودکننده است)
+        self._readers = ThreadPoolExecutor(max_workers=count, thread_name_prefix="events")
+
+    def route(self, data):
+        self.workers[shard_of(data, len(self.workers))].inbox.put(('update', data))
+
+    def _broadcast(self, message, skip=None):
+        for worker in self.workers:
+            if worker is not skip:
+                worker.inbox.put(message)
+
+    async def _read_events(self, worker):
+        loop = asyncio.get_running_loop()
+        while True:
+            events = worker.events
+            try:
+                message = await loop.run_in_executor(self._readers, events.get, True, 1)
+            except queue.Empty:
+                continue
+            kind = message[0]
+            if kind == 'metrics':
+                self.snapshots[worker.index] = message[1]
+            elif kind == 'call':
+                self.workers[0].inbox.put(message)
+            elif kind == 'invalidate':
+                self._broadcast(message, skip=worker)
+
+    async def _monitor(self):
+        count = len(self.workers)
+        while True:
+            await asyncio.sleep(1)
+            now = time.monotonic()
+            for worker in self.workers:
+                if worker.restart_at is not None:
+                    if now >= worker.restart_at:
+                        worker.start(count)
+                        self.restarts += 1
+                    continue
+                if worker.process.is_alive():
+                    continue
+                worker.failures = 0 if now - worker.started_at > STABLE_AFTER else worker.failures + 1
+                delay = min(2 ** worker.failures, RESTART_BACKOFF_MAX) if worker.failures else 0
+                logging.error("worker %d exited with code %s, restarting in %ds",
+                              worker.index, worker.process.exitcode, delay)
+                self.snapshots.pop(worker.index, None)
+                worker.new_queues()
+                worker.restart_at = now + delay
+
+    async def _poll(self, bot, allowed_updates):
+        offset = None
+        backoff = 1
+        while True:
+            try:
+                updates = await bot.get_updates(offset=offset, timeout=POLL_TIMEOUT, allowed_updates=allowed_updates)
+            except Exception:
+                logging.exception("getUpdates failed, retrying in %ds", backoff)
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, 30)
+                continue
+            backoff = 1
+            for update in updates:
+                self.route(update.model_dump(mode='json', by_alias=True, exclude_none=True))
+                offset = update.update_id + 1
+
+    async def _webhook_handler(self, request):
+        if WEBHOOK_SECRET and request.headers.get('X-Telegram-Bot-Api-Secret-Token') != WEBHOOK_SECRET:
+            raise web.HTTPUnauthorized()
+        self.route(await request.json())
+        return web.Response()
+
+    def _app(self):
+        app = web.Application()
+        if METRICS_PATH:
+            app.router.add_get(METRICS_PATH, metrics_handler(lambda: metrics.render_prometheus(self.snapshots)))
+        if BOT_MODE == 'webhook':
+            app.router.add_post(WEBHOOK_PATH, self._webhook_handler)
+        return app
+
+    async def run(self):
+        # مهاجرت‌ها یک بار اینجا، پیش از بالا آمدن workerها
+        await init_db()
+        await close_db()
+        count = len(self.workers)
+        metrics.register_gauge("bot_workers_alive", "Worker processes running",
+                               lambda: sum(w.process is not None and w.process.is_alive() for w in self.workers))
+        metrics.register_gauge("bot_worker_restarts", "Worker restarts since start", lambda: self.restarts)
+        for worker in self.workers:
+            worker.start(count)
+        logging.info("supervisor: %d workers started (%s mode)", count, BOT_MODE)
+        bot = Bot(token=BOT_TOKEN)
+        allowed_updates = create_dispatcher(bot).resolve_used_update_types()
+        tasks = [asyncio.create_task(self._monitor())]
+        tasks += [asyncio.create_task(self._read_events(w)) for w in self.workers]
+        loop = asyncio.get_running_loop()
+        loop.add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+        try:
+            if BOT_MODE == 'webhook':
+                await set_webhook(bot, allowed_updates)
+                await serve(self._app())
+            else:
+                if METRICS_PATH:
+                    tasks.append(asyncio.create_task(serve(self._app())))
+                await self._poll(bot, allowed_updates)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await self.stop()
+            await bot.session.close()
+
+    async def stop(self):
+        self._broadcast(None)
+        loop = asyncio.get_running_loop()
+        for worker in self.workers:
+            if worker.process is None:
+                continue
+            await loop.run_in_executor(None, worker.process.join, STOP_TIMEOUT)
+            if worker.process.is_alive():
+                logging.warning("worker %d did not stop in time, terminating", worker.index)
+                worker.process.terminate()
+        self._readers.shutdown(wait=False, cancel_futures=True)
+
+
+def main(count):
+    try:
+        asyncio.run(Supervisor(count).run())
+    except KeyboardInterrupt:
+        pass
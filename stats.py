@@ -0,0 +1,75 @@
+"""نمایش آمار گزارش‌ها و جدول‌های امتیاز
+
+آمار و جدول‌ها از جدول تجمیعی report_stats خوانده می‌شوند که create_report و
+rate_report در همان تراکنش نوشتن گزارش به‌روزش می‌کنند (برای ماه، هفته و کل
+دوره)؛ پس هزینه‌ی /stats به تعداد گزارش‌ها بستگی ندارد.
+"""
+import timeutil
+from async_database import get_stats, get_period_stats, get_leaderboard
+from database import stats_period
+
+LEADERBOARD_SIZE = 10
+TREND_MONTHS = 6
+
+
+def current_period():
+    return stats_period(timeutil.now())
+
+
+def _avg(row):
+    return row['score_sum'] / row['scored'] if row and row['scored'] else None
+
+
+def format_summary(title, row):
+    if not row or not row['reports']:
+        return f"{title}: گزارشی ثبت نشده"
+    avg = _avg(row)
+    avg_text = f"{avg:.2f}" if avg is not None else "ندارد"
+    return f"{title}: {row['reports']} گزارش، {row['scored']} امتیازدار، میانگین {avg_text}"
+
+
+def format_trend(months):
+    lines = []
+    for row in months[:TREND_MONTHS]:
+        avg = _avg(row)
+        lines.append(f"    {row['period']}: {row['reports']} گزارش" + (f"، میانگین {avg:.2f}" if avg is not None else ""))
+    return "\n".join(lines)
+
+
+def format_leaderboard(title, rows, by):
+    if not rows:
+        return f"{title}\n    موردی نیست"
+    lines = [title]
+    for rank, row in enumerate(rows, 1):
+        value = f"{row['avg_score']:.2f} ⭐ ({row['scored']})" if by == 'avg' else f"{row['reports']} گزارش"
+        lines.append(f"    {rank}. {row['name']} — {value}")
+    return "\n".join(lines)
+
+
+async def stats_text(user, period=None):
+    """متن /stats: آمار خود کاربر، و برای مدیران آمار تیم و جدول‌های امتیاز"""
+    period = period or current_period()
+    period_title = "کل دوره" if period == 'all' else period
+    parts = []
+    if user['role'] != 'admin':
+        total, months = await get_stats('user', user['id'], limit=TREND_MONTHS)
+        parts.append(format_summary("📊 گزارش‌های شما (کل)", total))
+        if months:
+            parts.append(format_trend(months))
+    if user['role'] in ('admin', 'manager'):
+        total, months = await get_stats('team', user['id'], limit=TREND_MONTHS)
+        parts.append(format_summary("👥 گزارش‌های تیم (کل)", total))
+        week = await get_period_stats('team', user['id'], timeutil.week_key(timeutil.now()))
+        parts.append(f"🗓 گزارش‌های تیم از شنبه: {week['reports'] if week else 0}")
+        if months:
+            parts.append(format_trend(months))
+        # مدیر اصلی همه‌ی کاربران سازمانش را می‌بیند، حتی آن‌هایی که هنوز سرپرست ندارند
+        under = None if user['role'] == 'admin' else user['id']
+        best = await get_leaderboard('user', period, under, by='avg', limit=LEADERBOARD_SIZE, tenant_id=user['tenant_id'])
+        active = await get_leaderboard('user', period, under, by='reports', limit=LEADERBOARD_SIZE, tenant_id=user['tenant_id'])
+        parts.append(format_leaderboard(f"🏆 بهترین میانگین امتیاز ({period_title}):", best, 'avg'))
+        parts.append(format_leaderboard(f"📈 بیشترین گزارش ({period_title}):", active, 'reports'))
+        if user['role'] == 'admin':
+            teams = await get_leaderboard('team', period, user['id'], by='avg', limit=LEADERBOARD_SIZE, tenant_id=user['tenant_id'])
+            parts.append(format_leaderboard(f"🏅 تیم‌ها بر اساس میانگین امتیاز ({period_title}):", teams, 'avg'))
+    return "\n\n".join(parts)
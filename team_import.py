@@ -0,0 +1,248 @@
+"""ورود گروهی اعضا از فایل CSV
+
+فایل ردیف‌به‌ردیف خوانده و بررسی می‌شود؛ ردیف‌های معتبر در یک تراکنش با
+executemany ثبت می‌شوند (database.import_users) و ردیف‌های رد شده با دلیلشان
+گزارش می‌شوند. خروجی «CSV UTF-8» اکسل و فایل‌های جداشده با ; یا tab هم
+پذیرفته می‌شوند.
+
+ستون‌ها (سطر اول؛ نام فارسی یا انگلیسی):
+    telegram_id/آیدی, username/یوزرنیم, name/نام, position/سمت,
+    role/نقش, supervisor/سرپرست
+حداقل یکی از آیدی و یوزرنیم و همچنین نام لازم است. سرپرست با آیدی عددی یا
+@یوزرنیم مشخص می‌شود و می‌تواند یکی از ردیف‌های همین فایل باشد؛ اگر خالی
+باشد سرپرست کسی است که فایل را فرستاده.
+"""
+import csv
+import io
+import re
+
+from async_database import get_users_by_keys, get_subtree
+
+MAX_IMPORT_BYTES = 2 * 1024 * 1024
+MAX_IMPORT_ROWS = 5000
+
+COLUMNS = {
+    'telegram_id': 'telegram_id', 'id': 'telegram_id', 'آیدی': 'telegram_id', 'ایدی': 'telegram_id',
+    'username': 'username', 'یوزرنیم': 'username', 'نام کاربری': 'username',
+    'name': 'name', 'نام': 'name',
+    'position': 'position', 'سمت': 'position',
+    'role': 'role', 'نقش': 'role',
+    'supervisor': 'supervisor', 'سرپرست': 'supervisor',
+}
+ROLES = {
+    '': 'member', 'member': 'member', 'عضو': 'member', 'کاربر': 'member',
+    'manager': 'manager', 'مدیر': 'manager', 'مدیر میانی': 'manager',
+}
+USERNAME_RE = re.compile(r'^[A-Za-z0-9_]{4,32}$')
+
+
+class ImportFileError(ValueError):
+    """فایل قابل خواندن نیست (نه یک ردیف خاص)"""
+
+
+def _key(telegram_id, username):
+    return ('id', telegram_id) if telegram_id is not None else ('u', username)
+
+
+def _parse_ref(value):
+    """'@user' یا '123' -> (telegram_id, username)"""
+    value = value.strip()
+    if not value:
+        return None
+    if value.isdigit():
+        return int(value), None
+    username = value.lstrip('@')
+    if not USERNAME_RE.match(username):
+        raise ValueError(f"سرپرست نامعتبر: {value}")
+    return None, username
+
+
+def read_rows(stream):
+    """خواندن جریانی فایل؛ خروجی (rows, errors) که errors فهرست (شماره‌ی سطر، دلیل) است"""
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', errors='replace', newline='')
+    sample = text.read(4096)
+    text.seek(0)
+    try:
+        dialect = csv.Sniffer().sniff(sample, delimiters=',;\t')
+    except csv.Error:
+        dialect = csv.excel
+    reader = csv.reader(text, dialect)
+    header = next(reader, None)
+    if not header:
+        raise ImportFileError("فایل خالی است.")
+    columns = [COLUMNS.get(h.strip()) for h in header]
+    if 'name' not in columns or not {'telegram_id', 'username'} & set(columns):
+        raise ImportFileError("سطر اول باید ستون نام و یکی از ستون‌های آیدی یا یوزرنیم را داشته باشد.")
+
+    rows, errors, seen = [], [], set()
+    for line, values in enumerate(reader, start=2):
+        if not any(v.strip() for v in values):
+            continue
+        if len(rows) + len(errors) >= MAX_IMPORT_ROWS:
+            errors.append((line, f"حداکثر {MAX_IMPORT_ROWS} ردیف؛ بقیه‌ی فایل خوانده نشد"))
+            break
+        record = {col: v.strip() for col, v in zip(columns, values) if col}
+        try:
+            telegram_id = record.get('telegram_id') or None
+            if telegram_id is not None:
+                if not telegram_id.isdigit():
+                    raise ValueError(f"آیدی عددی نامعتبر: {telegram_id}")
+                telegram_id = int(telegram_id)
+            username = record.get('username', '').lstrip('@') or None
+            if username and not USERNAME_RE.match(username):
+                raise ValueError(f"یوزرنیم نامعتبر: {username}")
+            if telegram_id is None and username is None:
+                raise ValueError("آیدی یا یوزرنیم لازم است")
+            if not record.get('name'):
+                raise ValueError("نام خالی است")
+            role = ROLES.get(record.get('role', '').lower())
+            if role is None:
+                raise ValueError(f"نقش نامعتبر: {record['role']}")
+            supervisor = _parse_ref(record.get('supervisor', ''))
+        except ValueError as e:
+            errors.append((line, str(e)))
+            continue
+        key = _key(telegram_id, username)
+        if key in seen or (username and ('u', username) in seen):
+            errors.append((line, "ردیف تکراری"))
+            continue
+        seen.add(key)
+        if username:
+            seen.add(('u', username))
+        rows.append({
+            'line': line, 'telegram_id': telegram_id, 'username': username,
+            'name': record['name'], 'position': record.get('position') or None,
+            'role': role, 'supervisor': supervisor,
+        })
+    return rows, errors
+
+
+async def validate(rows, importer):
+    """بررسی دسترسی و سرپرست‌ها؛ خروجی (levels, errors, updated)
+
+    levels دسته‌های ردیف به ترتیبی است که باید ثبت شوند (سرپرست هر ردیف در
+    دسته‌های قبلی یا در دیتابیس است). مدیر میانی فقط می‌تواند «عضو» در
+    زیرمجموعه‌ی خودش اضافه یا ویرایش کند.
+    """
+    errors = []
+    found = await get_users_by_keys(
+        [r['telegram_id'] for r in rows if r['telegram_id'] is not None] +
+        [r['supervisor'][0] for r in rows if r['supervisor'] and r['supervisor'][0] is not None],
+        [r['username'] for r in rows if r['username']] +
+        [r['supervisor'][1] for r in rows if r['supervisor'] and r['supervisor'][1]],
+    )
+    # فقط کاربران سازمان خود واردکننده؛ حساب ثبت‌شده در سازمان دیگر قابل ورود نیست
+    existing = [u for u in found if u['tenant_id'] == importer['tenant_id']]
+    foreign_ids = {u['telegram_id'] for u in found if u['tenant_id'] != importer['tenant_id'] and u['telegram_id'] is not None}
+    foreign_usernames = {u['username'] for u in found
+                         if u['tenant_id'] != importer['tenant_id'] and u['telegram_id'] is not None and u['username']}
+    by_id = {u['telegram_id']: u for u in existing if u['telegram_id'] is not None}
+    by_username = {u['username']: u for u in existing if u['username']}
+    allowed = None
+    if importer['role'] != 'admin':
+        allowed = {u['id'] for u in await get_subtree(importer['id'])}
+
+    def lookup(telegram_id, username):
+        if telegram_id is not None and telegram_id in by_id:
+            return by_id[telegram_id]
+        return by_username.get(username) if username else None
+
+    # مرحله‌ی اول: خود ردیف؛ مرحله‌ی دوم: سرپرست، که فقط می‌تواند ردیف معتبر همین فایل
+    # یا کاربری موجود (و برای مدیر میانی، در تیم خودش) باشد
+    candidates = []
+    for row in rows:
+        current = lookup(row['telegram_id'], row['username'])
+        reason = None
+        if row['telegram_id'] in foreign_ids or (current is None and row['username'] in foreign_usernames):
+            reason = "این کاربر عضو سازمان دیگری است"
+        elif current and row['telegram_id'] is not None and current['telegram_id'] not in (None, row['telegram_id']):
+            reason = "این یوزرنیم متعلق به کاربر دیگری است"
+        elif current and current['id'] == importer['id']:
+            reason = "ویرایش خودتان از این راه ممکن نیست"
+        elif current and current['role'] == 'admin':
+            reason = "مدیر اصلی قابل ویرایش نیست"
+        elif allowed is not None and row['role'] != 'member':
+            reason = "مدیر میانی فقط می‌تواند عضو اضافه کند"
+        elif allowed is not None and current and current['id'] not in allowed:
+            reason = "این کاربر در تیم شما نیست"
+        if reason:
+            errors.append((row['line'], reason))
+            continue
+        row['exists'] = current is not None
+        candidates.append(row)
+
+    in_file = {}
+    for row in candidates:
+        in_file[_key(row['telegram_id'], row['username'])] = row
+        if row['username']:
+            in_file[('u', row['username'])] = row
+
+    valid, updated = [], 0
+    for row in candidates:
+        sup = row['supervisor']
+        reason = None
+        if sup and in_file.get(_key(*sup)) is row:
+            reason = "کاربر نمی‌تواند سرپرست خودش باشد"
+        elif sup and _key(*sup) not in in_file:
+            target = lookup(*sup)
+            if target is None:
+                reason = "سرپرست پیدا نشد"
+            elif allowed is not None and target['id'] not in allowed:
+                reason = "سرپرست در تیم شما نیست"
+        if reason:
+            errors.append((row['line'], reason))
+            continue
+        updated += row['exists']
+        valid.append(row)
+
+    # دسته‌بندی لایه‌ای: ردیفی که سرپرستش در فایل است بعد از سرپرست ثبت می‌شود
+    remaining = {id(r): r for r in valid}
+    placed = set()
+    levels = []
+    while remaining:
+        level = []
+        for row in remaining.values():
+            sup = row['supervisor']
+            parent = in_file.get(_key(*sup)) if sup else None
+            if parent is None or id(parent) in placed:
+                level.append(row)
+        if not level:
+            break
+        for row in level:
+            del remaining[id(row)]
+        placed.update(id(r) for r in level)
+        levels.append(level)
+    for row in remaining.values():
+        # سرپرست رد شده یا ارجاع دوری در فایل
+        updated -= row['exists']
+        errors.append((row['line'], "سرپرست این ردیف ثبت نشد یا ارجاع دوری است"))
+    errors.sort()
+    return levels, errors, updated
+
+
+def to_params(levels, importer):
+    """پارامترهای database.import_users"""
+    return [
+        [{
+            'telegram_id': r['telegram_id'],
+            'username': r['username'],
+            'name': r['name'],
+            'position': r['position'],
+            'role': r['role'],
+            'sup_telegram_id': r['supervisor'][0] if r['supervisor'] else None,
+            'sup_username': r['supervisor'][1] if r['supervisor'] else None,
+            'default_supervisor_id': importer['id'],
+            'tenant_id': importer['tenant_id'],
+        } for r in level]
+        for level in levels
+    ]
+
+
+def format_summary(imported, updated, errors, limit=30):
+    text = f"✅ {imported} ردیف ثبت شد ({imported - updated} جدید، {updated} به‌روزرسانی)."
+    if errors:
+        text += f"\n\n❌ {len(errors)} ردیف رد شد:\n"
+        text += "\n".join(f"سطر {line}: {reason}" for line, reason in errors[:limit])
+        if len(errors) > limit:
+            text += f"\n… و {len(errors) - limit} مورد دیگر"
+    return text
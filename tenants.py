@@ -0,0 +1,43 @@
+"""چند سازمان (tenant) در یک پروسه‌ی ربات
+
+هر کاربر دقیقاً عضو یک سازمان است و tenant_id او روی تسک‌ها و گزارش‌هایش هم
+نوشته می‌شود. نماهای «کل سازمان» مدیر اصلی (فید گزارش‌ها، درخت کاربران،
+جستجو، سررسیدها، آمار، خروجی و آرشیو) به سازمان خود او محدودند و با
+ایندکس‌هایی که با tenant_id شروع می‌شوند خوانده می‌شوند.
+
+عضو جدید با لینک دعوت وارد می‌شود: https://t.me/<bot>?start=inv_<token>. مدیر
+اصلی مدیر میانی دعوت می‌کند و مدیر میانی عضو تیم خودش را؛ نقش و سرپرست از
+روی دعوت تعیین می‌شود، نه از ورودی کاربر.
+"""
+import secrets
+
+import timeutil
+from async_database import create_invite
+
+INVITE_PREFIX = "inv_"
+INVITE_TTL_DAYS = 7
+# یک لینک برای کل یک تیم کوچک کافی باشد
+INVITE_USES = 50
+# نقش دعوت‌کننده -> نقش عضو جدید
+INVITE_ROLES = {'admin': 'manager', 'manager': 'member'}
+ROLE_TITLES = {'manager': "مدیر میانی", 'member': "عضو تیم"}
+
+
+async def new_invite(user, uses=INVITE_USES):
+    """ساخت دعوت برای زیرمجموعه‌ی مستقیم user؛ (token، نقش عضو جدید) را برمی‌گرداند"""
+    token = secrets.token_urlsafe(12)
+    now = timeutil.now()
+    role = INVITE_ROLES[user['role']]
+    await create_invite(token, user['tenant_id'], role, user['id'], now, now + INVITE_TTL_DAYS * timeutil.DAY, uses)
+    return token, role
+
+
+def invite_link(bot_username, token):
+    return f"https://t.me/{bot_username}?start={INVITE_PREFIX}{token}"
+
+
+def parse_invite(payload):
+    """آرگومان /start -> token دعوت، یا None اگر deep link دعوت نیست"""
+    if payload and payload.startswith(INVITE_PREFIX):
+        return payload[len(INVITE_PREFIX):]
+    return None
@@ -0,0 +1,38 @@
+"""یکسان‌سازی متن فارسی برای جستجوی تمام‌متن
+
+متن ذخیره‌شده در جدول‌های FTS و عبارت جستجو هر دو از همین تابع عبور می‌کنند
+تا «كتاب» و «کتاب»، یا «۱۴۰۴» و «1404»، یکی حساب شوند.
+"""
+import re
+
+_TRANSLATE = str.maketrans({
+    'ي': 'ی', 'ى': 'ی', 'ئ': 'ی',
+    'ك': 'ک',
+    'ة': 'ه', 'ۀ': 'ه',
+    'أ': 'ا', 'إ': 'ا', 'ٱ': 'ا',
+    'ؤ': 'و',
+    **{chr(0x06F0 + i): str(i) for i in range(10)},   # ارقام فارسی
+    **{chr(0x0660 + i): str(i) for i in range(10)},   # ارقام عربی
+})
+
+# اعراب و تطویل؛ توکنایزر unicode61 آن‌ها را جداکننده می‌داند و کلمه را می‌شکند
+_STRIP = re.compile('[\u064b-\u065f\u0670\u0640]')
+
+
+def normalize(text):
+    if not text:
+        return ''
+    return _STRIP.sub('', text.translate(_TRANSLATE))
+
+
+def fts_query(text):
+    """عبارت کاربر -> کوئری امن FTS5 با AND ضمنی بین کلمه‌ها
+
+    عملگرهای FTS5 در ورودی کاربر معنایی ندارند و هر کلمه داخل "" قرار می‌گیرد.
+    فقط کلمه‌ی آخر پیشوندی تطبیق داده می‌شود (کلمه‌ای که احتمالاً نیمه‌کاره
+    است)؛ پیشوند روی همه‌ی کلمه‌ها مجموعه‌ی نتایج و هزینه‌ی رتبه‌بندی را زیاد می‌کند.
+    """
+    words = ['"' + w.replace('"', '""') + '"' for w in normalize(text).split()]
+    if words:
+        words[-1] += '*'
+    return ' '.join(words)
@@ -0,0 +1,111 @@
+"""تبدیل زمان بین epoch (ذخیره در دیتابیس) و تاریخ شمسی (ورودی و نمایش)
+
+همه‌ی زمان‌ها در دیتابیس ثانیه‌های epoch (INTEGER) هستند تا مقایسه و کوئری
+بازه‌ای روی ایندکس انجام شود. تبدیل به شمسی و منطقه‌ی زمانی فقط در لبه‌ها
+(خواندن ورودی کاربر و ساختن متن پیام) انجام می‌شود.
+
+ددلاین یک «روز» است و به صورت epoch ساعت ۰۰:۰۰ همان روز ذخیره می‌شود.
+"""
+import time
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+
+import jdatetime
+
+from config import TIMEZONE
+
+TZ = ZoneInfo(TIMEZONE)
+
+JALALI_MONTHS = [
+    "فروردین", "اردیبهشت", "خرداد", "تیر", "مرداد", "شهریور",
+    "مهر", "آبان", "آذر", "دی", "بهمن", "اسفند",
+]
+DAY = 24 * 3600
+
+
+def now():
+    return int(time.time())
+
+
+def to_datetime(ts):
+    return datetime.fromtimestamp(ts, TZ)
+
+
+def to_epoch(dt):
+    """datetime بدون منطقه‌ی زمانی به وقت TZ تعبیر می‌شود"""
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=TZ)
+    return int(dt.timestamp())
+
+
+def iso_to_epoch(value):
+    """رشته‌ی ISO قدیمی (تاریخ یا تاریخ-زمان بدون منطقه‌ی زمانی) -> epoch؛ برای مهاجرت"""
+    if value is None or value == '':
+        return None
+    if isinstance(value, (int, float)):
+        return int(value)
+    try:
+        return to_epoch(datetime.fromisoformat(value))
+    except ValueError:
+        return None
+
+
+def day_start(ts):
+    """epoch ساعت ۰۰:۰۰ روزی که ts در آن است"""
+    return to_epoch(to_datetime(ts).replace(hour=0, minute=0, second=0, microsecond=0, tzinfo=None))
+
+
+def at_hour(day, hour):
+    """epoch ساعت hour در روزی که با day (epoch شروع روز) داده شده"""
+    return to_epoch(to_datetime(day).replace(hour=hour, tzinfo=None))
+
+
+def add_days(day, days):
+    return to_epoch(to_datetime(day).replace(tzinfo=None) + timedelta(days=days))
+
+
+def week_start(ts):
+    """شروع هفته‌ی شمسی (شنبه ۰۰:۰۰)"""
+    dt = to_datetime(day_start(ts))
+    return add_days(day_start(ts), -((dt.weekday() - 5) % 7))
+
+
+def month_key(ts):
+    """کلید ماه میلادی (YYYY-MM) به وقت محلی"""
+    return to_datetime(ts).strftime('%Y-%m')
+
+
+def week_key(ts):
+    """کلید هفته‌ی شمسی: W:YYYY-MM-DD تاریخ میلادی شنبه‌ی شروع هفته، به وقت محلی"""
+    return to_datetime(week_start(ts)).strftime('W:%Y-%m-%d')
+
+
+def parse_jalali_date(text):
+    """'26 خرداد 1404' -> epoch شروع آن روز؛ در صورت فرمت نادرست ValueError"""
+    parts = text.split()
+    if len(parts) != 3 or parts[1] not in JALALI_MONTHS:
+        raise ValueError(text)
+    jalali = jdatetime.date(int(parts[2]), JALALI_MONTHS.index(parts[1]) + 1, int(parts[0]))
+    return to_epoch(datetime.combine(jalali.togregorian(), datetime.min.time()))
+
+
+def parse_jalali_numeric(text):
+    """'1404/03/26' یا '1404-3-26' -> epoch شروع آن روز؛ در صورت فرمت نادرست ValueError"""
+    parts = text.replace('-', '/').split('/')
+    if len(parts) != 3 or not all(p.isdigit() for p in parts):
+        raise ValueError(text)
+    jalali = jdatetime.date(int(parts[0]), int(parts[1]), int(parts[2]))
+    return to_epoch(datetime.combine(jalali.togregorian(), datetime.min.time()))
+
+
+def jalali_date(ts):
+    if ts is None:
+        return "-"
+    d = jdatetime.date.fromgregorian(date=to_datetime(ts).date())
+    return f"{d.day} {JALALI_MONTHS[d.month - 1]} {d.year}"
+
+
+def jalali_datetime(ts):
+    if ts is None:
+        return "-"
+    return f"{jalali_date(ts)} {to_datetime(ts):%H:%M}"
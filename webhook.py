@@ -0,0 +1,75 @@
+"""اجرای ربات در حالت webhook روی سرور aiohttp
+
+برای تست محلی WEBHOOK_BASE_URL را خالی بگذارید و یک Update ضبط‌شده را POST کنید:
+
+    curl -X POST -H "Content-Type: application/json" \\
+         -H "X-Telegram-Bot-Api-Secret-Token: $WEBHOOK_SECRET" \\
+         -d @update.json http://localhost:8080/webhook
+
+متریک‌ها با فرمت Prometheus روی METRICS_PATH (پیش‌فرض /metrics) همین سرور هستند.
+"""
+import asyncio
+import logging
+
+from aiohttp import web
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+
+import metrics
+from config import (
+    WEBHOOK_BASE_URL, WEBHOOK_PATH, WEBHOOK_SECRET, WEBAPP_HOST, WEBAPP_PORT, METRICS_PATH, METRICS_TOKEN,
+)
+
+
+def metrics_handler(render=metrics.render_prometheus):
+    """هندلر METRICS_PATH؛ render متن Prometheus را می‌سازد (supervisor نسخه‌ی تجمیعی را می‌دهد)"""
+    async def handler(request):
+        if METRICS_TOKEN and request.headers.get('Authorization') != f"Bearer {METRICS_TOKEN}":
+            raise web.HTTPUnauthorized()
+        return web.Response(text=render(), content_type='text/plain', charset='utf-8')
+    return handler
+
+
+def create_app(dp, bot):
+    app = web.Application()
+    if METRICS_PATH:
+        app.router.add_get(METRICS_PATH, metrics_handler())
+    SimpleRequestHandler(
+        dispatcher=dp,
+        bot=bot,
+        handle_in_background=True,
+        secret_token=WEBHOOK_SECRET or None,
+    ).register(app, path=WEBHOOK_PATH)
+    setup_application(app, dp, bot=bot)
+    return app
+
+
+async def set_webhook(bot, allowed_updates):
+    """ثبت آدرس webhook در تلگرام؛ اگر WEBHOOK_BASE_URL خالی باشد کاری نمی‌کند"""
+    if WEBHOOK_BASE_URL:
+        await bot.set_webhook(
+            WEBHOOK_BASE_URL.rstrip('/') + WEBHOOK_PATH,
+            secret_token=WEBHOOK_SECRET or None,
+            allowed_updates=allowed_updates,
+        )
+
+
+async def serve(app):
+    """اجرای app روی WEBAPP_HOST:WEBAPP_PORT تا لغو شدن (Ctrl+C)"""
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, WEBAPP_HOST, WEBAPP_PORT).start()
+    logging.info("http server listening on %s:%s", WEBAPP_HOST, WEBAPP_PORT)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
+
+async def run_webhook(dp, bot, app=None):
+    """سرور webhook را اجرا می‌کند و تا لغو شدن (Ctrl+C) منتظر می‌ماند"""
+    app = app or create_app(dp, bot)
+    await set_webhook(bot, dp.resolve_used_update_types())
+    try:
+        await serve(app)
+    finally:
+        await bot.session.close()